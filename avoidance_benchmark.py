@@ -0,0 +1,54 @@
+import random
+import time
+
+import numpy
+from tqdm import tqdm
+
+import constants
+from models import MovingObstacle
+from obstacle_avoidance import RolloutObstacleAvoidance
+
+N_PLANS = 200
+OBSTACLE_COUNTS = (10, 30, 100, 300, 1000, 3000)
+
+
+def generate_situation(n_obstacles):
+    obstacles = [MovingObstacle.create_randomized() for _ in range(n_obstacles)]
+    positions = numpy.array([(ob.x, ob.y) for ob in obstacles])
+    velocities = numpy.array([(ob.vx, ob.vy) for ob in obstacles])
+    robot_position = (random.uniform(constants.WINDOW_CORNERS[0], constants.WINDOW_CORNERS[2]),
+                      random.uniform(constants.WINDOW_CORNERS[1], constants.WINDOW_CORNERS[3]))
+    ball_position = numpy.array([[random.uniform(constants.WINDOW_CORNERS[0], constants.WINDOW_CORNERS[2]),
+                                  random.uniform(constants.WINDOW_CORNERS[1], constants.WINDOW_CORNERS[3])]])
+    robot_angle = random.uniform(-numpy.pi, numpy.pi)
+    return robot_position, ball_position, positions, velocities, robot_angle
+
+
+def main():
+    planner = RolloutObstacleAvoidance()
+    time_per_plan = {}
+
+    for n_obstacles in OBSTACLE_COUNTS:
+        print(f"Benchmarking planning with {n_obstacles} obstacles...")
+        time_per_plan[n_obstacles] = []
+        for _ in tqdm(range(N_PLANS)):
+            robot_position, ball_position, positions, velocities, robot_angle = generate_situation(n_obstacles)
+            start_time = time.perf_counter()
+            planner(robot_position, ball_position, positions,
+                    obstacles_predicted_velocities=velocities, robot_angle=robot_angle)
+            time_per_plan[n_obstacles].append(time.perf_counter() - start_time)
+
+    with open('obstacle_avoidance_benchmark.txt', 'w') as result_file:
+        template = '{:^12}|{:^12}|{:^12}|{:^12}\n'
+        result_file.write(f"Time budget per plan: {planner.time_budget * 1000}ms\n")
+        result_file.write(template.format('obstacles', 'mean, ms', 'p50, ms', 'p99, ms'))
+        for n_obstacles in OBSTACLE_COUNTS:
+            times = numpy.array(time_per_plan[n_obstacles]) * 1000
+            result_file.write(template.format(
+                n_obstacles, round(times.mean(), 3), round(numpy.percentile(times, 50), 3),
+                round(numpy.percentile(times, 99), 3)
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import multiprocessing
+import queue
+from multiprocessing import shared_memory
+
+import cv2
+import numpy
+
+import constants
+from obstacle_detection.obstacle_utils import BatchForward
+from obstacle_detection.registry import DETECTORS
+
+FRAME_SHAPE = (constants.WINDOW_HEIGHT, constants.WINDOW_WIDTH, 3)
+
+
+def _ring(shm: shared_memory.SharedMemory, slots: int) -> numpy.ndarray:
+    return numpy.ndarray((slots, *FRAME_SHAPE), dtype=numpy.uint8, buffer=shm.buf)
+
+
+def _detect(detectors, frames, reference_color):
+    """Detections of every frame by its client's detector, one `forward_batch` call for stateless detectors."""
+    if isinstance(detectors[0], BatchForward) and len(frames) > 1:
+        # Without state any client's detector serves all of them
+        positions, valid = detectors[0].forward_batch(numpy.stack(frames), reference_color)
+        return [[p[i][v[i]] for p, v in zip(positions, valid)] for i in range(len(frames))]
+    return [detector.forward(frame, reference_color) for detector, frame in zip(detectors, frames)]
+
+
+def _answer(requests, detectors, rings, slots, responses):
+    # Requests with the same reference colors are detected together
+    groups = {}
+    for request in requests:
+        groups.setdefault(repr(request[2]), []).append(request)
+    for group in groups.values():
+        try:
+            results = _detect(
+                [detectors[client] for client, _, _ in group],
+                [rings[client][sequence % slots] for client, sequence, _ in group], group[0][2]
+            )
+            errors = [None] * len(group)
+        except Exception as error:
+            # Clients re-raise it instead of waiting for a result that never comes
+            results, errors = [None] * len(group), [error] * len(group)
+        for (client, sequence, _), result, error in zip(group, results, errors):
+            responses[client].put((sequence, result, error))
+
+
+def _service_worker(detector_name, ring_names, slots, max_batch, requests, responses):
+    # Parallelism comes from the service processes, OpenCV threads would only oversubscribe the cores
+    cv2.setNumThreads(1)
+    # Every client gets its own detector, so trackers only ever see the frames of one simulation
+    detectors = {}
+    memories = [shared_memory.SharedMemory(name=name) for name in ring_names]
+    rings = [_ring(memory, slots) for memory in memories]
+    running = True
+    while running:
+        # Take whatever is queued, from any of this worker's clients, up to max_batch requests
+        batch = [requests.get()]
+        while len(batch) < max_batch:
+            try:
+                batch.append(requests.get_nowait())
+            except queue.Empty:
+                break
+        if None in batch:
+            running = False
+            batch = [request for request in batch if request is not None]
+
+        frames = []
+        for client, sequence, reference_color in batch:
+            if client not in detectors:
+                detectors[client] = DETECTORS[detector_name]()
+            if sequence is not None:
+                frames.append((client, sequence, reference_color))
+                continue
+            # A reset request, frames sent before it are detected before it
+            _answer(frames, detectors, rings, slots, responses)
+            frames = []
+            if hasattr(detectors[client], 'reset'):
+                detectors[client].reset()
+        _answer(frames, detectors, rings, slots, responses)
+
+    for detector in detectors.values():
+        if hasattr(detector, 'close'):
+            detector.close()
+    del rings
+    for memory in memories:
+        memory.close()
+
+
+class DetectionService:
+    """Pool of detector processes shared by many simulations.
+
+    Every client owns a ring of `slots` frames in shared memory and is served
+    by one worker, which keeps a detector per client. Frames of a client are
+    therefore detected in order by its own detector, and `reset()` of the
+    client resets it, so tracks never mix frames of different simulations. A
+    request only carries the client, the slot and the reference colors; workers
+    read the frame in place and take up to `max_batch` queued requests, from
+    any of their clients, per queue round trip. Frames of those requests with
+    the same reference colors go through one `forward_batch` call when the
+    detector is a stateless `BatchForward`. Results come back as the detector's
+    `[ball_positions, obstacle_positions]`, errors are raised by the client.
+
+    Clients come from `client(i)` and are inherited by processes started
+    afterwards, e.g. through pool initializer arguments.
+    """
+
+    def __init__(self, detector_name: str = 'MSER', workers: int = 2, clients: int = 1, slots: int = 2,
+                 max_batch: int = 8):
+        assert detector_name in DETECTORS, f"Unknown detector {detector_name}"
+        self.detector_name = detector_name
+        self.slots = slots
+        frame_size = int(numpy.prod(FRAME_SHAPE))
+        self._memories = [shared_memory.SharedMemory(create=True, size=slots * frame_size) for _ in range(clients)]
+        self._requests = [multiprocessing.Queue() for _ in range(workers)]
+        self._responses = [multiprocessing.Queue() for _ in range(clients)]
+        self._workers = [
+            multiprocessing.Process(
+                target=_service_worker, daemon=True,
+                args=(detector_name, [memory.name for memory in self._memories], slots, max_batch,
+                      requests, self._responses)
+            ) for requests in self._requests
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def client(self, i: int) -> 'DetectionClient':
+        # Clients are spread over the workers round robin
+        return DetectionClient(
+            i, self._memories[i].name, self.slots, self.detector_name, self._requests[i % len(self._requests)],
+            self._responses[i]
+        )
+
+    def clients(self):
+        return [self.client(i) for i in range(len(self._memories))]
+
+    def close(self):
+        for requests in self._requests:
+            requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        for memory in self._memories:
+            memory.close()
+            memory.unlink()
+
+
+class DetectionClient:
+    """Drop-in detector that hands frames to a `DetectionService`.
+
+    `forward` blocks for the result. `submit` and `result` keep up to `slots`
+    frames in flight. Drawing straight into `next_frame()` skips the one copy
+    into shared memory.
+    """
+
+    def __init__(self, index, ring_name, slots, detector_name, requests, responses):
+        self.index = index
+        self.ring_name = ring_name
+        self.slots = slots
+        self.name = detector_name
+        self._requests = requests
+        self._responses = responses
+        self._memory = None
+        self._ring = None
+        self._sequence = 0
+        self._pending = set()
+        self._results = {}
+
+    def _frames(self) -> numpy.ndarray:
+        # Attached on first use, so the client can be handed to another process first
+        if self._ring is None:
+            self._memory = shared_memory.SharedMemory(name=self.ring_name)
+            self._ring = _ring(self._memory, self.slots)
+        return self._ring
+
+    def next_frame(self) -> numpy.ndarray:
+        """Shared-memory slot the next `submit` will send, free to draw into."""
+        if self._sequence >= self.slots:
+            # The slot is about to be overwritten, its previous request has to be done with it
+            self._wait(self._sequence - self.slots)
+        return self._frames()[self._sequence % self.slots]
+
+    def submit(self, image: numpy.ndarray, reference_color) -> int:
+        """Sends a frame to the service and returns its ticket for `result`."""
+        sequence = self._sequence
+        slot = self.next_frame()
+        if not numpy.shares_memory(image, slot):
+            slot[...] = image
+        self._requests.put((self.index, sequence, reference_color))
+        self._pending.add(sequence)
+        self._sequence += 1
+        return sequence
+
+    def _wait(self, sequence: int):
+        while sequence in self._pending:
+            done, result, error = self._responses.get()
+            self._pending.discard(done)
+            self._results[done] = result, error
+
+    def result(self, sequence: int):
+        self._wait(sequence)
+        result, error = self._results.pop(sequence)
+        if error is not None:
+            raise error
+        return result
+
+    def reset(self):
+        """Resets the client's detector once the frames submitted so far are detected."""
+        self._requests.put((self.index, None, None))
+
+    def forward(self, image: numpy.ndarray, reference_color):
+        return self.result(self.submit(image, reference_color))
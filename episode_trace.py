@@ -0,0 +1,254 @@
+import glob
+import json
+import os
+
+import numpy
+
+import constants
+from models import Robot, Ball, MovingObstacle, ObstacleField
+from recording import RawFrameWriter, read_raw_frames
+from rendering import SceneRenderer
+from utils import cast_detector_coordinates
+
+# Columns with one row per step, ragged columns have a row per detection and a count per step
+STEP_COLUMNS = ('time', 'detected', 'detection_time', 'detection_latency', 'planned', 'controlled', 'robot', 'wheels',
+                'controller', 'target', 'ball', 'obstacles', 'ball_counts', 'obstacle_counts')
+RAGGED_COLUMNS = {
+    'ball_detections': 'ball_counts',
+    'obstacle_detections': 'obstacle_counts',
+    'obstacle_velocities': 'obstacle_counts',
+}
+
+
+def _ran_now(clock, now: float) -> bool:
+    return clock.last_time is not None and clock.last_time == now
+
+
+class TraceRecorder:
+    """Streams per-step state of a `Simulation` into a trace directory.
+
+    Each step records the state the stages acted on: robot pose, wheel
+    velocities, controller state, planner target, ball and obstacle states and
+    the current detector outputs with the time of the frame they came from and
+    the detection latency the planner was given.
+    `detected` marks the steps a detection was applied in. Steps are kept in
+    memory only until `chunk_steps` of them are collected, then written as one
+    `.npz` chunk. With `frames=True` the frames of the applied detections are
+    appended to a raw memory-mapped file as well.
+
+    Pass it in `Simulation(recorders=...)`; `close()` writes the episode summary.
+    """
+
+    def __init__(self, path: str, chunk_steps: int = 512, frames: bool = False):
+        os.makedirs(path, exist_ok=True)
+        for stale in glob.glob(os.path.join(path, 'chunk_*.npz')):
+            os.remove(stale)
+        self.path = path
+        self.chunk_steps = chunk_steps
+        self.frames = RawFrameWriter(os.path.join(path, 'frames.raw')) if frames else None
+        self.steps = 0
+        self._chunks = 0
+        self._columns = {name: [] for name in (*STEP_COLUMNS, *RAGGED_COLUMNS)}
+        self._simulation = None
+
+    def record(self, simulation, frame: numpy.ndarray = None):
+        """Records the current step, `frame` is the one whose detection was applied in it."""
+        self._simulation = simulation
+        robot = simulation.robot
+        columns = self._columns
+        columns['time'].append(simulation.time)
+        columns['detected'].append(frame is not None)
+        columns['detection_time'].append(numpy.nan if simulation.detection_time is None else simulation.detection_time)
+        columns['detection_latency'].append(simulation.detection_latency)
+        columns['planned'].append(_ran_now(simulation.clocks['plan'], simulation.time))
+        columns['controlled'].append(_ran_now(simulation.clocks['control'], simulation.time))
+        columns['robot'].append((robot.x, robot.y, robot.angle))
+        columns['wheels'].append((robot.wheels[0].velocity, robot.wheels[1].velocity))
+        columns['controller'].append(simulation.controller_state or (numpy.nan,) * 3)
+        columns['target'].append(simulation.target if simulation.target is not None else (numpy.nan,) * 2)
+        ball = simulation.ball
+        columns['ball'].append((ball.x, ball.y, ball.vx, ball.vy))
+        obstacles = simulation.obstacles
+        columns['obstacles'].append(numpy.stack((obstacles.x, obstacles.y, obstacles.vx, obstacles.vy), axis=-1))
+
+        balls = numpy.asarray(simulation.ball_predicted_positions, dtype=numpy.float64).reshape(-1, 2)
+        barriers = numpy.asarray(simulation.barriers_predicted_positions, dtype=numpy.float64).reshape(-1, 2)
+        velocities = simulation.barriers_predicted_velocities
+        if velocities is None or len(velocities) != len(barriers):
+            velocities = numpy.full_like(barriers, numpy.nan)
+        columns['ball_counts'].append(len(balls))
+        columns['obstacle_counts'].append(len(barriers))
+        columns['ball_detections'].append(balls)
+        columns['obstacle_detections'].append(barriers)
+        columns['obstacle_velocities'].append(numpy.asarray(velocities, dtype=numpy.float64).reshape(-1, 2))
+
+        if frame is not None and self.frames is not None:
+            self.frames.write(frame)
+
+        self.steps += 1
+        if len(columns['time']) >= self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        columns = self._columns
+        if not columns['time']:
+            return
+        arrays = {name: numpy.array(columns[name]) for name in STEP_COLUMNS}
+        for name in RAGGED_COLUMNS:
+            arrays[name] = numpy.concatenate(columns[name]).reshape(-1, 2)
+        numpy.savez(os.path.join(self.path, f'chunk_{self._chunks:05d}.npz'), **arrays)
+        self._chunks += 1
+        for values in columns.values():
+            values.clear()
+
+    def close(self):
+        self.flush()
+        if self.frames is not None:
+            self.frames.release()
+        simulation = self._simulation
+        meta = {'steps': self.steps, 'chunks': self._chunks, 'frames': self.frames is not None}
+        if simulation is not None:
+            meta.update({
+                'status': simulation.status,
+                'seed': simulation.seed,
+                'obstacles_count': simulation.obstacles_count,
+                'detector': getattr(simulation.obstacle_detection, 'name', None),
+                'rates': {stage: clock.rate for stage, clock in simulation.clocks.items()},
+            })
+        with open(os.path.join(self.path, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+
+class Trace:
+    """A recorded episode loaded back from a trace directory, columns are arrays with a row per step.
+
+    Chunk files are closed once loaded, `close()` (or leaving a `with` block)
+    drops the trace's memory map of the recorded frames.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            self.meta = json.load(meta_file)
+
+        columns = {name: [] for name in (*STEP_COLUMNS, *RAGGED_COLUMNS)}
+        for chunk_path in sorted(glob.glob(os.path.join(path, 'chunk_*.npz'))):
+            with numpy.load(chunk_path) as chunk:
+                for name, values in columns.items():
+                    values.append(chunk[name])
+        self.columns = {
+            name: numpy.concatenate(values) if values else numpy.empty(0) for name, values in columns.items()
+        }
+        self._frames = None
+        self._offsets = {
+            counts: numpy.concatenate([[0], numpy.cumsum(self.columns[counts])]).astype(numpy.int64)
+            for counts in set(RAGGED_COLUMNS.values())
+        }
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def __getitem__(self, name: str) -> numpy.ndarray:
+        return self.columns[name]
+
+    def ragged(self, name: str, step: int) -> numpy.ndarray:
+        """Rows of a ragged column recorded at `step`."""
+        offsets = self._offsets[RAGGED_COLUMNS[name]]
+        return self.columns[name][offsets[step]:offsets[step + 1]]
+
+    def frames(self) -> numpy.ndarray:
+        """Recorded detector frames, one per step with `detected` set."""
+        if self._frames is None:
+            self._frames = read_raw_frames(os.path.join(self.path, 'frames.raw'))
+        return self._frames
+
+    def close(self):
+        self._frames = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def rendered_frames(trace: Trace):
+    """Yields (step, frame) for every detection step, re-drawing the world from the recorded states.
+
+    The frame is drawn from the states of the step at the detection's frame
+    time, an earlier one with pipelined detection.
+    """
+    scene = SceneRenderer()
+    robot = Robot(constants.x_start, constants.y_start, constants.theta_start)
+    ball = Ball(0., 0., 0., 0.)
+    obstacles = ObstacleField.from_obstacles(
+        [MovingObstacle(0., 0., 0., 0.) for _ in range(trace['obstacles'].shape[1])]
+    )
+
+    detected = numpy.flatnonzero(trace['detected'])
+    drawn_at = dict(zip(numpy.searchsorted(trace['time'], trace['detection_time'][detected]).tolist(), detected))
+    for step in range(len(trace)):
+        x, y, angle = trace['robot'][step]
+        robot.set_angle(angle)
+        if step:
+            # The trail holds every pose after the first move
+            robot.set_pos(x, y)
+        ball.set_pos(*trace['ball'][step][:2])
+        obstacles.x[:], obstacles.y[:] = trace['obstacles'][step][:, 0], trace['obstacles'][step][:, 1]
+        if step in drawn_at:
+            yield drawn_at[step], scene.draw_world(robot, ball, obstacles)
+
+
+def replay_detection(trace: Trace, obstacle_detection, use_recorded_frames: bool = None):
+    """Re-runs a detector over the detection steps of a trace.
+
+    Frames come from the trace when it has them, otherwise they are re-drawn
+    from the recorded states. Returns the new outputs per detection step and the
+    largest difference from the recorded outputs (inf when the counts differ).
+    """
+    if use_recorded_frames is None:
+        use_recorded_frames = trace.meta['frames']
+    steps = numpy.flatnonzero(trace['detected'])
+    frames = zip(steps, trace.frames()) if use_recorded_frames else rendered_frames(trace)
+    reference_color = [(constants.Color.RED, 1), (constants.Color.LIGHTBLUE, trace['obstacles'].shape[1])]
+
+    if hasattr(obstacle_detection, 'reset'):
+        obstacle_detection.reset()
+    outputs = {}
+    max_error = 0.
+    previous_time = None
+    for step, frame in frames:
+        frame_time = trace['detection_time'][step]
+        if hasattr(obstacle_detection, 'dt') and previous_time is not None:
+            # Trackers predict over the time between frames, as the simulation told them
+            obstacle_detection.dt = frame_time - previous_time
+        previous_time = frame_time
+        ball_predicted_positions, barriers_predicted_positions = obstacle_detection.forward(frame, reference_color)
+        balls = cast_detector_coordinates(ball_predicted_positions)
+        barriers = cast_detector_coordinates(barriers_predicted_positions)
+        outputs[int(step)] = balls, barriers
+        for new, name in ((balls, 'ball_detections'), (barriers, 'obstacle_detections')):
+            recorded = trace.ragged(name, step)
+            if len(new) != len(recorded):
+                max_error = numpy.inf
+            elif len(new):
+                max_error = max(max_error, float(numpy.abs(new - recorded).max()))
+    return outputs, max_error
+
+
+def replay_planning(trace: Trace, obstacle_avoidance):
+    """Re-runs a planner on the recorded inputs of every planning step.
+
+    Returns the steps, the new targets and their distances to the recorded targets.
+    """
+    steps = numpy.flatnonzero(trace['planned'])
+    targets = numpy.empty((len(steps), 2))
+    for i, step in enumerate(steps):
+        x, y, angle = trace['robot'][step]
+        velocities = trace.ragged('obstacle_velocities', step)
+        targets[i] = obstacle_avoidance(
+            (x, y), trace.ragged('ball_detections', step), trace.ragged('obstacle_detections', step),
+            obstacles_predicted_velocities=None if numpy.isnan(velocities).any() else velocities,
+            robot_angle=angle, detection_latency=trace['detection_latency'][step]
+        )
+    return steps, targets, numpy.hypot(*(targets - trace['target'][steps]).T)
@@ -3,9 +3,12 @@ import logging
 import random
 
 import cv2
+import numpy
 
 import constants
 from constants import Color
+from spatial import UniformGrid
+from world_model import DistanceField
 
 
 class Drawable:
@@ -37,18 +40,174 @@ class Drawable:
         pass
 
 
-class MovingObstacle(Drawable):
+class ObstacleField:
+    """Struct-of-arrays state of many moving obstacles.
+
+    Positions and velocities of all obstacles live in NumPy arrays so that the
+    whole field is advanced and queried in single vectorized calls.
+    `MovingObstacle` objects are views into a row of a field.
+    """
+
     RADIUS = constants.UNITS_RADIUS
+    # Upper bound of impulse passes per step, they stop as soon as every contact is resolved
+    COLLISION_PASSES = 16
+
+    def __init__(self, x, y, vx, vy, copy: bool = True):
+        convert = numpy.array if copy else numpy.asarray
+        self.x = convert(x, dtype=numpy.float64)
+        self.y = convert(y, dtype=numpy.float64)
+        self.vx = convert(vx, dtype=numpy.float64)
+        self.vy = convert(vy, dtype=numpy.float64)
+        self._views = []
+
+    @classmethod
+    def from_obstacles(cls, obstacles):
+        obstacles = list(obstacles)
+        field = cls(
+            [o.x for o in obstacles], [o.y for o in obstacles],
+            [o.vx for o in obstacles], [o.vy for o in obstacles]
+        )
+        for i, obstacle in enumerate(obstacles):
+            obstacle.bind(field, i)
+        field._views = obstacles
+        return field
+
+    def rows(self, start: int, stop: int, kind=None):
+        """Field over rows `start:stop` sharing the arrays of this one, with views of `kind` (MovingObstacle)."""
+        kind = kind or MovingObstacle
+        field = ObstacleField(self.x[start:stop], self.y[start:stop], self.vx[start:stop], self.vy[start:stop],
+                              copy=False)
+        field._views = [kind(0., 0., 0., 0.) for _ in range(stop - start)]
+        for i, view in enumerate(field._views):
+            view.bind(field, i)
+        return field
+
+    def __len__(self):
+        return len(self.x)
+
+    def __iter__(self):
+        return iter(self._views)
+
+    def __getitem__(self, i):
+        return self._views[i]
+
+    def get_positions(self):
+        return numpy.stack((self.x, self.y), axis=-1)
+
+    def advance(self, dt):
+        low_x = constants.WINDOW_CORNERS[0] + self.RADIUS
+        high_x = constants.WINDOW_CORNERS[2] - self.RADIUS
+        low_y = constants.WINDOW_CORNERS[1] + self.RADIUS
+        high_y = constants.WINDOW_CORNERS[3] - self.RADIUS
+
+        self.x += self.vx * dt
+        numpy.negative(self.vx, out=self.vx, where=(self.x < low_x) | (self.x > high_x))
+
+        self.y += self.vy * dt
+        numpy.negative(self.vy, out=self.vy, where=(self.y < low_y) | (self.y > high_y))
+
+    def collide(self):
+        """Elastic collisions between touching obstacles of equal mass, returns the number of contacts.
+
+        Contacts are found through a uniform grid with cells of one obstacle
+        diameter, so the cost grows with the obstacle count rather than its square.
+        Impulses along the contact normals reverse the approach speed of every
+        touching pair, which for a lone pair swaps the normal components of the two
+        velocities. Overlapping pairs are pushed apart.
+        """
+        positions = self.get_positions()
+        first, second = UniformGrid(positions, 2 * self.RADIUS).pairs(2 * self.RADIUS)
+        if len(first) == 0:
+            return 0
+
+        normals = positions[second] - positions[first]
+        distances = numpy.sqrt(numpy.einsum('ij,ij->i', normals, normals))
+        # Obstacles in the very same place have no contact normal, they are separated along x
+        normals = numpy.where(distances[:, None] > 0, normals / numpy.maximum(distances, 1e-12)[:, None], [1., 0.])
+
+        def relative_speeds():
+            return (self.vx[second] - self.vx[first]) * normals[:, 0] + \
+                (self.vy[second] - self.vy[first]) * normals[:, 1]
+
+        # Approaching pairs bounce back with their approach speed, the rest only must not approach.
+        # Bodies in several contacts at once share impulses between them, repeated passes settle the rest.
+        target_speeds = numpy.maximum(-relative_speeds(), 0.)
+        contacts = numpy.bincount(first, minlength=len(self)) + numpy.bincount(second, minlength=len(self))
+        share = 1. / numpy.maximum(contacts[first], contacts[second])
+        for _ in range(self.COLLISION_PASSES):
+            deficits = numpy.minimum(relative_speeds() - target_speeds, 0.)
+            if deficits.min() > -1e-9:
+                break
+            impulses = (share * deficits / 2)[:, None] * normals
+            for velocities, deltas in ((self.vx, impulses[:, 0]), (self.vy, impulses[:, 1])):
+                numpy.add.at(velocities, first, deltas)
+                numpy.add.at(velocities, second, -deltas)
+
+        pushes = (share * (2 * self.RADIUS - distances) / 2)[:, None] * normals
+        for coordinates, deltas in ((self.x, pushes[:, 0]), (self.y, pushes[:, 1])):
+            numpy.add.at(coordinates, first, -deltas)
+            numpy.add.at(coordinates, second, deltas)
+        return len(first)
+
+    def clearances(self, x, y, radius):
+        # Distance between the closest touching points of a circular body and every circular obstacle
+        return numpy.hypot(self.x - x, self.y - y) - self.RADIUS - radius
+
+
+class MovingObstacle(Drawable):
+    RADIUS = ObstacleField.RADIUS
     VELOCITY_RANGE = constants.OBSTACLE_VELOCITY_RANGE
 
     SCREEN_RADIUS = int(RADIUS * constants.k)
     COLOR = Color.LIGHTBLUE
 
     def __init__(self, x, y, vx, vy):
+        self.bind(ObstacleField([x], [y], [vx], [vy]), 0)
         super().__init__(x, y)
 
-        self._vx = vx
-        self._vy = vy
+    def bind(self, field, index):
+        self._field = field
+        self._index = index
+
+    @property
+    def _x(self):
+        return self._field.x[self._index]
+
+    @_x.setter
+    def _x(self, value):
+        self._field.x[self._index] = value
+
+    @property
+    def _y(self):
+        return self._field.y[self._index]
+
+    @_y.setter
+    def _y(self, value):
+        self._field.y[self._index] = value
+
+    @property
+    def _vx(self):
+        return self._field.vx[self._index]
+
+    @_vx.setter
+    def _vx(self, value):
+        self._field.vx[self._index] = value
+
+    @property
+    def _vy(self):
+        return self._field.vy[self._index]
+
+    @_vy.setter
+    def _vy(self, value):
+        self._field.vy[self._index] = value
+
+    @property
+    def vx(self):
+        return self._vx
+
+    @property
+    def vy(self):
+        return self._vy
 
     @classmethod
     def create_randomized(cls):
@@ -82,10 +241,10 @@ class Ball(MovingObstacle):
     COLOR = Color.RED
 
     @classmethod
-    def create_randomized(cls):
-        assert constants.RANDOM_SEED != 0, "Value 0 for random seed is not allowed. If no seed needed, set None"
-        if constants.RANDOM_SEED is not None:
-            random.seed(constants.RANDOM_SEED)
+    def create_randomized(cls, seed=constants.RANDOM_SEED):
+        assert seed != 0, "Value 0 for random seed is not allowed. If no seed needed, set None"
+        if seed is not None:
+            random.seed(seed)
 
         x = constants.WINDOW_CORNERS[2]-1
         y = constants.WINDOW_CORNERS[3]-1
@@ -142,6 +301,28 @@ class Wheel(Drawable):
         cv2.circle(screen, pos, self.SCREEN_RADIUS, self.COLOR, thickness=2)
 
 
+def move_poses(x, y, theta, vel_left, vel_right, dt, width=constants.UNITS_RADIUS * 2):
+    """Robot.move for arrays of poses and wheel velocities, returns the new x, y and theta arrays."""
+    vl_rounded = numpy.round(vel_left, 3)
+    vr_rounded = numpy.round(vel_right, 3)
+    straight = vl_rounded == vr_rounded
+    arc = ~straight & (vl_rounded != -vr_rounded)
+
+    delta_theta = (vel_right - vel_left) * dt / width
+    # Pure rotation is an arc of zero radius
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        _r = numpy.where(arc, width / 2.0 * (vel_right + vel_left) / (vel_right - vel_left), 0.)
+    theta_new = theta + delta_theta
+
+    x_new = numpy.where(
+        straight, x + vel_left * dt * numpy.cos(theta), x + _r * (numpy.sin(theta_new) - numpy.sin(theta))
+    )
+    y_new = numpy.where(
+        straight, y + vel_right * dt * numpy.sin(theta), y - _r * (numpy.cos(theta_new) - numpy.cos(theta))
+    )
+    return x_new, y_new, numpy.where(straight, theta, theta_new)
+
+
 class Robot(Drawable):
     RADIUS = constants.UNITS_RADIUS
     WIDTH = constants.UNITS_RADIUS * 2
@@ -191,7 +372,10 @@ class Robot(Drawable):
         vel_left = self.wheels[0].velocity
         vel_right = self.wheels[1].velocity
 
-        logging.info(f'Moving robot: origin=({self._x}, {self._y}, {self._angle}), vel=({vel_left}, {vel_right})')
+        # Arguments are only formatted when INFO is enabled
+        logging.info(
+            'Moving robot: origin=(%s, %s, %s), vel=(%s, %s)', self._x, self._y, self._angle, vel_left, vel_right
+        )
 
         if round(vel_left, 3) == round(vel_right, 3):  # Straight line motion
             x_new = self._x + vel_left * dt * math.cos(self._angle)
@@ -223,6 +407,14 @@ class Robot(Drawable):
 
     def get_closest_dist_to_obstacle(self, obstacles):
         closest_dist = 100000.0
+        if isinstance(obstacles, ObstacleField):
+            if len(obstacles) == 0:
+                return closest_dist
+            return float(obstacles.clearances(self._x, self._y, Robot.RADIUS).min())
+        if isinstance(obstacles, DistanceField):
+            # Distances further than the field's max_distance read as max_distance
+            return float(obstacles.clearance(self._x, self._y, Robot.RADIUS))
+
         for i, player in enumerate(obstacles):
             p_x, p_y = player.get_pos()
 
@@ -241,3 +433,39 @@ class Robot(Drawable):
     def get_dist_to_target(self, target):
         target_x, target_y = target.get_pos()
         return math.sqrt((self._x - target_x) ** 2 + (self._y - target_y) ** 2)
+
+
+class RobotTeam:
+    """Struct-of-arrays state of many robots, see `ObstacleField`.
+
+    Poses and wheel velocities of all robots live in NumPy arrays and are moved
+    with one `move_poses` call per step. `team` holds the team index of every robot.
+    """
+
+    RADIUS = Robot.RADIUS
+
+    def __init__(self, x, y, angle, team=None):
+        self.x = numpy.array(x, dtype=numpy.float64)
+        self.y = numpy.array(y, dtype=numpy.float64)
+        self.angle = numpy.array(angle, dtype=numpy.float64)
+        self.team = numpy.zeros(len(self.x), dtype=numpy.int64) if team is None else numpy.array(team)
+        self.vel_left = numpy.zeros(len(self.x))
+        self.vel_right = numpy.zeros(len(self.x))
+
+    def __len__(self):
+        return len(self.x)
+
+    def get_positions(self):
+        return numpy.stack((self.x, self.y), axis=-1)
+
+    def set_velocities(self, vel_left, vel_right):
+        self.vel_left[:] = vel_left
+        self.vel_right[:] = vel_right
+
+    def move(self, dt):
+        self.x, self.y, self.angle = move_poses(self.x, self.y, self.angle, self.vel_left, self.vel_right, dt)
+
+    def touching(self, distance=0.):
+        """Pairs of robots whose bodies are closer than `distance`."""
+        reach = 2 * self.RADIUS + distance
+        return UniformGrid(self.get_positions(), reach).pairs(reach)
@@ -0,0 +1,136 @@
+import csv
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy
+from tqdm import tqdm
+
+import constants
+from obstacle_avoidance import dump_obstacle_avoidance
+from obstacle_detection.registry import DETECTORS
+from simulation import TIMEOUT, Simulation
+
+N_EPISODES = 1000
+DT = 0.1
+MAX_STEPS = 3000
+PERCENTILES = (5, 25, 50, 75, 95, 99)
+
+_worker_simulation_args = None
+
+
+def episode_seed(base_seed, episode):
+    """Seed of episode `episode`, drawn from its own child of `numpy.random.SeedSequence(base_seed)`.
+
+    Obstacle `k` of an episode is seeded with `seed * (k + 1)`, so neighbouring
+    seeds like `base_seed + episode` would share obstacles between episodes.
+    Random 62-bit seeds practically never do.
+    """
+    state = numpy.random.SeedSequence(base_seed, spawn_key=(episode,)).generate_state(2)
+    # Value 0 is reserved, see Ball.create_randomized
+    return (int(state[0]) << 30 | int(state[1]) >> 2) or 1
+
+
+def _init_worker(detector_name, obstacle_avoidance, obstacles_count, detection_clients=None, claimed_clients=None):
+    global _worker_simulation_args
+    # Parallelism comes from the pool, OpenCV threads would only oversubscribe the cores
+    cv2.setNumThreads(1)
+    if detection_clients is None:
+        obstacle_detection = DETECTORS[detector_name]()
+    else:
+        with claimed_clients.get_lock():
+            obstacle_detection = detection_clients[claimed_clients.value]
+            claimed_clients.value += 1
+    _worker_simulation_args = (obstacle_detection, obstacle_avoidance, obstacles_count)
+
+
+def _run_worker_episode(args):
+    seed, dt, max_steps = args
+    obstacle_detection, obstacle_avoidance, obstacles_count = _worker_simulation_args
+    return run_episode(seed, obstacle_detection, obstacle_avoidance, obstacles_count, dt, max_steps)
+
+
+def run_episode(seed, obstacle_detection, obstacle_avoidance=dump_obstacle_avoidance,
+                obstacles_count=constants.OBSTACLES_COUNT, dt=DT, max_steps=MAX_STEPS):
+    simulation = Simulation(obstacle_detection, obstacle_avoidance, obstacles_count=obstacles_count, seed=seed)
+    status = simulation.run(dt, max_steps=max_steps)
+    return {
+        'seed': seed,
+        'status': TIMEOUT if status == Simulation.Status.RUNNING else status,
+        'steps': simulation.steps,
+        'time': simulation.time,
+    }
+
+
+def run_episodes(n_episodes, detector_name='MSER', obstacle_avoidance=dump_obstacle_avoidance,
+                 obstacles_count=constants.OBSTACLES_COUNT, base_seed=constants.RANDOM_SEED,
+                 dt=DT, max_steps=MAX_STEPS, workers=None, detection_service=None):
+    """Runs `n_episodes` seeded headless episodes over a process pool.
+
+    Episode `i` is seeded with `episode_seed(base_seed, i)`, so results do not
+    depend on the number of workers or the order in which episodes finish.
+    The seed is kept in every episode's record to re-run it alone.
+
+    With a `DetectionService` the workers send their frames to it instead of
+    detecting themselves, it needs a client per worker.
+    """
+    assert base_seed is not None and base_seed > 0, 'Batch runs need a positive base seed to be reproducible'
+
+    tasks = [(episode_seed(base_seed, i), dt, max_steps) for i in range(n_episodes)]
+    workers = workers or os.cpu_count()
+    initargs = (detector_name, obstacle_avoidance, obstacles_count)
+    if detection_service is not None:
+        clients = detection_service.clients()
+        assert len(clients) >= workers, 'Every worker needs its own detection client'
+        initargs += (clients, multiprocessing.Value('i', 0))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        chunksize = max(1, n_episodes // (workers * 4))
+        return list(tqdm(executor.map(_run_worker_episode, tasks, chunksize=chunksize), total=n_episodes))
+
+
+def _percentiles(values):
+    if len(values) == 0:
+        return {f'p{p}': None for p in PERCENTILES}
+    return {f'p{p}': float(v) for p, v in zip(PERCENTILES, numpy.percentile(values, PERCENTILES))}
+
+
+def summarize(episodes):
+    statuses = numpy.array([e['status'] for e in episodes])
+    steps = numpy.array([e['steps'] for e in episodes])
+    times = numpy.array([e['time'] for e in episodes])
+    reached = statuses == Simulation.Status.REACHED
+
+    return {
+        'episodes': len(episodes),
+        'reach_rate': float(reached.mean()) if len(episodes) else None,
+        'crash_rate': float((statuses == Simulation.Status.CRASHED).mean()) if len(episodes) else None,
+        'timeout_rate': float((statuses == TIMEOUT).mean()) if len(episodes) else None,
+        'time_to_ball': _percentiles(times[reached]),
+        'steps': _percentiles(steps),
+    }
+
+
+def write_csv(episodes, path):
+    with open(path, 'w', newline='') as result_file:
+        writer = csv.DictWriter(result_file, fieldnames=['seed', 'status', 'steps', 'time'])
+        writer.writeheader()
+        writer.writerows(episodes)
+
+
+def write_json(summary, path):
+    with open(path, 'w') as result_file:
+        json.dump(summary, result_file, indent=2)
+
+
+def main():
+    for detector_name in ['MSER']:
+        print(f"Running {N_EPISODES} episodes with {detector_name} detector...")
+        episodes = run_episodes(N_EPISODES, detector_name)
+        write_csv(episodes, f'monte_carlo_{detector_name}.csv')
+        write_json(summarize(episodes), f'monte_carlo_{detector_name}.json')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,170 @@
+import math
+import time
+
+import numpy
+
 import constants
+from models import move_poses
+from spatial import UniformGrid
+from utils import move_to_dot_batch
 
 
-def dump_obstacle_avoidance(robot_position, ball_predicted_positions, obstacles_predicted_positions):
+def dump_obstacle_avoidance(robot_position, ball_predicted_positions, obstacles_predicted_positions,
+                            obstacles_predicted_velocities=None, robot_angle=None, detection_latency=None):
     return ball_predicted_positions[0]
+
+
+class RolloutObstacleAvoidance:
+    """Dynamic-window style planner over candidate dots for move_to_dot.
+
+    Every candidate dot (the ball and dots around the robot) is rolled out for
+    `time_horizon` seconds through the movement controller and the robot
+    kinematics, against obstacles extrapolated with their predicted velocities.
+    Nearby obstacles are found through a uniform grid and capped to the
+    `max_neighbors` closest, so a plan costs about the same for any obstacle count.
+    Detections `detection_latency` seconds old are first moved to the present.
+
+    Candidates are evaluated coarse first, then the finer ones in between.
+    `time_budget` (seconds per call) is a soft budget: it is only checked between
+    the two batches, so the coarse batch always runs to the end and the fine one
+    is skipped when it would not fit. A call may overrun the budget by the cost
+    of the coarse batch, `last_plan_time` reports what it actually took.
+    """
+
+    COLLISION_COST = 100.
+
+    def __init__(
+            self, time_horizon: float = 2., dt: float = 0.2, safety_margin: float = 0.1,
+            n_headings: int = 24, distances=(0.5, 1., 2.), max_neighbors: int = 32,
+            cell_size: float = 0.5, time_budget: float = 0.005
+    ):
+        self.time_horizon = time_horizon
+        self.dt = dt
+        self.safety_margin = safety_margin
+        self.n_headings = n_headings
+        self.distances = distances
+        self.max_neighbors = max_neighbors
+        self.cell_size = cell_size
+        self.time_budget = time_budget
+        self.last_plan_time = 0.
+        self.last_evaluated = 0
+
+    def _neighbors(self, robot_position, obstacles_predicted_positions, obstacles_predicted_velocities):
+        positions = numpy.asarray(obstacles_predicted_positions, dtype=numpy.float64).reshape(-1, 2)
+        if obstacles_predicted_velocities is None:
+            velocities = numpy.zeros_like(positions)
+        else:
+            velocities = numpy.asarray(obstacles_predicted_velocities, dtype=numpy.float64).reshape(-1, 2)
+
+        # Obstacles that could meet the robot within the time horizon
+        reach = (constants.ROBOT_MAX_VELOCITY + 3 * constants.OBSTACLE_VELOCITY_RANGE) * self.time_horizon + \
+            2 * constants.UNITS_RADIUS + self.safety_margin
+        indices = UniformGrid(positions, self.cell_size).query_radius(robot_position, reach)
+
+        if len(indices) > self.max_neighbors:
+            offsets = positions[indices] - robot_position
+            closest = numpy.argpartition(numpy.einsum('ij,ij->i', offsets, offsets), self.max_neighbors)
+            indices = indices[closest[:self.max_neighbors]]
+        return positions[indices], velocities[indices]
+
+    def _candidate_batches(self, robot_position, ball_position):
+        to_ball = ball_position - robot_position
+        goal_heading = math.atan2(to_ball[1], to_ball[0])
+        low = numpy.array(constants.WINDOW_CORNERS[:2]) + constants.UNITS_RADIUS
+        high = numpy.array(constants.WINDOW_CORNERS[2:]) - constants.UNITS_RADIUS
+
+        # Coarse headings first, then the ones in between
+        coarse = numpy.arange(0, self.n_headings, 2)
+        fine = numpy.arange(1, self.n_headings, 2)
+        for heading_indices in (coarse, fine):
+            headings = goal_heading + 2 * math.pi * heading_indices / self.n_headings
+            directions = numpy.stack((numpy.cos(headings), numpy.sin(headings)), axis=-1)
+            dots = robot_position + directions[:, None, :] * numpy.asarray(self.distances)[None, :, None]
+            yield numpy.clip(dots.reshape(-1, 2), low, high)
+
+    def _evaluate(self, dots, is_ball, robot_position, robot_angle, ball_position, obstacles, velocities):
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return self._rollout_costs(dots, is_ball, robot_position, robot_angle, ball_position, obstacles, velocities)
+
+    def _rollout_costs(self, dots, is_ball, robot_position, robot_angle, ball_position, obstacles, velocities):
+        n = len(dots)
+        position = numpy.repeat(robot_position[None, :], n, axis=0)
+        theta = numpy.full(n, robot_angle, dtype=numpy.float64)
+
+        min_clearance = numpy.full(n, numpy.inf)
+        collision_time = numpy.full(n, numpy.inf)
+        reached = numpy.zeros(n, dtype=bool)
+        steps = int(round(self.time_horizon / self.dt))
+        for step in range(1, steps + 1):
+            vl, vr, _, _, _ = move_to_dot_batch(
+                dots[:, 0], dots[:, 1], position[:, 0], position[:, 1],
+                numpy.where(is_ball, dots[:, 0], numpy.nan), numpy.where(is_ball, dots[:, 1], numpy.nan), theta
+            )
+            x, y, theta = move_poses(position[:, 0], position[:, 1], theta, vl, vr, self.dt)
+            position = numpy.stack((x, y), axis=-1)
+
+            predicted = obstacles + velocities * (step * self.dt)
+            if len(predicted):
+                d = position[:, None, :] - predicted[None, :, :]
+                clearance = numpy.sqrt(numpy.einsum('cnk,cnk->cn', d, d)).min(axis=1) - 2 * constants.UNITS_RADIUS
+                # Clearance after touching the ball does not matter, the episode is over by then
+                clearance = numpy.where(reached, numpy.inf, clearance)
+                min_clearance = numpy.minimum(min_clearance, clearance)
+                collision_time = numpy.where(
+                    (clearance < self.safety_margin) & numpy.isinf(collision_time), step * self.dt, collision_time
+                )
+            reached |= numpy.hypot(*(position - ball_position).T) < 2 * constants.UNITS_RADIUS
+
+        progress = numpy.hypot(*(position - ball_position).T)
+        progress = numpy.where(reached, 0., progress)
+        # Earlier predicted collisions are worse, any collision is worse than no progress at all
+        penalty = numpy.where(
+            numpy.isinf(collision_time), 0.,
+            self.COLLISION_COST * (1. + self.time_horizon - numpy.minimum(collision_time, self.time_horizon))
+        )
+        return progress + penalty - 0.1 * numpy.minimum(min_clearance, 1.)
+
+    def __call__(self, robot_position, ball_predicted_positions, obstacles_predicted_positions,
+                 obstacles_predicted_velocities=None, robot_angle=None, detection_latency=None):
+        start_time = time.perf_counter()
+
+        ball_position = ball_predicted_positions[0]
+        robot_position = numpy.asarray(robot_position, dtype=numpy.float64)
+        ball = numpy.asarray(ball_position, dtype=numpy.float64)
+        if robot_angle is None:
+            # Without the heading assume the robot already faces the ball
+            robot_angle = math.atan2(ball[1] - robot_position[1], ball[0] - robot_position[0])
+
+        obstacles, velocities = self._neighbors(
+            robot_position, obstacles_predicted_positions, obstacles_predicted_velocities
+        )
+        if detection_latency:
+            obstacles = obstacles + velocities * detection_latency
+
+        # The ball goes first in the coarse batch, it wins whenever heading for it is collision free
+        best_cost, best_dot = numpy.inf, None
+        self.last_evaluated = 0
+        for batch, dots in enumerate(self._candidate_batches(robot_position, ball)):
+            batch_start_time = time.perf_counter()
+            if batch == 0:
+                dots = numpy.concatenate([ball[None, :], dots])
+            is_ball = numpy.zeros(len(dots), dtype=bool)
+            is_ball[0] = batch == 0
+            costs = self._evaluate(dots, is_ball, robot_position, robot_angle, ball, obstacles, velocities)
+            self.last_evaluated += len(dots)
+
+            if batch == 0 and costs[0] < self.COLLISION_COST:
+                break
+            i = numpy.argmin(costs)
+            if costs[i] < best_cost:
+                best_cost, best_dot = costs[i], (None if is_ball[i] else dots[i])
+
+            # Only start the next batch if one more batch of the same cost fits into the budget
+            now = time.perf_counter()
+            if now - start_time + (now - batch_start_time) > self.time_budget:
+                break
+
+        self.last_plan_time = time.perf_counter() - start_time
+        if best_dot is None:
+            return ball_position
+        return best_dot[0], best_dot[1]
@@ -0,0 +1,73 @@
+import time
+from typing import List, Tuple
+
+import numpy
+
+
+class AdaptiveScaleObstacleDetector:
+    """Picks the detection scale per frame to stay within a latency budget.
+
+    `factory(scale)` builds a detector for every scale of `scales`. Latencies
+    are tracked per scale as exponential moving averages; a scale not measured
+    yet is estimated from the closest measured one, assuming the cost grows
+    with the number of pixels. Every frame runs at the finest scale estimated
+    to fit into `budget_ms`, or the coarsest one when none does. Every
+    `probe_interval` frames the measurements of the other scales are dropped,
+    so a finer scale is tried again once the current one got faster.
+    """
+
+    def __init__(self, factory, budget_ms: float, scales=(1.0, 0.5, 0.25), smoothing: float = 0.2,
+                 probe_interval: int = 50):
+        self.scales = tuple(sorted(scales, reverse=True))
+        self.detectors = {scale: factory(scale) for scale in self.scales}
+        self.name = f'{self.detectors[self.scales[0]].name}+Adaptive'
+        self.budget_ms = budget_ms
+        self.smoothing = smoothing
+        self.probe_interval = probe_interval
+        self.reset()
+
+    def reset(self):
+        self.latencies_ms = {}
+        self.scale = self.scales[0]
+        self.frame_index = 0
+        for detector in self.detectors.values():
+            if hasattr(detector, 'reset'):
+                detector.reset()
+
+    def close(self):
+        for detector in self.detectors.values():
+            if hasattr(detector, 'close'):
+                detector.close()
+
+    def estimated_latency_ms(self, scale: float) -> float:
+        if scale in self.latencies_ms:
+            return self.latencies_ms[scale]
+        if not self.latencies_ms:
+            return 0.
+        measured = min(self.latencies_ms, key=lambda other: abs(numpy.log(other / scale)))
+        return self.latencies_ms[measured] * (scale / measured) ** 2
+
+    def _pick_scale(self) -> float:
+        for scale in self.scales:
+            if self.estimated_latency_ms(scale) <= self.budget_ms:
+                return scale
+        return self.scales[-1]
+
+    @property
+    def velocities(self):
+        return getattr(self.detectors[self.scale], 'velocities', None)
+
+    def forward(self, image: numpy.ndarray, reference_color: List[Tuple[Tuple, int]]):
+        if self.frame_index and self.frame_index % self.probe_interval == 0:
+            self.latencies_ms = {self.scale: self.latencies_ms[self.scale]}
+        self.scale = self._pick_scale()
+
+        start_time = time.perf_counter()
+        result = self.detectors[self.scale].forward(image, reference_color)
+        latency_ms = (time.perf_counter() - start_time) * 1e3
+
+        previous = self.latencies_ms.get(self.scale)
+        self.latencies_ms[self.scale] = latency_ms if previous is None else \
+            previous + self.smoothing * (latency_ms - previous)
+        self.frame_index += 1
+        return result
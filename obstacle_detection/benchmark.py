@@ -1,16 +1,31 @@
+import inspect
+import os
+import random
 import time
+from concurrent.futures import ProcessPoolExecutor
 
+import cv2
 import numpy
+from scipy.optimize import linear_sum_assignment
 from tqdm import tqdm
 
 import constants
 import utils
 from models import Ball, MovingObstacle
-from obstacle_detection.mser import MSERObstacleDetector
-from obstacle_detection.scale_based import ScaleBasedObstacleDetector
+from obstacle_detection.obstacle_utils import DETECTION_SCALE
+from obstacle_detection.registry import DETECTORS
+from recording import RawFrameWriter, read_raw_frames
 
 N_SAMPLES = 5000
 N_OBSTACLES = 10
+DETECTOR_NAMES = ('MSER', 'U-SURF', 'SIFT', 'Blob', 'MSER+Pyramid', 'MSER+Adaptive')
+# Detection scales of the accuracy/latency curve
+SCALES = (1.0, DETECTION_SCALE, 0.25)
+CACHE_DIR = 'benchmark_cache'
+CHUNK_SIZE = 50
+PERCENTILES = (50, 95, 99)
+# Distances in metres under which a matched prediction counts as a hit, the obstacle radius is 0.14
+THRESHOLDS = (0.05, 0.1, 0.2)
 
 
 def generate_sample(height, width, n_obstacles):
@@ -32,69 +47,205 @@ def l2_to_metric(l2):
     return 1. / (l2 + 1)
 
 
+def match_obstacles(true_obstacles, predicted_obstacles):
+    """Distances of optimally matched pairs of true and predicted obstacles, unmatched ones are left out."""
+    true_obstacles = numpy.asarray(true_obstacles, dtype=numpy.float64).reshape(-1, 2)
+    predicted_obstacles = numpy.asarray(predicted_obstacles, dtype=numpy.float64).reshape(-1, 2)
+    if len(true_obstacles) == 0 or len(predicted_obstacles) == 0:
+        return numpy.empty(0)
+    offsets = predicted_obstacles[:, None, :] - true_obstacles[None, :, :]
+    distances = numpy.sqrt(numpy.einsum('ptk,ptk->pt', offsets, offsets))
+    rows, columns = linear_sum_assignment(distances)
+    return distances[rows, columns]
+
+
 def l2_obstacles(true_obstacles, predicted_obstacles):
-    used = [False for _ in true_obstacles]
-    l2 = []
-    for obs in predicted_obstacles:
-        cur_l2 = [(l2_norm(obs, _o), num) for num, _o in enumerate(true_obstacles) if not used[num]]
-        min_point = min(cur_l2)
-        # print(f"{obs} -- {true_obstacles[min_point[1]]}")
-        l2.append(min_point[0])
-        used[min_point[1]] = True
-    return sum(l2)
-
-
-def main():
-    print(f"Generating {N_SAMPLES} samples...")
-    samples = [
-        generate_sample(constants.WINDOW_HEIGHT, constants.WINDOW_WIDTH, N_OBSTACLES) for _ in tqdm(range(N_SAMPLES))
+    return float(match_obstacles(true_obstacles, predicted_obstacles).sum())
+
+
+def hits(matched_distances, thresholds=THRESHOLDS):
+    """Matched pairs closer than every threshold, divide by the predicted (true) count for precision (recall)."""
+    return (numpy.asarray(matched_distances)[None, :] <= numpy.asarray(thresholds)[:, None]).sum(axis=1)
+
+
+def dataset_path(n_samples=N_SAMPLES, n_obstacles=N_OBSTACLES, seed=constants.RANDOM_SEED, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f'samples_seed{seed}_n{n_samples}_obstacles{n_obstacles}')
+
+
+def cache_dataset(n_samples=N_SAMPLES, n_obstacles=N_OBSTACLES, seed=constants.RANDOM_SEED, cache_dir=CACHE_DIR):
+    """Generates the samples once into a raw memory-mapped frame file, ground truth goes to a `.npz` next to it.
+
+    The ground truth file is written last, so an interrupted run is regenerated next time.
+    """
+    path = dataset_path(n_samples, n_obstacles, seed, cache_dir)
+    if os.path.exists(path + '.npz'):
+        return path
+
+    print(f"Generating {n_samples} samples into {path}...")
+    os.makedirs(cache_dir, exist_ok=True)
+    random.seed(seed)
+    frames = RawFrameWriter(path + '.raw')
+    obstacles = numpy.empty((n_samples, n_obstacles, 2))
+    balls = numpy.empty((n_samples, 2))
+    for i in tqdm(range(n_samples)):
+        screen, obstacles[i], balls[i] = generate_sample(constants.WINDOW_HEIGHT, constants.WINDOW_WIDTH, n_obstacles)
+        frames.write(screen)
+    frames.release()
+
+    with open(path + '.npz.tmp', 'wb') as truth_file:
+        numpy.savez(truth_file, obstacles=obstacles, balls=balls)
+    os.replace(path + '.npz.tmp', path + '.npz')
+    return path
+
+
+def load_dataset(path):
+    truth = numpy.load(path + '.npz')
+    return read_raw_frames(path + '.raw'), truth['obstacles'], truth['balls']
+
+
+_worker_dataset = None
+_worker_detectors = {}
+
+
+def _init_worker(path):
+    global _worker_dataset
+    # Parallelism comes from the pool, OpenCV threads would only oversubscribe the cores
+    cv2.setNumThreads(1)
+    _worker_dataset = load_dataset(path)
+
+
+def _evaluate_chunk(args):
+    detector_name, scale, start, stop = args
+    if (detector_name, scale) not in _worker_detectors:
+        # Detectors are benchmarked one after another, the previous one is done
+        for previous in _worker_detectors.values():
+            if hasattr(previous, 'close'):
+                previous.close()
+        _worker_detectors.clear()
+        factory = DETECTORS[detector_name]
+        _worker_detectors[detector_name, scale] = factory() if scale is None else factory(scale=scale)
+    detector = _worker_detectors[detector_name, scale]
+    frames, true_obstacles, true_balls = _worker_dataset
+    n_obstacles = true_obstacles.shape[1]
+
+    latencies = numpy.empty(stop - start, dtype=numpy.int64)
+    l2_obstacle_values = numpy.empty(stop - start)
+    l2_ball_values = numpy.empty(stop - start)
+    # Hits per threshold, predicted and true obstacle counts
+    counts = numpy.zeros(len(THRESHOLDS) + 2, dtype=numpy.int64)
+    for i, sample in enumerate(range(start, stop)):
+        # Frames are read from the memory map outside of the timed region
+        screen = numpy.ascontiguousarray(frames[sample])
+        start_time = time.perf_counter_ns()
+        ball_predicted_positions, barriers_predicted_positions = detector.forward(
+            screen, [(constants.Color.RED, 1), (constants.Color.LIGHTBLUE, n_obstacles)]
+        )
+        latencies[i] = time.perf_counter_ns() - start_time
+        ball_predicted_positions = utils.cast_detector_coordinates(ball_predicted_positions)[0]
+        barriers_predicted_positions = utils.cast_detector_coordinates(barriers_predicted_positions)
+
+        matched = match_obstacles(true_obstacles[sample], barriers_predicted_positions)
+        l2_obstacle_values[i] = matched.sum()
+        l2_ball_values[i] = l2_norm(true_balls[sample], ball_predicted_positions)
+        counts[:-2] += hits(matched)
+        counts[-2] += len(barriers_predicted_positions)
+        counts[-1] += n_obstacles
+    return latencies, l2_obstacle_values, l2_ball_values, counts[None, :]
+
+
+def default_scale(detector_name):
+    return inspect.signature(DETECTORS[detector_name]).parameters['scale'].default
+
+
+def evaluate(executor, detector_name, n_samples, workers, scale=None):
+    """Evaluates one detector over the whole dataset, chunks of samples are spread over the pool."""
+    tasks = [
+        (detector_name, scale, start, min(start + CHUNK_SIZE, n_samples)) for start in range(0, n_samples, CHUNK_SIZE)
     ]
-    mser_detector = MSERObstacleDetector()
-    surf_detector = ScaleBasedObstacleDetector('U-SURF')
-    sift_detector = ScaleBasedObstacleDetector('SIFT')
-
-    all_l2_obstacles = {}
-    all_l2_balls = {}
-    time_per_sample = {}
-
-    for detector in [mser_detector, surf_detector, sift_detector]:
-        print(f"Benchmarking {detector.name} algorithm...")
-        all_l2_obstacles[detector.name] = []
-        all_l2_balls[detector.name] = []
-        time_per_sample[detector.name] = []
-
-        for screen, obstacles, ball in tqdm(samples):
-            start_time = time.time()
-            ball_predicted_positions, barriers_predicted_positions = detector.forward(
-                screen, [(constants.Color.RED, 1), (constants.Color.LIGHTBLUE, N_OBSTACLES)]
-            )
-            finish_time = time.time()
-            ball_predicted_positions = utils.cast_detector_coordinates(ball_predicted_positions)[0]
-            barriers_predicted_positions = utils.cast_detector_coordinates(barriers_predicted_positions)
-
-            all_l2_obstacles[detector.name].append(l2_obstacles(obstacles, barriers_predicted_positions))
-            all_l2_balls[detector.name].append(l2_norm(ball, ball_predicted_positions))
-            time_per_sample[detector.name].append(finish_time - start_time)
+    start_time = time.perf_counter()
+    chunks = list(tqdm(executor.map(_evaluate_chunk, tasks), total=len(tasks)))
+    wall_time = time.perf_counter() - start_time
+
+    latencies, l2_obstacle_values, l2_ball_values, counts = (numpy.concatenate(column) for column in zip(*chunks))
+    counts = counts.sum(axis=0)
+    latencies_ms = latencies / 1e6
+    return {
+        'latency_ms': dict(zip(PERCENTILES, numpy.percentile(latencies_ms, PERCENTILES))),
+        'mean_latency_ms': latencies_ms.mean(),
+        'std_latency_ms': latencies_ms.std(),
+        # Samples per second of the whole pool and of a single core
+        'throughput': n_samples / wall_time,
+        'core_throughput': 1e3 / latencies_ms.mean(),
+        'workers': workers,
+        'l2_obstacles': l2_obstacle_values.mean(),
+        'l2_ball': l2_ball_values.mean(),
+        'precision': dict(zip(THRESHOLDS, counts[:-2] / max(counts[-2], 1))),
+        'recall': dict(zip(THRESHOLDS, counts[:-2] / max(counts[-1], 1))),
+    }
+
+
+def main(detector_names=DETECTOR_NAMES, n_samples=N_SAMPLES, n_obstacles=N_OBSTACLES,
+         seed=constants.RANDOM_SEED, workers=None, scales=SCALES):
+    """Benchmarks every detector at its default scale, then at the other `scales` for the accuracy/latency curve."""
+    path = cache_dataset(n_samples, n_obstacles, seed)
+    workers = workers or os.cpu_count()
+
+    results = {}
+    curves = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(path,)) as executor:
+        for detector_name in detector_names:
+            print(f"Benchmarking {detector_name} algorithm...")
+            results[detector_name] = evaluate(executor, detector_name, n_samples, workers)
+            for scale in scales:
+                if scale == default_scale(detector_name):
+                    curves[detector_name, scale] = results[detector_name]
+                    continue
+                print(f"Benchmarking {detector_name} algorithm at scale {scale}...")
+                curves[detector_name, scale] = evaluate(executor, detector_name, n_samples, workers, scale)
 
     with open('obstacle_detection_benchmark.txt', 'w') as result_file:
         template = '{:^20}|{:^10}|{:^10}\n'
-        for d_name in [mser_detector.name, surf_detector.name, sift_detector.name]:
-            mean_time = round(numpy.mean(time_per_sample[d_name]), 4)
-            std_time = round(numpy.std(time_per_sample[d_name]), 4)
-            mean_l2_obs = numpy.mean(all_l2_obstacles[d_name])
-            mean_l2_ball = numpy.mean(all_l2_balls[d_name])
+        for d_name, result in results.items():
+            latency = ' / '.join(str(round(result['latency_ms'][p], 2)) for p in PERCENTILES)
+            percentiles = '/'.join(f'p{p}' for p in PERCENTILES)
 
             result_file.write("{:=^45}\n".format(d_name))
-            result_file.write(f"Mean time per sample: {mean_time} \u00B1 {std_time}ms\n")
+            result_file.write(
+                f"Mean time per sample: {round(result['mean_latency_ms'], 2)} \u00B1 "
+                f"{round(result['std_latency_ms'], 2)}ms\n"
+            )
+            result_file.write(f"Latency {percentiles}: {latency}ms\n")
+            result_file.write(
+                f"Throughput: {round(result['throughput'], 1)} samples/s on {result['workers']} workers, "
+                f"{round(result['core_throughput'], 1)} samples/s per core\n"
+            )
             result_file.write(template.format('', 'l2', 'inverse l2'))
             result_file.write(template.format(
-                'detecting obstacles', round(mean_l2_obs, 2), round(l2_to_metric(mean_l2_obs), 2)
+                'detecting obstacles', round(result['l2_obstacles'], 2), round(l2_to_metric(result['l2_obstacles']), 2)
             ))
             result_file.write(template.format(
-                'detecting ball', round(mean_l2_ball, 2), round(l2_to_metric(mean_l2_ball), 2)
+                'detecting ball', round(result['l2_ball'], 2), round(l2_to_metric(result['l2_ball']), 2)
             ))
+            for threshold in THRESHOLDS:
+                result_file.write(
+                    f"Obstacles within {threshold}m: precision {round(result['precision'][threshold], 3)}, "
+                    f"recall {round(result['recall'][threshold], 3)}\n"
+                )
             result_file.write("\n")
 
+        if curves:
+            threshold = THRESHOLDS[len(THRESHOLDS) // 2]
+            curve_template = '{:^20}|{:^8}|{:^12}|{:^12}|{:^12}|{:^12}\n'
+            result_file.write("{:=^80}\n".format('Accuracy / latency across scales'))
+            result_file.write(curve_template.format(
+                'detector', 'scale', 'p50 ms', 'p95 ms', 'l2 obstacles', f'recall {threshold}m'
+            ))
+            for (d_name, scale), result in curves.items():
+                result_file.write(curve_template.format(
+                    d_name, scale, round(result['latency_ms'][50], 2), round(result['latency_ms'][95], 2),
+                    round(result['l2_obstacles'], 2), round(result['recall'][threshold], 3)
+                ))
+
 
 if __name__ == '__main__':
     main()
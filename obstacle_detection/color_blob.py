@@ -0,0 +1,94 @@
+import math
+from typing import List, Tuple
+
+import cv2
+import numpy
+
+import constants
+from obstacle_detection.obstacle_utils import DETECTION_SCALE, BatchForward, extract_closest_points
+
+
+class ColorBlobObstacleDetector(BatchForward):
+    """Finds solid disks of known color by thresholding and connected components.
+
+    Blobs larger than one disk are split into as many disks as their area
+    suggests, using the cores left after thresholding the distance transform.
+    """
+
+    name = 'Blob'
+    grayscale = False
+
+    def __init__(
+            self, color_tolerance: int = 40, disk_radius: float = constants.UNITS_RADIUS * constants.k,
+            min_area_ratio: float = 0.2, threads: int = None, scale: float = DETECTION_SCALE
+    ):
+        self.color_tolerance = color_tolerance
+        self.disk_radius = disk_radius
+        self.min_area_ratio = min_area_ratio
+        self.threads = threads
+        self.scale = scale
+
+    def _detect(self, image_scaled: numpy.ndarray, reference_color: List[Tuple[Tuple, int]]):
+        disk_radius = self.disk_radius * self.scale
+        disk_area = math.pi * disk_radius ** 2
+
+        distances = {}
+        for color, _ in reference_color:
+            lower = numpy.clip(numpy.array(color) - self.color_tolerance, 0, 255).astype(numpy.uint8)
+            upper = numpy.clip(numpy.array(color) + self.color_tolerance, 0, 255).astype(numpy.uint8)
+            mask = cv2.inRange(image_scaled, lower, upper)
+            distances[color] = self._find_disks(mask, disk_radius, disk_area)
+
+        return extract_closest_points(distances, reference_color, 1 / self.scale)
+
+    def _find_disks(
+            self, mask: numpy.ndarray, disk_radius: float, disk_area: float
+    ) -> List[Tuple[float, numpy.ndarray]]:
+        n_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+        disks = []
+        for label in range(1, n_labels):
+            area = stats[label, cv2.CC_STAT_AREA]
+            if area < self.min_area_ratio * disk_area:
+                continue
+
+            n_disks = max(1, round(area / disk_area))
+            if n_disks == 1:
+                x, y = centroids[label]
+                disks.append((self._area_mismatch(area, disk_area), numpy.array((y, x))))
+                continue
+
+            x, y, w, h = stats[label, :4]
+            blob = (labels[y:y + h, x:x + w] == label).astype(numpy.uint8)
+            for core_y, core_x in self._split_blob(blob, n_disks, disk_radius):
+                disks.append((self._area_mismatch(area / n_disks, disk_area), numpy.array((core_y + y, core_x + x))))
+        return disks
+
+    @staticmethod
+    def _area_mismatch(area: float, disk_area: float) -> float:
+        return abs(1. - area / disk_area)
+
+    @staticmethod
+    def _split_blob(blob: numpy.ndarray, n_disks: int, disk_radius: float) -> numpy.ndarray:
+        # Centers of touching disks stay apart after thresholding the distance to the blob border
+        distance = cv2.distanceTransform(blob, cv2.DIST_L2, 3)
+        cores = (distance > 0.5 * disk_radius).astype(numpy.uint8)
+        n_cores, _, _, core_centroids = cv2.connectedComponentsWithStats(cores, connectivity=8)
+        if n_cores - 1 == n_disks:
+            return core_centroids[1:, ::-1]
+
+        # Heavily overlapping disks share one core, fall back to clustering the blob pixels. Clusters start
+        # from the deepest pixel and the deep pixels farthest from the seeds so far, never from OpenCV's RNG
+        pixels = numpy.argwhere(blob).astype(numpy.float32)
+        depth = distance[blob > 0]
+        deep = pixels[depth >= 0.5 * depth.max()]
+        seeds = [pixels[numpy.argmax(depth)]]
+        gaps = numpy.full(len(deep), numpy.inf)
+        for _ in range(n_disks - 1):
+            gaps = numpy.minimum(gaps, numpy.hypot(*(deep - seeds[-1]).T))
+            seeds.append(deep[numpy.argmax(gaps)])
+        offsets = pixels[:, None, :] - numpy.array(seeds)[None, :, :]
+        labels = numpy.argmin(numpy.einsum('psk,psk->ps', offsets, offsets), axis=1).astype(numpy.int32)[:, None]
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.5)
+        _, _, centers = cv2.kmeans(pixels, n_disks, labels, criteria, 1, cv2.KMEANS_USE_INITIAL_LABELS)
+        return centers
@@ -1,48 +1,77 @@
+import math
+import threading
 from typing import List, Tuple
 
 import cv2
 import numpy
 
-from obstacle_detection.obstacle_utils import extract_closest_points
+from obstacle_detection.obstacle_utils import DETECTION_SCALE, BatchForward, select_points
 
 
-class MSERObstacleDetector:
+class MSERObstacleDetector(BatchForward):
+    """Finds regions by MSER on the grayscale frame downscaled by `scale` and ranks them by their mean color.
+
+    `hull_distance_threshold` is in pixels of a frame at DETECTION_SCALE.
+    """
 
     name = 'MSER'
 
     def __init__(
-            self, hull_distance_threshold: int = 10
+            self, hull_distance_threshold: int = 10, threads: int = None, scale: float = DETECTION_SCALE
     ):
         self.hull_distance_threshold = hull_distance_threshold
-        self.mser = cv2.MSER_create()
-
-    def forward(self, image: numpy.ndarray, reference_color: List[Tuple[Tuple, int]]):
-        assert len(image.shape) == 3, 'Please pass a colored 3-channel image'
+        self.threads = threads
+        self.scale = scale
+        self._local = threading.local()
 
-        image_scaled = cv2.resize(image, None, fx=0.5, fy=0.5)
-        image_grayscale = cv2.cvtColor(image_scaled, cv2.COLOR_BGR2GRAY)
+    @property
+    def mser(self):
+        if not hasattr(self._local, 'mser'):
+            # OpenCV's default region areas fit frames at DETECTION_SCALE
+            area_scale = (self.scale / DETECTION_SCALE) ** 2
+            self._local.mser = cv2.MSER_create(
+                min_area=max(1, round(60 * area_scale)), max_area=round(14400 * area_scale)
+            )
+        return self._local.mser
 
+    def _detect(self, image_scaled: numpy.ndarray, image_grayscale: numpy.ndarray,
+                reference_color: List[Tuple[Tuple, int]]):
         regions = self.mser.detectRegions(image_grayscale)
         hulls = [cv2.convexHull(p.reshape(-1, 1, 2)) for p in regions[0]]
 
-        distances = {color: [] for color, _ in reference_color}
+        hull_positions = []
+        hull_differences = []
 
+        # Per-pixel distance to every reference color, computed once per frame in one broadcast
+        colors = numpy.array([color for color, _ in reference_color], dtype=numpy.int32)
+        color_differences = image_scaled.astype(numpy.int32) - colors[:, None, None, :]
+        color_differences = numpy.sqrt(numpy.einsum('...i,...i->...', color_differences, color_differences))
+
+        hull_distance_threshold = self.hull_distance_threshold * self.scale / DETECTION_SCALE
         last_hull_coords = numpy.array([-1000, -1000])
         for i, hull in enumerate(hulls):
-            mask = cv2.fillConvexPoly(numpy.zeros_like(image_grayscale), hull, (255, 255, 255))
-            relevant_pixels = numpy.where(mask)
+            relevant_pixels = self._hull_pixels(hull)
             hull_coords = numpy.mean(relevant_pixels, axis=-1)
-            if numpy.linalg.norm(hull_coords - last_hull_coords) > self.hull_distance_threshold:
+            dy, dx = hull_coords - last_hull_coords
+            if math.sqrt(dy * dy + dx * dx) > hull_distance_threshold:
                 last_hull_coords = hull_coords
             else:
                 continue
 
-            # mean_color = numpy.mean(image_scaled[relevant_pixels], axis=0)
-            for color, _ in reference_color:
-                color_difference = numpy.linalg.norm(image_scaled[relevant_pixels] - color, axis=1).mean()
-                distances[color].append((
-                    color_difference,
-                    hull_coords
-                ))
+            hull_positions.append(hull_coords)
+            hull_differences.append(color_differences[:, relevant_pixels[0], relevant_pixels[1]].mean(axis=-1))
+
+        hull_positions = numpy.array(hull_positions).reshape(-1, 2)
+        hull_differences = numpy.array(hull_differences).reshape(-1, len(reference_color))
+        return [
+            select_points(hull_differences[:, i], hull_positions, cnt, 1 / self.scale)
+            for i, (_, cnt) in enumerate(reference_color)
+        ]
 
-        return extract_closest_points(distances, reference_color, 2)
+    @staticmethod
+    def _hull_pixels(hull: numpy.ndarray):
+        # Rasterize the hull into a mask covering only its bounding box instead of the whole frame
+        x, y, w, h = cv2.boundingRect(hull)
+        mask = cv2.fillConvexPoly(numpy.zeros((h, w), numpy.uint8), hull - (x, y), 255)
+        rows, cols = numpy.where(mask)
+        return rows + y, cols + x
@@ -1,29 +1,202 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple
 
+import cv2
 import numpy
 
+from spatial import UniformGrid
+
+# Candidates closer than this (in detector pixels at DETECTION_SCALE) to a better one are duplicates of it
+SUPPRESSION_DISTANCE = 3
+# Candidates after the best one are only taken while their color distance is below this
+MAX_COLOR_DISTANCE = 200
+# Frames are downscaled by this factor before detection unless a detector is told otherwise
+DETECTION_SCALE = 0.5
+
 
 def extract_closest_points(
     distances: Dict, reference_colors: List[Tuple[Tuple, int]], scale: float
 ) -> List[numpy.ndarray]:
     result = []
     for color, cnt in reference_colors:
-        true_points = remove_too_close_points(sorted(distances[color], key=lambda t: t[0]))
-        result.append(
-            numpy.array(
-                [
-                    (round(y * scale), round(x * scale))
-                    for i, (dist, (x, y)) in enumerate(true_points[:cnt])
-                    if i == 0 or dist < 200
-                ]
-            )
-        )
+        candidates = distances[color]
+        scores = numpy.array([score for score, _ in candidates], dtype=numpy.float64)
+        points = numpy.array([point for _, point in candidates], dtype=numpy.float64).reshape(-1, 2)
+        result.append(select_points(scores, points, cnt, scale))
     return result
 
 
-def remove_too_close_points(points: List[Tuple[float, Tuple]]) -> List[Tuple[float, Tuple]]:
-    result = []
-    for _d, point in points:
-        if all([numpy.linalg.norm(i[1] - point) > 3 for i in result]):
-            result.append((_d, point))
-    return result
+def select_points(scores: numpy.ndarray, points: numpy.ndarray, cnt: int, scale: float) -> numpy.ndarray:
+    """Best `cnt` points by score after duplicate suppression, as scaled (x, y) from (row, col) points.
+
+    `scale` maps detector pixels to frame pixels, the suppression distance
+    follows the detector's resolution. Only a prefix of the candidates ordered
+    by score is sorted and suppressed, it is grown until it yields `cnt` points
+    or covers all candidates.
+    """
+    scores = numpy.asarray(scores, dtype=numpy.float64)
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+    kept = numpy.empty(0, dtype=numpy.int64)
+    distance = SUPPRESSION_DISTANCE / (DETECTION_SCALE * scale)
+    prefix = 4 * cnt
+    while len(scores):
+        order = _best_indices(scores, prefix)
+        kept = remove_too_close_points(points[order], cnt, distance)
+        kept = order[kept]
+        if len(kept) >= cnt or len(order) == len(scores):
+            break
+        prefix *= 2
+
+    kept = kept[:cnt]
+    kept = kept[(numpy.arange(len(kept)) == 0) | (scores[kept] < MAX_COLOR_DISTANCE)]
+    return numpy.round(points[kept, ::-1] * scale).astype(numpy.int64)
+
+
+def _best_indices(scores: numpy.ndarray, k: int) -> numpy.ndarray:
+    """Indices of at least the `k` lowest scores in stable ascending order, ties at the cut are all included."""
+    if k < len(scores):
+        cut = numpy.partition(scores, k - 1)[k - 1]
+        candidates = numpy.flatnonzero(scores <= cut)
+    else:
+        candidates = numpy.arange(len(scores))
+    return candidates[numpy.argsort(scores[candidates], kind='stable')]
+
+
+def remove_too_close_points(points: numpy.ndarray, limit: int = None,
+                            distance: float = SUPPRESSION_DISTANCE) -> numpy.ndarray:
+    """Greedy duplicate suppression over points ordered from best to worst, returns indices of the kept ones.
+
+    A point is dropped when a kept point lies within `distance` of it.
+    Scanning stops once `limit` points are kept. It used to take and return
+    lists of `(score, point)` pairs, which `remove_too_close_scored_points` still does.
+    """
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return numpy.empty(0, dtype=numpy.int64)
+
+    grid = UniformGrid(points, distance, origin=points.min(axis=0))
+    first, second = grid.pairs(distance)
+    if len(first) == 0:
+        return numpy.arange(len(points) if limit is None else min(limit, len(points)))
+
+    # Every pair suppresses in both directions
+    first, second = numpy.concatenate([first, second]), numpy.concatenate([second, first])
+    by_first = numpy.argsort(first, kind='stable')
+    second = second[by_first]
+    bounds = numpy.searchsorted(first[by_first], numpy.arange(len(points) + 1))
+
+    suppressed = numpy.zeros(len(points), dtype=bool)
+    kept = []
+    for i in range(len(points)):
+        if suppressed[i]:
+            continue
+        kept.append(i)
+        if limit is not None and len(kept) == limit:
+            break
+        suppressed[second[bounds[i]:bounds[i + 1]]] = True
+    return numpy.array(kept, dtype=numpy.int64)
+
+
+def remove_too_close_scored_points(points: List[Tuple[float, Tuple]],
+                                   distance: float = SUPPRESSION_DISTANCE) -> List[Tuple[float, Tuple]]:
+    """`remove_too_close_points` for lists of `(score, point)` pairs, returns the kept pairs."""
+    if len(points) == 0:
+        return []
+    kept = remove_too_close_points(numpy.array([point for _, point in points]), distance=distance)
+    return [points[i] for i in kept]
+
+
+def scale_image(image: numpy.ndarray, scale: float) -> numpy.ndarray:
+    if scale == 1:
+        return image
+    return cv2.resize(image, None, fx=scale, fy=scale)
+
+
+def scale_batch(frames: numpy.ndarray, scale: float) -> numpy.ndarray:
+    """`scale_image` of every frame of a (B, H, W, C) stack.
+
+    When the height is a multiple of an integer factor 1 / scale, the stack is
+    resized as one tall image: such a linear resize never mixes rows of
+    neighbouring frames.
+    """
+    frames = numpy.ascontiguousarray(frames)
+    batch, height, width = frames.shape[:3]
+    if scale == 1:
+        return frames
+    factor = 1 / scale
+    if not factor.is_integer() or height % factor:
+        return numpy.stack([scale_image(frame, scale) for frame in frames])
+    scaled_height = height // int(factor)
+    scaled = cv2.resize(frames.reshape(batch * height, width, -1), (round(width * scale), batch * scaled_height))
+    return scaled.reshape(batch, scaled_height, *scaled.shape[1:])
+
+
+def grayscale_batch(frames: numpy.ndarray) -> numpy.ndarray:
+    """`cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)` of every frame of a (B, H, W, 3) stack in one call."""
+    batch, height, width = frames.shape[:3]
+    return cv2.cvtColor(frames.reshape(batch * height, width, 3), cv2.COLOR_BGR2GRAY).reshape(batch, height, width)
+
+
+def pad_detections(detections, reference_color: List[Tuple[Tuple, int]]):
+    """Per-frame detector outputs as one (B, cnt, 2) array per color, zero padded, and their (B, cnt) valid masks."""
+    positions, valid = [], []
+    for i, (_, cnt) in enumerate(reference_color):
+        color_positions = numpy.zeros((len(detections), cnt, 2))
+        color_valid = numpy.zeros((len(detections), cnt), dtype=bool)
+        for frame, points in enumerate(detections):
+            points = numpy.asarray(points[i], dtype=numpy.float64).reshape(-1, 2)[:cnt]
+            color_positions[frame, :len(points)] = points
+            color_valid[frame, :len(points)] = True
+        positions.append(color_positions)
+        valid.append(color_valid)
+    return positions, valid
+
+
+class BatchForward:
+    """`forward_batch` for detectors split into preprocessing and `_detect(*preprocessed, reference_color)`.
+
+    Detectors work on frames downscaled by `scale`. Preprocessing gives the
+    scaled frame and, with `grayscale`, its grayscale version. Frames of a
+    batch are preprocessed together, detection of the single frames is spread
+    over a pool of `threads` threads, started by the first batch and shut down
+    by `close()`. Detectors keep OpenCV objects per thread, they are not safe
+    to share.
+    """
+
+    scale = DETECTION_SCALE
+    grayscale = True
+    threads = None
+    _batch_executor = None
+
+    def _preprocess(self, image: numpy.ndarray):
+        image_scaled = scale_image(image, self.scale)
+        if not self.grayscale:
+            return (image_scaled,)
+        return image_scaled, cv2.cvtColor(image_scaled, cv2.COLOR_BGR2GRAY)
+
+    def _preprocess_batch(self, frames: numpy.ndarray):
+        frames_scaled = scale_batch(frames, self.scale)
+        if not self.grayscale:
+            return (frames_scaled,)
+        return frames_scaled, grayscale_batch(frames_scaled)
+
+    def forward(self, image: numpy.ndarray, reference_color: List[Tuple[Tuple, int]]):
+        assert len(image.shape) == 3, 'Please pass a colored 3-channel image'
+        return self._detect(*self._preprocess(image), reference_color)
+
+    def forward_batch(self, frames: numpy.ndarray, reference_color: List[Tuple[Tuple, int]]):
+        """Detections of a (B, H, W, 3) stack of frames, padded as in `pad_detections`."""
+        assert len(frames.shape) == 4, 'Please pass a stack of colored 3-channel images'
+        if self._batch_executor is None:
+            self._batch_executor = ThreadPoolExecutor(max_workers=self.threads or os.cpu_count())
+        preprocessed = self._preprocess_batch(frames)
+        detections = self._batch_executor.map(
+            lambda i: self._detect(*(part[i] for part in preprocessed), reference_color), range(len(frames))
+        )
+        return pad_detections(list(detections), reference_color)
+
+    def close(self):
+        if self._batch_executor is not None:
+            self._batch_executor.shutdown()
+            self._batch_executor = None
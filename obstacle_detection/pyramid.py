@@ -0,0 +1,71 @@
+from typing import List, Tuple
+
+import numpy
+
+import constants
+
+
+def _disc_offsets(radius: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    rows, cols = numpy.mgrid[-radius:radius + 1, -radius:radius + 1]
+    inside = rows * rows + cols * cols <= radius * radius
+    return rows[inside], cols[inside]
+
+
+def refine_points(image: numpy.ndarray, points: numpy.ndarray, color, offsets, color_tolerance: int,
+                  min_pixels: int) -> numpy.ndarray:
+    """Moves every (x, y) point to the centroid of the pixels of `color` in a disc window around it.
+
+    Points whose window holds fewer than `min_pixels` such pixels stay where they are.
+    """
+    height, width = image.shape[:2]
+    x = numpy.round(points[:, 0]).astype(numpy.int64)
+    y = numpy.round(points[:, 1]).astype(numpy.int64)
+    rows = y[:, None] + offsets[0]
+    cols = x[:, None] + offsets[1]
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+
+    pixels = image[numpy.clip(rows, 0, height - 1), numpy.clip(cols, 0, width - 1)].astype(numpy.int32)
+    matching = inside & (numpy.abs(pixels - numpy.asarray(color, dtype=numpy.int32)) <= color_tolerance).all(axis=-1)
+    counts = matching.sum(axis=1)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        refined = numpy.stack(((cols * matching).sum(axis=1), (rows * matching).sum(axis=1)), axis=-1) / counts[:, None]
+    return numpy.where((counts >= min_pixels)[:, None], refined, points)
+
+
+class PyramidObstacleDetector:
+    """Coarse detection by a detector working on a downscaled frame, refined at full resolution.
+
+    Every coarse candidate is moved `iterations` times to the centroid of its
+    color in a disc of `disk_radius + margin` around it, so only small windows
+    of the full frame are touched. Positions come back as sub-pixel floats.
+    """
+
+    def __init__(
+            self, detector, disk_radius: float = constants.UNITS_RADIUS * constants.k, margin: float = 2,
+            color_tolerance: int = 40, min_area_ratio: float = 0.2, iterations: int = 2
+    ):
+        self.detector = detector
+        self.name = f'{detector.name}+Pyramid'
+        self.offsets = _disc_offsets(int(numpy.ceil(disk_radius + margin)))
+        self.color_tolerance = color_tolerance
+        self.min_pixels = min_area_ratio * numpy.pi * disk_radius ** 2
+        self.iterations = iterations
+
+    def reset(self):
+        if hasattr(self.detector, 'reset'):
+            self.detector.reset()
+
+    def close(self):
+        if hasattr(self.detector, 'close'):
+            self.detector.close()
+
+    def forward(self, image: numpy.ndarray, reference_color: List[Tuple[Tuple, int]]):
+        assert len(image.shape) == 3, 'Please pass a colored 3-channel image'
+
+        result = []
+        for (color, _), points in zip(reference_color, self.detector.forward(image, reference_color)):
+            points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+            for _ in range(self.iterations if len(points) else 0):
+                points = refine_points(image, points, color, self.offsets, self.color_tolerance, self.min_pixels)
+            result.append(points)
+        return result
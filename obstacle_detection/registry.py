@@ -0,0 +1,35 @@
+import functools
+
+from obstacle_detection.adaptive import AdaptiveScaleObstacleDetector
+from obstacle_detection.color_blob import ColorBlobObstacleDetector
+from obstacle_detection.mser import MSERObstacleDetector
+from obstacle_detection.obstacle_utils import DETECTION_SCALE
+from obstacle_detection.pyramid import PyramidObstacleDetector
+from obstacle_detection.scale_based import ScaleBasedObstacleDetector
+from obstacle_detection.tracking import TrackingObstacleDetector
+
+# Latency budget per frame of adaptive detectors, MSER meets it at DETECTION_SCALE on a single core
+ADAPTIVE_BUDGET_MS = 20.
+ADAPTIVE_SCALES = (1.0, DETECTION_SCALE, 0.25)
+
+
+def _adaptive(factory, scale=1.0):
+    # The adaptive detector picks its own scale, `scale` caps the finest one it may use
+    return AdaptiveScaleObstacleDetector(
+        lambda s: factory(scale=s), ADAPTIVE_BUDGET_MS, scales=[s for s in ADAPTIVE_SCALES if s <= scale] or [scale]
+    )
+
+
+# Detectors hold OpenCV objects that can not be pickled, so workers build them by name.
+# Every factory takes an optional detection `scale`, pyramid detectors detect coarser by default
+DETECTORS = {
+    'MSER': MSERObstacleDetector,
+    'SURF': functools.partial(ScaleBasedObstacleDetector, 'SURF'),
+    'U-SURF': functools.partial(ScaleBasedObstacleDetector, 'U-SURF'),
+    'SIFT': functools.partial(ScaleBasedObstacleDetector, 'SIFT'),
+    'Blob': ColorBlobObstacleDetector,
+    'Blob+Kalman': lambda scale=DETECTION_SCALE: TrackingObstacleDetector(ColorBlobObstacleDetector(scale=scale)),
+    'MSER+Pyramid': lambda scale=0.25: PyramidObstacleDetector(MSERObstacleDetector(scale=scale)),
+    'Blob+Pyramid': lambda scale=0.25: PyramidObstacleDetector(ColorBlobObstacleDetector(scale=scale)),
+    'MSER+Adaptive': functools.partial(_adaptive, MSERObstacleDetector),
+}
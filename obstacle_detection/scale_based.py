@@ -1,15 +1,30 @@
+import threading
 from typing import List, Tuple
 
 import cv2
 import numpy
 
-from obstacle_detection.obstacle_utils import extract_closest_points
+from obstacle_detection.obstacle_utils import (
+    DETECTION_SCALE, BatchForward, extract_closest_points, select_points
+)
 
 
-class ScaleBasedObstacleDetector:
+def _disc_offsets(radius: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    # Pixel offsets of a filled disc exactly as cv2.circle rasterizes it
+    patch = numpy.zeros((2 * radius + 1, 2 * radius + 1), numpy.uint8)
+    cv2.circle(patch, (radius, radius), radius, 1, thickness=-1)
+    rows, cols = numpy.where(patch)
+    return rows - radius, cols - radius
 
-    def __init__(self, algorithm: str):
+
+class ScaleBasedObstacleDetector(BatchForward):
+
+    COLOR_SAMPLE_RADIUS = 3
+
+    def __init__(self, algorithm: str, threads: int = None, scale: float = DETECTION_SCALE):
         self.name = algorithm
+        self.threads = threads
+        self.scale = scale
         if algorithm == 'SURF':
             self.get_ball_detector = lambda: cv2.xfeatures2d.SURF_create()
         elif algorithm == 'U-SURF':
@@ -18,30 +33,48 @@ class ScaleBasedObstacleDetector:
             self.get_ball_detector = lambda: cv2.xfeatures2d.SIFT_create()
         else:
             raise ValueError(f"Unknown scale based object detection algorithm {algorithm}")
+        self._local = threading.local()
+        self._sample_offsets = _disc_offsets(self.COLOR_SAMPLE_RADIUS)
+
+    @property
+    def ball_detector(self):
+        # Built on first use in every thread and reused for its following frames
+        if not hasattr(self._local, 'ball_detector'):
+            self._local.ball_detector = self.get_ball_detector()
+        return self._local.ball_detector
+
+    def _sample_colors(self, image: numpy.ndarray, keypoints) -> numpy.ndarray:
+        """Mean color of a small disc around every keypoint, gathered for all keypoints at once."""
+        height, width = image.shape[:2]
+        points = numpy.array([keypoint.pt for keypoint in keypoints], dtype=numpy.float64).reshape(-1, 2)
+        x = numpy.round(points[:, 0]).astype(numpy.int64)
+        y = numpy.round(points[:, 1]).astype(numpy.int64)
+        # A keypoint with a rounded quarter size of 0 used to be drawn with color 0, i.e. an empty mask
+        drawn = numpy.array([round(keypoint.size / 4) != 0 for keypoint in keypoints], dtype=bool)
 
-    def forward(self, image: numpy.ndarray, reference_color: List[Tuple[Tuple, int]]):
-        assert len(image.shape) == 3, 'Please pass a colored 3-channel image'
+        rows = y[:, None] + self._sample_offsets[0]
+        cols = x[:, None] + self._sample_offsets[1]
+        valid = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width) & drawn[:, None]
 
-        image_scaled = cv2.resize(image, None, fx=0.5, fy=0.5)
-        image_grayscale = cv2.cvtColor(image_scaled, cv2.COLOR_BGR2GRAY)
-        keypoints, descriptors = self.get_ball_detector().detectAndCompute(image_grayscale, None)
+        pixels = image[numpy.clip(rows, 0, height - 1), numpy.clip(cols, 0, width - 1)].astype(numpy.float64)
+        pixels[~valid] = 0
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return pixels.sum(axis=1) / valid.sum(axis=1)[:, None]
 
-        distances = {color: [] for color, _ in reference_color}
+    def _detect(self, image_scaled: numpy.ndarray, image_grayscale: numpy.ndarray,
+                reference_color: List[Tuple[Tuple, int]]):
+        keypoints, descriptors = self.ball_detector.detectAndCompute(image_grayscale, None)
 
-        for i, keypoint in enumerate(keypoints):
-            x, y = keypoint.pt
-            x = round(x)
-            y = round(y)
-            radius = round(keypoint.size / 4)
+        if len(keypoints) == 0:
+            return extract_closest_points({color: [] for color, _ in reference_color}, reference_color, 1 / self.scale)
 
-            mask = numpy.zeros(image_scaled.shape[:2], numpy.uint8)
-            cv2.circle(mask, (x, y), 3, radius, thickness=-1)
-            relevant_pixels = numpy.where(mask)
-            mean_color = image_scaled[relevant_pixels].mean(0)
-            for color, _ in reference_color:
-                distances[color].append((
-                    numpy.linalg.norm(color - mean_color),
-                    numpy.array((y, x))
-                ))
+        mean_colors = self._sample_colors(image_scaled, keypoints)
+        colors = numpy.array([color for color, _ in reference_color], dtype=numpy.float64)
+        color_differences = numpy.linalg.norm(colors[None, :, :] - mean_colors[:, None, :], axis=-1)
 
-        return extract_closest_points(distances, reference_color, 2)
+        # Keypoints as (row, col), rounded like the color samples
+        positions = numpy.round(numpy.array([keypoint.pt for keypoint in keypoints])[:, ::-1])
+        return [
+            select_points(color_differences[:, i], positions, cnt, 1 / self.scale)
+            for i, (_, cnt) in enumerate(reference_color)
+        ]
@@ -0,0 +1,231 @@
+from typing import List, Tuple
+
+import numpy
+
+import constants
+from obstacle_detection.obstacle_utils import pad_detections
+
+
+class KalmanTracks:
+    """Constant-velocity Kalman filters for all tracked objects of one color.
+
+    State of every track is (x, y, vx, vy) in pixels and pixels per second,
+    filters of all tracks are predicted and updated together as stacked arrays.
+    """
+
+    def __init__(self, dt: float, measurement_std: float, acceleration_std: float, initial_velocity_std: float):
+        self.measurement_std = measurement_std
+        self.acceleration_std = acceleration_std
+        self.initial_velocity_std = initial_velocity_std
+
+        self.set_dt(dt)
+        self.R = measurement_std ** 2 * numpy.eye(2)
+
+        self.x = numpy.empty((0, 4))
+        self.P = numpy.empty((0, 4, 4))
+        self.misses = numpy.empty(0, dtype=numpy.int64)
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def positions(self) -> numpy.ndarray:
+        return self.x[:, :2]
+
+    @property
+    def velocities(self) -> numpy.ndarray:
+        return self.x[:, 2:]
+
+    @property
+    def position_std(self) -> numpy.ndarray:
+        return numpy.sqrt(numpy.maximum(self.P[:, 0, 0], self.P[:, 1, 1]))
+
+    def set_dt(self, dt: float):
+        """Rebuilds the transition and process noise for predictions `dt` seconds ahead."""
+        self.dt = dt
+        self.F = numpy.array([[1, 0, dt, 0], [0, 1, 0, dt], [0, 0, 1, 0], [0, 0, 0, 1]], dtype=numpy.float64)
+        g = numpy.array([[dt ** 2 / 2, 0], [0, dt ** 2 / 2], [dt, 0], [0, dt]])
+        self.Q = self.acceleration_std ** 2 * g @ g.T
+
+    def predict(self, dt: float = None):
+        if dt is not None and dt != self.dt:
+            self.set_dt(dt)
+        self.x = self.x @ self.F.T
+        self.P = self.F @ self.P @ self.F.T + self.Q
+
+    def update(self, indices: numpy.ndarray, measurements: numpy.ndarray):
+        if len(indices) == 0:
+            return
+        x, P = self.x[indices], self.P[indices]
+        innovation = measurements - x[:, :2]
+        S = P[:, :2, :2] + self.R
+        K = P[:, :, :2] @ numpy.linalg.inv(S)
+        self.x[indices] = x + (K @ innovation[:, :, None])[:, :, 0]
+        self.P[indices] = P - K @ P[:, :2, :]
+        self.misses[indices] = 0
+
+    def add(self, measurements: numpy.ndarray):
+        n = len(measurements)
+        x = numpy.zeros((n, 4))
+        x[:, :2] = measurements
+        P = numpy.zeros((n, 4, 4))
+        P[:, [0, 1], [0, 1]] = self.measurement_std ** 2
+        P[:, [2, 3], [2, 3]] = self.initial_velocity_std ** 2
+        self.x = numpy.concatenate([self.x, x])
+        self.P = numpy.concatenate([self.P, P])
+        self.misses = numpy.concatenate([self.misses, numpy.zeros(n, dtype=numpy.int64)])
+
+    def keep(self, mask: numpy.ndarray):
+        self.x, self.P, self.misses = self.x[mask], self.P[mask], self.misses[mask]
+
+
+class TrackingObstacleDetector:
+    """Wraps any detector with per-object Kalman tracking and region of interest re-detection.
+
+    The wrapped detector scans the whole frame only every `full_detection_interval`
+    frames or when a track is missed `max_misses` times in a row. In between, it runs
+    on small windows around the predicted positions. Velocity estimates of the last
+    call are kept in `velocities`.
+
+    `dt` is the time in seconds between consecutive frames, tracks predict over
+    its current value. Simulations set it from their detection clock, so it
+    follows the actual detection rate.
+    """
+
+    def __init__(
+            self, detector, full_detection_interval: int = 10, dt: float = 0.1,
+            disk_radius: float = constants.UNITS_RADIUS * constants.k, roi_margin: float = 8,
+            roi_candidates: int = 3, gate: float = None, max_misses: int = 2, max_position_std: float = None,
+            measurement_std: float = 2., acceleration_std: float = None
+    ):
+        self.detector = detector
+        self.name = f'{detector.name}+Kalman'
+        self.full_detection_interval = full_detection_interval
+        self.dt = dt
+        self.disk_radius = disk_radius
+        self.roi_margin = roi_margin
+        self.roi_candidates = roi_candidates
+        self.gate = gate if gate is not None else disk_radius
+        self.max_misses = max_misses
+        self.max_position_std = max_position_std if max_position_std is not None else disk_radius / 2
+        self.measurement_std = measurement_std
+        # Obstacles keep their velocity between wall bounces, which are the only accelerations
+        self.acceleration_std = acceleration_std if acceleration_std is not None \
+            else constants.OBSTACLE_VELOCITY_RANGE * constants.k
+        self.reset()
+
+    def reset(self):
+        self.tracks = {}
+        self.velocities = []
+        self.frame_index = 0
+        self.full_detections = 0
+
+    def close(self):
+        if hasattr(self.detector, 'close'):
+            self.detector.close()
+
+    def _new_tracks(self):
+        return KalmanTracks(
+            self.dt, self.measurement_std, self.acceleration_std,
+            3 * constants.OBSTACLE_VELOCITY_RANGE * constants.k
+        )
+
+    def _needs_full_detection(self, reference_color) -> bool:
+        if self.frame_index % self.full_detection_interval == 0:
+            return True
+        for color, _ in reference_color:
+            tracks = self.tracks.get(color)
+            if tracks is None or len(tracks) == 0:
+                return True
+            if (tracks.misses >= self.max_misses).any() or (tracks.position_std > self.max_position_std).any():
+                return True
+        return False
+
+    def _associate(self, tracks: KalmanTracks, detections: numpy.ndarray):
+        # Greedy nearest-neighbour matching within the gate, closest pairs first
+        if len(tracks) == 0 or len(detections) == 0:
+            return numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.int64)
+        distances = numpy.linalg.norm(tracks.positions[:, None, :] - detections[None, :, :], axis=-1)
+        track_indices, detection_indices = [], []
+        for flat in numpy.argsort(distances, axis=None):
+            t, d = divmod(flat, distances.shape[1])
+            if distances[t, d] > self.gate:
+                break
+            if t in track_indices or d in detection_indices:
+                continue
+            track_indices.append(t)
+            detection_indices.append(d)
+        return numpy.array(track_indices, dtype=numpy.int64), numpy.array(detection_indices, dtype=numpy.int64)
+
+    def _full_detection(self, image: numpy.ndarray, reference_color: List[Tuple[Tuple, int]]):
+        self.full_detections += 1
+        detections = self.detector.forward(image, reference_color)
+        for (color, cnt), points in zip(reference_color, detections):
+            points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+            tracks = self.tracks.setdefault(color, self._new_tracks())
+
+            track_indices, detection_indices = self._associate(tracks, points)
+            tracks.update(track_indices, points[detection_indices])
+
+            missed = numpy.ones(len(tracks), dtype=bool)
+            missed[track_indices] = False
+            tracks.misses[missed] += 1
+            tracks.keep(tracks.misses < self.max_misses)
+
+            unmatched = numpy.ones(len(points), dtype=bool)
+            unmatched[detection_indices] = False
+            tracks.add(points[unmatched][:max(0, cnt - len(tracks))])
+
+    def _roi_detection(self, image: numpy.ndarray, reference_color: List[Tuple[Tuple, int]]):
+        height, width = image.shape[:2]
+        for color, _ in reference_color:
+            tracks = self.tracks[color]
+            half_sizes = self.disk_radius + self.roi_margin + 3 * tracks.position_std
+            matched, measurements = [], []
+            for i, ((x, y), half_size) in enumerate(zip(tracks.positions, half_sizes)):
+                x0, y0 = max(0, int(x - half_size)), max(0, int(y - half_size))
+                x1, y1 = min(width, int(x + half_size) + 1), min(height, int(y + half_size) + 1)
+                if x1 - x0 < 2 or y1 - y0 < 2:
+                    continue
+                # Neighbours may reach into the window, so take the candidate closest to the prediction
+                points = self.detector.forward(image[y0:y1, x0:x1], [(color, self.roi_candidates)])[0]
+                if len(points) == 0:
+                    continue
+                points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2) + (x0, y0)
+                distances = numpy.linalg.norm(points - (x, y), axis=-1)
+                closest = numpy.argmin(distances)
+                if distances[closest] <= self.gate:
+                    matched.append(i)
+                    measurements.append(points[closest])
+
+            missed = numpy.ones(len(tracks), dtype=bool)
+            missed[matched] = False
+            tracks.misses[missed] += 1
+            tracks.update(numpy.array(matched, dtype=numpy.int64), numpy.array(measurements).reshape(-1, 2))
+
+    def forward(self, image: numpy.ndarray, reference_color: List[Tuple[Tuple, int]]):
+        assert len(image.shape) == 3, 'Please pass a colored 3-channel image'
+
+        if self.frame_index > 0:
+            for tracks in self.tracks.values():
+                tracks.predict(self.dt)
+
+        if self._needs_full_detection(reference_color):
+            self._full_detection(image, reference_color)
+        else:
+            self._roi_detection(image, reference_color)
+        self.frame_index += 1
+
+        result = []
+        self.velocities = []
+        for color, cnt in reference_color:
+            tracks = self.tracks[color]
+            order = numpy.argsort(tracks.misses, kind='stable')[:cnt]
+            result.append(tracks.positions[order].copy())
+            self.velocities.append(tracks.velocities[order].copy())
+        return result
+
+    def forward_batch(self, frames: numpy.ndarray, reference_color: List[Tuple[Tuple, int]]):
+        """Tracks through a (B, H, W, 3) stack as consecutive frames, padded as in `pad_detections`."""
+        assert len(frames.shape) == 4, 'Please pass a stack of colored 3-channel images'
+        return pad_detections([self.forward(frame, reference_color) for frame in frames], reference_color)
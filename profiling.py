@@ -0,0 +1,126 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import numpy
+
+PERCENTILES = (50, 95, 99)
+
+
+class _CountingSpan:
+    """Span of a disabled profiler: counts calls and measures nothing."""
+
+    __slots__ = ('calls',)
+
+    def __init__(self):
+        self.calls = 0
+
+    def __enter__(self):
+        self.calls += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class _TimedSpan:
+    __slots__ = ('stats', 'start')
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.add(self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+class SpanStats:
+    """Durations of the last `window` calls of a span in a ring buffer, in nanoseconds."""
+
+    def __init__(self, name, window, profiler):
+        self.name = name
+        self.profiler = profiler
+        self.durations = numpy.zeros(window, dtype=numpy.int64)
+        self.calls = 0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def add(self, start, duration):
+        with self._lock:
+            self.durations[self.calls % len(self.durations)] = duration
+            self.calls += 1
+            self.total += duration
+        if self.profiler.events is not None:
+            self.profiler.events.append((self.name, start, duration, threading.get_ident()))
+
+    def window(self) -> numpy.ndarray:
+        return self.durations[:min(self.calls, len(self.durations))]
+
+    def histogram(self, bins: int = 20):
+        """Counts of the windowed durations over log-spaced bins, and the bin edges in milliseconds."""
+        durations = self.window() / 1e6
+        if len(durations) == 0:
+            return numpy.zeros(bins, dtype=numpy.int64), numpy.zeros(bins + 1)
+        low, high = max(durations.min(), 1e-4), max(durations.max(), 1e-4)
+        edges = numpy.geomspace(low, high * (1 + 1e-9), bins + 1)
+        return numpy.histogram(numpy.clip(durations, low, None), edges)[0], edges
+
+    def summary(self):
+        durations = self.window() / 1e6
+        result = {'calls': self.calls, 'total_ms': self.total / 1e6}
+        if len(durations):
+            result.update({'mean_ms': float(durations.mean()), 'max_ms': float(durations.max())})
+            result.update({f'p{p}_ms': float(v) for p, v in zip(PERCENTILES, numpy.percentile(durations, PERCENTILES))})
+        return result
+
+
+class Profiler:
+    """Named timing spans for hot paths.
+
+    `with profiler.span('plan'): ...` times a block. A disabled profiler hands out
+    a shared counting span, so instrumented code only pays for a dictionary
+    lookup and a counter. An enabled one keeps a rolling window of durations per
+    span and, with `trace_events`, the last events for a Chrome trace.
+    """
+
+    def __init__(self, enabled: bool = False, window: int = 1024, trace_events: int = 0):
+        self.enabled = enabled
+        self.window = window
+        self.stats = {}
+        self.counters = collections.defaultdict(_CountingSpan)
+        self.events = collections.deque(maxlen=trace_events) if trace_events else None
+
+    def span(self, name: str):
+        if not self.enabled:
+            return self.counters[name]
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = SpanStats(name, self.window, self)
+        return _TimedSpan(stats)
+
+    def summary(self):
+        result = {name: {'calls': counter.calls} for name, counter in self.counters.items()}
+        for name, stats in self.stats.items():
+            summary = stats.summary()
+            summary['calls'] += result.get(name, {}).get('calls', 0)
+            result[name] = summary
+        return result
+
+    def write_json(self, path: str):
+        with open(path, 'w') as result_file:
+            json.dump(self.summary(), result_file, indent=2)
+
+    def write_chrome_trace(self, path: str):
+        """Recorded events in the Trace Event Format, open with chrome://tracing or Perfetto."""
+        events = [
+            {'name': name, 'ph': 'X', 'ts': start / 1e3, 'dur': duration / 1e3, 'pid': os.getpid(), 'tid': tid}
+            for name, start, duration, tid in (self.events or ())
+        ]
+        with open(path, 'w') as result_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, result_file)
@@ -0,0 +1,160 @@
+import json
+import queue
+import threading
+
+import numpy
+
+import constants
+from simulation import NullRenderer, video_writer
+
+
+class DropPolicy:
+    BLOCK = 'block'
+    DROP_NEWEST = 'drop_newest'
+    DROP_OLDEST = 'drop_oldest'
+
+
+class RawFrameWriter:
+    """Appends frames to a raw memory-mapped file, to be encoded offline with `encode_raw_frames`.
+
+    The file grows by `chunk_frames` frames at a time. Frame shape, dtype and count
+    are kept in a JSON file next to it.
+    """
+
+    def __init__(self, path: str, shape=(constants.WINDOW_HEIGHT, constants.WINDOW_WIDTH, 3),
+                 dtype=numpy.uint8, chunk_frames: int = 256):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        self.chunk_frames = chunk_frames
+        self.frames = 0
+        self._capacity = 0
+        self._memmap = None
+        open(path, 'wb').close()
+
+    def _grow(self):
+        if self._memmap is not None:
+            self._memmap.flush()
+        self._capacity += self.chunk_frames
+        # numpy extends the file to the requested shape
+        self._memmap = numpy.memmap(self.path, dtype=self.dtype, mode='r+', shape=(self._capacity, *self.shape))
+
+    def write(self, frame: numpy.ndarray):
+        if self.frames == self._capacity:
+            self._grow()
+        self._memmap[self.frames] = frame
+        self.frames += 1
+
+    def release(self):
+        if self._memmap is not None:
+            self._memmap.flush()
+            self._memmap = None
+        # Drop the unused tail of the last chunk
+        with open(self.path, 'r+b') as raw_file:
+            raw_file.truncate(self.frames * int(numpy.prod(self.shape)) * self.dtype.itemsize)
+        with open(self.path + '.json', 'w') as meta_file:
+            json.dump({'shape': self.shape, 'dtype': self.dtype.str, 'frames': self.frames}, meta_file)
+
+
+def read_raw_frames(path: str) -> numpy.ndarray:
+    with open(path + '.json') as meta_file:
+        meta = json.load(meta_file)
+    if meta['frames'] == 0:
+        return numpy.empty((0, *meta['shape']), dtype=meta['dtype'])
+    return numpy.memmap(path, dtype=meta['dtype'], mode='r', shape=(meta['frames'], *meta['shape']))
+
+
+def encode_raw_frames(raw_path: str, video_path: str = 'result.mov', fps: int = 30):
+    out = video_writer(video_path, fps)
+    for frame in read_raw_frames(raw_path):
+        out.write(frame)
+    out.release()
+
+
+class AsyncRecorder(NullRenderer):
+    """Records frames on a background thread, so encoding never stalls the simulation loop.
+
+    Frames are copied into buffers from a preallocated pool and handed to the
+    writer (anything with `write(frame)` and `release()`, e.g. `cv2.VideoWriter`
+    or `RawFrameWriter`) through a bounded queue. When the writer falls behind
+    and the pool is exhausted, `drop_policy` decides whether to wait, skip the new
+    frame or overwrite the oldest queued one. An exception of the writer stops
+    the encoder and is raised again by the next `render` and by `close`.
+    """
+
+    needs_frame = True
+
+    def __init__(self, writer, pool_size: int = 8, drop_policy: str = DropPolicy.DROP_OLDEST,
+                 shape=(constants.WINDOW_HEIGHT, constants.WINDOW_WIDTH, 3)):
+        assert drop_policy in (DropPolicy.BLOCK, DropPolicy.DROP_NEWEST, DropPolicy.DROP_OLDEST), \
+            f"Unknown drop policy {drop_policy}"
+        self.writer = writer
+        self.drop_policy = drop_policy
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self._error = None
+        self._closed = False
+
+        self._free = queue.Queue()
+        for _ in range(pool_size):
+            self._free.put(numpy.empty(shape, dtype=numpy.uint8))
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._encode, daemon=True)
+        self._thread.start()
+
+    def _encode(self):
+        try:
+            while True:
+                buffer = self._pending.get()
+                if buffer is None:
+                    break
+                self.writer.write(buffer)
+                self.frames_written += 1
+                self._free.put(buffer)
+        except Exception as error:
+            self._error = error
+            # Wakes a render waiting for a free buffer, it raises the error instead
+            self._free.put(None)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _acquire(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+
+        if self.drop_policy == DropPolicy.DROP_NEWEST:
+            return None
+        if self.drop_policy == DropPolicy.DROP_OLDEST:
+            try:
+                buffer = self._pending.get_nowait()
+                self.frames_dropped += 1
+                return buffer
+            except queue.Empty:
+                # The encoder took the last queued frame just now, its buffer comes back soon
+                pass
+        return self._free.get()
+
+    def render(self, frame: numpy.ndarray):
+        self._raise_error()
+        buffer = self._acquire()
+        if buffer is None:
+            self._raise_error()
+            self.frames_dropped += 1
+            return
+        numpy.copyto(buffer, frame)
+        self._pending.put(buffer)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._pending.put(None)
+            self._thread.join()
+        finally:
+            self.writer.release()
+        self._raise_error()
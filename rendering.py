@@ -0,0 +1,156 @@
+from typing import List
+
+import cv2
+import numpy
+
+import constants
+from constants import Color
+from models import Robot, Ball, MovingObstacle, ObstacleField, Wheel
+
+
+def _item_keys(items: numpy.ndarray) -> numpy.ndarray:
+    # One integer per circle: centre, radius, thickness and color packed into 64 bits
+    x = numpy.clip(items[:, 0] + 2048, 0, 4095)
+    y = numpy.clip(items[:, 1] + 2048, 0, 4095)
+    return (x << 45) | (y << 33) | (items[:, 2] << 27) | ((items[:, 3] + 1) << 24) | \
+        (items[:, 4] << 16) | (items[:, 5] << 8) | items[:, 6]
+
+
+def _keys_extent(keys: numpy.ndarray) -> numpy.ndarray:
+    x = ((keys >> 45) & 4095) - 2048
+    y = ((keys >> 33) & 4095) - 2048
+    reach = ((keys >> 27) & 63) + ((keys >> 24) & 7) + 1
+    return numpy.stack((x - reach, y - reach, x + reach + 1, y + reach + 1), axis=-1)
+
+
+def _items_extent(items: numpy.ndarray) -> numpy.ndarray:
+    reach = items[:, 2] + items[:, 3] + 2
+    return numpy.stack(
+        (items[:, 0] - reach, items[:, 1] - reach, items[:, 0] + reach + 1, items[:, 1] + reach + 1), axis=-1
+    )
+
+
+def _screen_rows(positions: numpy.ndarray, radius: int, thickness: int, color) -> numpy.ndarray:
+    # Vectorized Drawable.get_coords_on_screen, truncating like int() does
+    rows = numpy.empty((len(positions), 7), dtype=numpy.int64)
+    rows[:, 0] = (constants.WINDOW_WIDTH / 2 + constants.k * positions[:, 0]).astype(numpy.int64)
+    rows[:, 1] = (constants.WINDOW_HEIGHT / 2 - constants.k * positions[:, 1]).astype(numpy.int64)
+    rows[:, 2] = radius
+    rows[:, 3] = thickness
+    rows[:, 4:] = color
+    return rows
+
+
+class SceneRenderer:
+    """Draws the scene incrementally into preallocated buffers.
+
+    The world is described as a list of circles in drawing order. A buffer only
+    repaints tiles touched by circles that appeared or disappeared since it was
+    last drawn: moving disks and the newest (and dropped) trail points. Repainted
+    tiles start from the cached static layer and get every circle overlapping them.
+
+    World frames alternate between `buffers` buffers, so a frame handed to the
+    detector stays intact while the next one is drawn. The display frame has its
+    own buffer as well.
+    """
+
+    TILE_SIZE = 40
+
+    def __init__(self, buffers: int = 2):
+        shape = (constants.WINDOW_HEIGHT, constants.WINDOW_WIDTH, 3)
+        self.static_layer = numpy.full(shape, Color.BLACK, dtype=numpy.uint8)
+        self._buffers = [numpy.empty(shape, dtype=numpy.uint8) for _ in range(buffers)]
+        self._drawn_keys = [None for _ in range(buffers)]
+        self._index = 0
+        self.display = numpy.empty(shape, dtype=numpy.uint8)
+
+        # Partial tiles at the bottom and right edges count as whole ones
+        self._tiles_shape = (
+            -(-constants.WINDOW_HEIGHT // SceneRenderer.TILE_SIZE),
+            -(-constants.WINDOW_WIDTH // SceneRenderer.TILE_SIZE)
+        )
+
+    @staticmethod
+    def _circles(robot: Robot, ball: Ball, obstacles: ObstacleField) -> numpy.ndarray:
+        """Rows of (x, y, radius, thickness, color) in the order `Drawable.draw` calls would paint them."""
+        trail = _screen_rows(numpy.array(robot.pos_history).reshape(-1, 2),
+                             Robot.TRAIL_SCREEN_RADIUS, -1, Robot.TRAIL_COLOR)
+        robot_rows = numpy.array([
+            *[(*Wheel.get_coords_on_screen(wheel.get_pos()), wheel.SCREEN_RADIUS, 2, *wheel.COLOR)
+              for wheel in robot.wheels],
+            (*Robot.get_coords_on_screen(robot.get_pos()), Robot.SCREEN_RADIUS, 3, *robot.COLOR),
+        ], dtype=numpy.int64)
+        obstacle_rows = _screen_rows(obstacles.get_positions(), MovingObstacle.SCREEN_RADIUS, -1, MovingObstacle.COLOR)
+        if len(obstacle_rows):
+            obstacle_rows[:, 4:] = [obstacle.COLOR for obstacle in obstacles]
+        ball_row = _screen_rows(numpy.array([ball.get_pos()]), ball.SCREEN_RADIUS, -1, ball.COLOR)
+        return numpy.concatenate([trail, robot_rows, obstacle_rows, ball_row])
+
+    @staticmethod
+    def _paint(buffer: numpy.ndarray, circles: numpy.ndarray, x0: int = 0, y0: int = 0):
+        for x, y, radius, thickness, c0, c1, c2 in circles.tolist():
+            cv2.circle(buffer, (x - x0, y - y0), radius, (c0, c1, c2), thickness=thickness)
+
+    def _dirty_spans(self, extents: numpy.ndarray):
+        tile = SceneRenderer.TILE_SIZE
+        rows, cols = self._tiles_shape
+        dirty = numpy.zeros(self._tiles_shape, dtype=bool)
+        x0 = numpy.clip(extents[:, 0] // tile, 0, cols)
+        y0 = numpy.clip(extents[:, 1] // tile, 0, rows)
+        x1 = numpy.clip(-(-extents[:, 2] // tile), 0, cols)
+        y1 = numpy.clip(-(-extents[:, 3] // tile), 0, rows)
+        for a, b, c, d in zip(y0.tolist(), y1.tolist(), x0.tolist(), x1.tolist()):
+            dirty[a:b, c:d] = True
+
+        # Runs of dirty tiles in a tile row are repainted as one rectangle
+        edges = numpy.diff(numpy.pad(dirty.view(numpy.int8), ((0, 0), (1, 1))), axis=1)
+        starts = numpy.argwhere(edges == 1)
+        ends = numpy.argwhere(edges == -1)
+        for (row, start), (_, end) in zip(starts.tolist(), ends.tolist()):
+            yield (start * tile, row * tile,
+                   min(end * tile, constants.WINDOW_WIDTH), min((row + 1) * tile, constants.WINDOW_HEIGHT))
+
+    def draw_world(self, robot: Robot, ball: Ball, obstacles: ObstacleField) -> numpy.ndarray:
+        """Draws the world into the next buffer and returns it, it stays untouched for `buffers - 1` calls."""
+        buffer = self._buffers[self._index]
+        circles = self._circles(robot, ball, obstacles)
+        keys = _item_keys(circles)
+        drawn_keys = self._drawn_keys[self._index]
+
+        if drawn_keys is None:
+            buffer[...] = self.static_layer
+            self._paint(buffer, circles)
+        else:
+            changed = numpy.setxor1d(drawn_keys, keys)
+            extents = _items_extent(circles)
+            for x0, y0, x1, y1 in self._dirty_spans(_keys_extent(changed)):
+                overlapping = (extents[:, 0] < x1) & (extents[:, 2] > x0) & \
+                              (extents[:, 1] < y1) & (extents[:, 3] > y0)
+                # OpenCV rasterizes thick circles differently when they are clipped, so circles are painted
+                # whole into a scratch area clipped only by the screen and just the span is copied back
+                sx0, sy0 = max(0, min(x0, extents[overlapping, 0].min(initial=x0))), \
+                    max(0, min(y0, extents[overlapping, 1].min(initial=y0)))
+                sx1 = min(constants.WINDOW_WIDTH, max(x1, extents[overlapping, 2].max(initial=x1)))
+                sy1 = min(constants.WINDOW_HEIGHT, max(y1, extents[overlapping, 3].max(initial=y1)))
+                scratch = self.static_layer[sy0:sy1, sx0:sx1].copy()
+                self._paint(scratch, circles[overlapping], sx0, sy0)
+                buffer[y0:y1, x0:x1] = scratch[y0 - sy0:y1 - sy0, x0 - sx0:x1 - sx0]
+
+        self._drawn_keys[self._index] = keys
+        self._index = (self._index + 1) % len(self._buffers)
+        return buffer
+
+    def draw_display(self, world: numpy.ndarray, ball_predicted_positions, barriers_predicted_positions):
+        """Display frame: the world with predicted positions outlined, converted to the window channel order."""
+        cv2.cvtColor(world, cv2.COLOR_BGR2RGB, dst=self.display)
+        # The display is already channel swapped, so outline colors are swapped as well
+        _draw_edges(self.display, ball_predicted_positions, Color.YELLOW[::-1])
+        _draw_edges(self.display, barriers_predicted_positions, Color.GREEN[::-1])
+        return self.display
+
+
+def _draw_edges(screen, predicted_coords: List, color):
+    for coord in predicted_coords:
+        x = int(constants.u0 + constants.k * coord[0])
+        y = int(constants.v0 - constants.k * coord[1])
+        cv2.circle(screen, (x, y), MovingObstacle.SCREEN_RADIUS, color, 2)
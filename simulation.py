@@ -0,0 +1,400 @@
+import collections
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy
+
+import constants
+from constants import Color
+from models import Robot, MovingObstacle, Ball, ObstacleField
+from obstacle_avoidance import dump_obstacle_avoidance
+from obstacle_detection.mser import MSERObstacleDetector
+from profiling import Profiler
+from rendering import SceneRenderer
+from utils import cast_detector_coordinates, cast_detector_velocities, move_to_dot, move_to_dot_again
+from world_model import DistanceField
+
+# Status of episodes cut off by a step limit before reaching the ball or crashing
+TIMEOUT = 'timeout'
+
+
+def generate_obstacles(cnt=10, seed=constants.RANDOM_SEED):
+    barriers = []
+    for i in range(cnt):
+        if seed is not None:
+            random.seed(seed * (i + 1))
+        barrier = MovingObstacle.create_randomized()
+        barriers.append(barrier)
+    return barriers
+
+
+class NullRenderer:
+    """Discards frames. With only null renderers the display frame is never built."""
+
+    needs_frame = False
+
+    def render(self, frame: numpy.ndarray):
+        pass
+
+    def is_open(self) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+
+class FrameRenderer(NullRenderer):
+    """Keeps display frames in memory, optionally only the last `limit` of them."""
+
+    needs_frame = True
+
+    def __init__(self, limit: int = None):
+        self.frames = collections.deque(maxlen=limit)
+
+    def render(self, frame: numpy.ndarray):
+        # Display frames live in a reused buffer
+        self.frames.append(frame.copy())
+
+
+class WindowRenderer(NullRenderer):
+    needs_frame = True
+
+    def __init__(self, window_name: str = 'robot football', delay: int = 1):
+        self.window_name = window_name
+        self.delay = delay
+        self._shown = False
+
+    def render(self, frame: numpy.ndarray):
+        cv2.imshow(self.window_name, frame)
+        self._shown = True
+        self.wait()
+
+    def wait(self):
+        cv2.waitKey(self.delay)
+
+    def is_open(self) -> bool:
+        if not self._shown:
+            return True
+        return cv2.getWindowProperty(self.window_name, cv2.WND_PROP_VISIBLE) >= 1
+
+    def close(self):
+        cv2.destroyAllWindows()
+
+
+def video_writer(path: str = 'result.mov', fps: int = 30) -> cv2.VideoWriter:
+    return cv2.VideoWriter(
+        path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (constants.WINDOW_WIDTH, constants.WINDOW_HEIGHT)
+    )
+
+
+class VideoRenderer(NullRenderer):
+    """Encodes frames synchronously, see `recording.AsyncRecorder` for encoding off the simulation loop."""
+
+    needs_frame = True
+
+    def __init__(self, path: str = 'result.mov', fps: int = 30):
+        self.out = video_writer(path, fps)
+
+    def render(self, frame: numpy.ndarray):
+        self.out.write(frame)
+
+    def close(self):
+        self.out.release()
+
+
+class StageClock:
+    """Tells when a stage running at `rate` Hz of simulated time is due. Without a rate it runs every step."""
+
+    def __init__(self, rate: float = None):
+        self.rate = rate
+        self.reset()
+
+    def reset(self):
+        self.next_time = 0.0
+        self.last_time = None
+        self.elapsed = 0.0
+        self.calls = 0
+
+    def due(self, now: float) -> bool:
+        if self.rate is not None:
+            # Small tolerance against floating point drift of the accumulated simulation time
+            if now < self.next_time - 1e-9:
+                return False
+            self.next_time = max(self.next_time + 1.0 / self.rate, now)
+        self.elapsed = 0.0 if self.last_time is None else now - self.last_time
+        self.last_time = now
+        self.calls += 1
+        return True
+
+
+class Simulation:
+    """Fixed-step simulation of one episode, independent of any display.
+
+    Each `step(dt)` draws the world, runs detection, planning and the movement
+    controller, then advances the physics by `dt` seconds of simulated time.
+    Detection, planning and control can run at their own rates; between planner
+    calls the controller keeps steering with move_to_dot_again.
+
+    Recorders (see `episode_trace.TraceRecorder`) get the state of every step
+    after the stages ran and before the physics advance, along with the frame
+    whose detection was applied in that step, if any. That frame was drawn at
+    `detection_time`.
+
+    With `obstacle_collisions` obstacles bounce off each other, not only off the walls.
+
+    Stages are timed as render, detect, cast, world_model, plan, control,
+    physics and record spans of `profiler`, a disabled one by default.
+
+    With `pipelined` detection runs on a worker thread: the frame drawn in one
+    step is detected while the rest of the step and the drawing of the next
+    frame go on, and the result is taken at the next step. Perception then lags
+    by exactly one step, which the planner gets as `detection_latency`.
+    Detection frames are handed over in the renderer's buffers without copies.
+
+    A `distance_field` is updated with every detection of the obstacles, hand
+    the same one to a planner to query clearances from it.
+    """
+
+    STAGES = ('detect', 'plan', 'control')
+
+    class Status:
+        RUNNING = 'running'
+        REACHED = 'reached'
+        CRASHED = 'crashed'
+
+    CRASH_DISTANCE = 0.001
+
+    def __init__(self, obstacle_detection=None, obstacle_avoidance=dump_obstacle_avoidance,
+                 renderers=(), obstacles_count: int = constants.OBSTACLES_COUNT, seed=constants.RANDOM_SEED,
+                 detection_rate: float = None, planning_rate: float = None, control_rate: float = None,
+                 recorders=(), profiler: Profiler = None, obstacle_collisions: bool = False,
+                 pipelined: bool = False, distance_field: DistanceField = None):
+        self.clocks = {
+            'detect': StageClock(detection_rate),
+            'plan': StageClock(planning_rate),
+            'control': StageClock(control_rate),
+        }
+        self.scene = SceneRenderer()
+        self.obstacle_detection = obstacle_detection if obstacle_detection is not None else MSERObstacleDetector()
+        self.obstacle_avoidance = obstacle_avoidance
+        self.renderers = list(renderers)
+        self.recorders = list(recorders)
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.obstacles_count = obstacles_count
+        self.obstacle_collisions = obstacle_collisions
+        self.seed = seed
+        self.distance_field = distance_field
+        # One detection in flight at a time, its frame buffer is left alone until the next step draws the other one
+        self._detection_worker = ThreadPoolExecutor(max_workers=1) if pipelined else None
+        self._pending_detection = None
+        self.reset()
+
+    def reset(self):
+        self.ball = Ball.create_randomized(seed=self.seed)
+        self.obstacles = ObstacleField.from_obstacles(generate_obstacles(cnt=self.obstacles_count, seed=self.seed))
+        self.robot = Robot(constants.x_start, constants.y_start, constants.theta_start)
+
+        self.ball_predicted_positions = []
+        self.barriers_predicted_positions = []
+        self.barriers_predicted_velocities = None
+        self.target = None
+        self._replanned = False
+        self._controller_state = None
+        if self._pending_detection is not None:
+            # The detector is reset below, let it finish with the old episode first
+            self._pending_detection[0].result()
+            self._pending_detection = None
+        self.detection_latency = 0.0
+        self.detection_wait_time = 0.0
+        self.detection_time = None
+        self._detected_frame = None
+        if self.distance_field is not None:
+            self.distance_field.rebuild([])
+
+        if hasattr(self.obstacle_detection, 'reset'):
+            self.obstacle_detection.reset()
+
+        self.time = 0.0
+        self.steps = 0
+        self.status = Simulation.Status.RUNNING
+        for clock in self.clocks.values():
+            clock.reset()
+
+    @property
+    def reference_color(self):
+        return [(Color.RED, 1), (Color.LIGHTBLUE, self.obstacles_count)]
+
+    def render(self) -> numpy.ndarray:
+        """Draws the world, feeds the display frame to renderers and returns the detector frame."""
+        with self.profiler.span('render'):
+            screen_picture = self.scene.draw_world(self.robot, self.ball, self.obstacles)
+            needs_frame = any(renderer.needs_frame for renderer in self.renderers)
+            if needs_frame:
+                screen = self.scene.draw_display(
+                    screen_picture, self.ball_predicted_positions, self.barriers_predicted_positions
+                )
+        if needs_frame:
+            with self.profiler.span('record'):
+                for renderer in self.renderers:
+                    renderer.render(screen)
+        return screen_picture
+
+    def _forward(self, screen_picture: numpy.ndarray):
+        with self.profiler.span('detect'):
+            return self.obstacle_detection.forward(screen_picture, self.reference_color)
+
+    def _pass_frame_interval(self):
+        # Trackers predict over the simulated time since the previous detection, set while no detection runs
+        elapsed = self.clocks['detect'].elapsed
+        if hasattr(self.obstacle_detection, 'dt') and elapsed > 0:
+            self.obstacle_detection.dt = elapsed
+
+    def detect(self, screen_picture: numpy.ndarray):
+        self._pass_frame_interval()
+        self._apply_detection(*self._forward(screen_picture))
+        self._detected_frame, self.detection_time = screen_picture, self.time
+
+    def submit_detection(self, screen_picture: numpy.ndarray):
+        """Starts detection on the worker thread, the result is applied by `collect_detection`."""
+        assert self._pending_detection is None, 'Only one detection may be in flight'
+        self._pass_frame_interval()
+        future = self._detection_worker.submit(self._forward, screen_picture)
+        self._pending_detection = future, screen_picture, self.time
+
+    def collect_detection(self):
+        """Waits for the detection in flight, if any, and applies it."""
+        if self._pending_detection is None:
+            return
+        future, frame, frame_time = self._pending_detection
+        self._pending_detection = None
+        wait_start = time.perf_counter()
+        result = future.result()
+        self.detection_wait_time += time.perf_counter() - wait_start
+        self.detection_latency = self.time - frame_time
+        self._apply_detection(*result)
+        self._detected_frame, self.detection_time = frame, frame_time
+
+    def _apply_detection(self, ball_predicted_positions, barriers_predicted_positions):
+        with self.profiler.span('cast'):
+            self.ball_predicted_positions = cast_detector_coordinates(ball_predicted_positions)
+            self.barriers_predicted_positions = cast_detector_coordinates(barriers_predicted_positions)
+
+            # Tracking detectors also estimate how obstacles move
+            velocities = getattr(self.obstacle_detection, 'velocities', None)
+            if velocities:
+                self.barriers_predicted_velocities = cast_detector_velocities(velocities[1])
+        if self.distance_field is not None:
+            with self.profiler.span('world_model'):
+                self.distance_field.update(self.barriers_predicted_positions)
+
+    @property
+    def controller_state(self):
+        """(ro, alpha, beta) of the last control step, None before the first one."""
+        return self._controller_state
+
+    def plan(self):
+        with self.profiler.span('plan'):
+            self.target = self.obstacle_avoidance(
+                self.robot.get_pos(), self.ball_predicted_positions, self.barriers_predicted_positions,
+                obstacles_predicted_velocities=self.barriers_predicted_velocities, robot_angle=self.robot.angle,
+                detection_latency=self.detection_latency
+            )
+        self._replanned = True
+        return self.target
+
+    def control(self):
+        with self.profiler.span('control'):
+            if self._replanned:
+                target_x, target_y = self.target
+                vl, vr, ro, alpha, beta = move_to_dot(
+                    target_x, target_y, self.robot.x, self.robot.y,
+                    self.ball_predicted_positions[0][0], self.ball_predicted_positions[0][1], self.robot.angle
+                )
+                self._replanned = False
+            else:
+                ro, alpha, beta = self._controller_state
+                vl, vr, ro, alpha, beta = move_to_dot_again(
+                    ro, alpha, beta, self.robot.angle, self.clocks['control'].elapsed
+                )
+            self._controller_state = ro, alpha, beta
+
+            self.robot.set_velocity(vl, vr)
+        return vl, vr
+
+    def advance(self, dt):
+        self.ball.move(dt)
+        self.robot.move(dt)
+        self.obstacles.advance(dt)
+        if self.obstacle_collisions:
+            self.obstacles.collide()
+
+        self.time += dt
+        self.steps += 1
+
+    def check(self):
+        dist_to_obstacle = self.robot.get_closest_dist_to_obstacle(self.obstacles)
+        dist_to_target = self.robot.get_dist_to_target(self.ball)
+        if dist_to_obstacle < Simulation.CRASH_DISTANCE:
+            self.status = Simulation.Status.CRASHED
+        elif dist_to_target < MovingObstacle.RADIUS + Robot.RADIUS:
+            self.status = Simulation.Status.REACHED
+        return self.status
+
+    def step(self, dt: float):
+        assert self.status == Simulation.Status.RUNNING, 'Episode is over, call reset() first'
+
+        self._detected_frame = None
+        if self.clocks['detect'].due(self.time):
+            screen_picture = self.render()
+            if self._detection_worker is None:
+                self.detect(screen_picture)
+            else:
+                self.collect_detection()
+                self.submit_detection(screen_picture)
+                if self.steps == 0:
+                    # Nothing to plan with yet, the first frame is waited for
+                    self.collect_detection()
+        elif any(renderer.needs_frame for renderer in self.renderers):
+            # Display keeps the simulation rate even when detection runs slower
+            self.render()
+            self.collect_detection()
+        else:
+            self.collect_detection()
+
+        if self.clocks['plan'].due(self.time):
+            self.plan()
+        if self.clocks['control'].due(self.time):
+            self.control()
+
+        if self.recorders:
+            with self.profiler.span('record'):
+                for recorder in self.recorders:
+                    recorder.record(self, self._detected_frame)
+
+        with self.profiler.span('physics'):
+            self.advance(dt)
+            return self.check()
+
+    def achieved_rates(self):
+        """Calls per second of simulated time of every stage."""
+        return {stage: self.clocks[stage].calls / self.time if self.time else 0.0 for stage in Simulation.STAGES}
+
+    def is_open(self) -> bool:
+        return all(renderer.is_open() for renderer in self.renderers)
+
+    def run(self, dt: float, max_steps: int = None):
+        while self.status == Simulation.Status.RUNNING and self.is_open():
+            if max_steps is not None and self.steps >= max_steps:
+                break
+            self.step(dt)
+        return self.status
+
+    def close(self):
+        if self._detection_worker is not None:
+            self._detection_worker.shutdown()
+        for renderer in self.renderers:
+            renderer.close()
+        for recorder in self.recorders:
+            recorder.close()
@@ -0,0 +1,82 @@
+import numpy
+
+import constants
+
+
+class UniformGrid:
+    """Uniform grid hash over 2D points for radius queries.
+
+    Points are sorted by cell key once on construction. Cells of one grid column
+    occupy a contiguous run of keys, so a radius query costs one binary search
+    per overlapped column plus an exact distance check of the candidates.
+    """
+
+    # Keys are column * STRIDE + row, rows of any sane field fit into it
+    STRIDE = 1 << 20
+
+    def __init__(self, positions: numpy.ndarray, cell_size: float,
+                 origin=(constants.WINDOW_CORNERS[0], constants.WINDOW_CORNERS[1])):
+        self.positions = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 2)
+        self.cell_size = cell_size
+        self.origin = numpy.asarray(origin, dtype=numpy.float64)
+
+        cells = self._cells(self.positions)
+        keys = cells[:, 0] * UniformGrid.STRIDE + cells[:, 1]
+        self.order = numpy.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _cells(self, positions: numpy.ndarray) -> numpy.ndarray:
+        # Rows are shifted to stay non-negative for points slightly outside the field
+        cells = numpy.floor((positions - self.origin) / self.cell_size).astype(numpy.int64)
+        cells[:, 1] += UniformGrid.STRIDE // 2
+        return cells
+
+    def candidates(self, point, radius: float) -> numpy.ndarray:
+        """Indices of points in cells overlapping the square around `point`, a superset of the radius query."""
+        low = self._cells(numpy.array([[point[0] - radius, point[1] - radius]]))[0]
+        high = self._cells(numpy.array([[point[0] + radius, point[1] + radius]]))[0]
+
+        columns = numpy.arange(low[0], high[0] + 1) * UniformGrid.STRIDE
+        starts = numpy.searchsorted(self.sorted_keys, columns + low[1], side='left')
+        ends = numpy.searchsorted(self.sorted_keys, columns + high[1], side='right')
+        return numpy.concatenate([self.order[s:e] for s, e in zip(starts, ends)])
+
+    def query_radius(self, point, radius: float) -> numpy.ndarray:
+        indices = self.candidates(point, radius)
+        d = self.positions[indices] - numpy.asarray(point, dtype=numpy.float64)
+        return indices[numpy.einsum('ij,ij->i', d, d) <= radius * radius]
+
+    def pairs(self, radius: float):
+        """All pairs (i, j), i < j, of points at most `radius` apart, `radius` must not exceed the cell size.
+
+        Every cell is matched against itself and four of its neighbours, so each
+        close pair is met once, all cells at the same time.
+        """
+        assert radius <= self.cell_size, 'Pairs are only searched in neighbouring cells'
+        keys = self.sorted_keys
+        if len(keys) == 0:
+            return numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.int64)
+        firsts, seconds = [], []
+        for offset in (0, 1, UniformGrid.STRIDE - 1, UniformGrid.STRIDE, UniformGrid.STRIDE + 1):
+            starts = numpy.searchsorted(keys, keys + offset, side='left')
+            counts = numpy.searchsorted(keys, keys + offset, side='right') - starts
+            total = counts.sum()
+            if total == 0:
+                continue
+            # Concatenated ranges starts[i]:starts[i] + counts[i] of sorted positions
+            first = numpy.repeat(numpy.arange(len(keys)), counts)
+            second = numpy.repeat(starts - (numpy.cumsum(counts) - counts), counts) + numpy.arange(total)
+            if offset == 0:
+                # Within a cell every pair shows up twice and every point meets itself
+                first, second = first[first < second], second[first < second]
+            firsts.append(first)
+            seconds.append(second)
+
+        first = self.order[numpy.concatenate(firsts)]
+        second = self.order[numpy.concatenate(seconds)]
+        d = self.positions[first] - self.positions[second]
+        close = numpy.einsum('ij,ij->i', d, d) <= radius * radius
+        return numpy.minimum(first[close], second[close]), numpy.maximum(first[close], second[close])
@@ -0,0 +1,160 @@
+import random
+
+import numpy
+
+import constants
+from models import Ball, ObstacleField, RobotTeam
+from simulation import generate_obstacles
+from spatial import UniformGrid
+from utils import move_to_dot_batch
+
+
+def chase_ball(simulation, team: int) -> numpy.ndarray:
+    """Every robot of the team heads for the ball."""
+    n = numpy.count_nonzero(simulation.robots.team == team)
+    return numpy.repeat(numpy.array([simulation.ball.get_pos()]), n, axis=0)
+
+
+def closest_chases(simulation, team: int) -> numpy.ndarray:
+    """The active robot closest to the ball chases it, the others keep their formation shifted towards the ball."""
+    robots = simulation.robots.team == team
+    ball = numpy.array(simulation.ball.get_pos())
+    targets = simulation.formations[team] + 0.5 * (ball - simulation.formations[team])
+    active = numpy.flatnonzero(simulation.active[robots])
+    if len(active) == 0:
+        return targets
+    positions = simulation.robots.get_positions()[robots][active]
+    targets[active[numpy.argmin(numpy.hypot(*(positions - ball).T))]] = ball
+    return targets
+
+
+class TeamSimulation:
+    """Fixed-step match of robot teams chasing one ball, simulated on state only.
+
+    Every step each team's strategy picks targets for its robots, an optional
+    `obstacle_avoidance` planner turns them into dots around the other robots
+    and obstacles, and a batched move_to_dot steers all robots at once. Robots
+    that touch each other or an obstacle are out of the match and stop. The
+    match ends when a robot touches the ball, or stalls once no robot is left.
+    """
+
+    class Status:
+        RUNNING = 'running'
+        REACHED = 'reached'
+        STALLED = 'stalled'
+
+    def __init__(self, team_sizes=(5, 5), strategies=(closest_chases, closest_chases), obstacle_avoidance=None,
+                 obstacles_count: int = 0, seed=constants.RANDOM_SEED):
+        assert len(strategies) == len(team_sizes), 'Every team needs its strategy'
+        self.team_sizes = tuple(team_sizes)
+        self.strategies = tuple(strategies)
+        self.obstacle_avoidance = obstacle_avoidance
+        self.obstacles_count = obstacles_count
+        self.seed = seed
+        self.reset()
+
+    def _formation(self, team: int, size: int) -> numpy.ndarray:
+        # Teams line up in columns on their own side of the field, the first team on the left
+        left, bottom, right, top = constants.WINDOW_CORNERS
+        side = -1 if team % 2 == 0 else 1
+        columns = int(numpy.ceil(size / 5))
+        rows = int(numpy.ceil(size / columns))
+        slots = numpy.arange(size)
+        x = side * (right - 0.5 - (slots // rows) * (right - 0.5) / (columns + 1))
+        y = bottom + (slots % rows + 1) * (top - bottom) / (rows + 1)
+        return numpy.stack((x, y), axis=-1)
+
+    def reset(self):
+        self.ball = Ball.create_randomized(seed=self.seed)
+        if self.seed is not None:
+            random.seed(self.seed)
+        self.ball.set_pos(random.uniform(-1., 1.), random.uniform(-1., 1.))
+        self.obstacles = ObstacleField.from_obstacles(generate_obstacles(cnt=self.obstacles_count, seed=self.seed))
+
+        self.formations = [self._formation(team, size) for team, size in enumerate(self.team_sizes)]
+        positions = numpy.concatenate(self.formations)
+        teams = numpy.repeat(numpy.arange(len(self.team_sizes)), self.team_sizes)
+        ball = numpy.array(self.ball.get_pos())
+        angles = numpy.arctan2(ball[1] - positions[:, 1], ball[0] - positions[:, 0])
+        self.robots = RobotTeam(positions[:, 0], positions[:, 1], angles, teams)
+        self.active = numpy.ones(len(self.robots), dtype=bool)
+        self.targets = positions.copy()
+
+        self.time = 0.0
+        self.steps = 0
+        self.status = TeamSimulation.Status.RUNNING
+        self.winner = None
+
+    def plan(self):
+        for team, strategy in enumerate(self.strategies):
+            self.targets[self.robots.team == team] = strategy(self, team)
+        if self.obstacle_avoidance is None:
+            return self.targets
+
+        positions = self.robots.get_positions()
+        speeds = (self.robots.vel_left + self.robots.vel_right) / 2
+        headings = numpy.stack((numpy.cos(self.robots.angle), numpy.sin(self.robots.angle)), axis=-1)
+        velocities = speeds[:, None] * headings
+        obstacles = numpy.concatenate([positions, self.obstacles.get_positions()])
+        obstacle_velocities = numpy.concatenate(
+            [velocities, numpy.stack((self.obstacles.vx, self.obstacles.vy), axis=-1)]
+        )
+        for i in numpy.flatnonzero(self.active):
+            others = numpy.arange(len(obstacles)) != i
+            self.targets[i] = self.obstacle_avoidance(
+                positions[i], [self.targets[i]], obstacles[others],
+                obstacles_predicted_velocities=obstacle_velocities[others], robot_angle=self.robots.angle[i]
+            )
+        return self.targets
+
+    def control(self):
+        ball_x, ball_y = self.ball.get_pos()
+        vl, vr, _, _, _ = move_to_dot_batch(
+            self.targets[:, 0], self.targets[:, 1], self.robots.x, self.robots.y, ball_x, ball_y, self.robots.angle
+        )
+        self.robots.set_velocities(numpy.where(self.active, vl, 0.), numpy.where(self.active, vr, 0.))
+
+    def advance(self, dt):
+        self.ball.move(dt)
+        self.robots.move(dt)
+        self.obstacles.advance(dt)
+
+        self.time += dt
+        self.steps += 1
+
+    def check(self):
+        first, second = self.robots.touching()
+        self.active[first] = False
+        self.active[second] = False
+        if len(self.obstacles):
+            contact = self.robots.RADIUS + self.obstacles.RADIUS
+            grid = UniformGrid(self.obstacles.get_positions(), contact)
+            positions = self.robots.get_positions()
+            for i in numpy.flatnonzero(self.active):
+                # Touching means strictly closer than the contact distance, the query includes its border
+                d = grid.positions[grid.query_radius(positions[i], contact)] - positions[i]
+                if (numpy.einsum('ij,ij->i', d, d) < contact * contact).any():
+                    self.active[i] = False
+
+        dist_to_ball = numpy.hypot(self.robots.x - self.ball.x, self.robots.y - self.ball.y)
+        touching = self.active & (dist_to_ball < self.robots.RADIUS + Ball.RADIUS)
+        if touching.any():
+            self.status = TeamSimulation.Status.REACHED
+            self.winner = int(self.robots.team[numpy.flatnonzero(touching)[numpy.argmin(dist_to_ball[touching])]])
+        elif not self.active.any():
+            self.status = TeamSimulation.Status.STALLED
+        return self.status
+
+    def step(self, dt: float):
+        assert self.status == TeamSimulation.Status.RUNNING, 'Match is over, call reset() first'
+        self.plan()
+        self.control()
+        self.advance(dt)
+        return self.check()
+
+    def run(self, dt: float, max_steps: int = None):
+        while self.status == TeamSimulation.Status.RUNNING:
+            if max_steps is not None and self.steps >= max_steps:
+                break
+            self.step(dt)
+        return self.status
@@ -0,0 +1,57 @@
+import types
+
+from obstacle_detection import adaptive
+from obstacle_detection.adaptive import AdaptiveScaleObstacleDetector
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.
+
+    def perf_counter(self):
+        return self.now
+
+
+class FakeDetector:
+    """Takes `latencies_ms[scale]` of the fake clock per frame."""
+
+    name = 'Fake'
+
+    def __init__(self, scale, clock, latencies_ms):
+        self.scale = scale
+        self.clock = clock
+        self.latencies_ms = latencies_ms
+
+    def forward(self, image, reference_color):
+        self.clock.now += self.latencies_ms[self.scale] / 1e3
+        return [self.scale]
+
+
+def _adaptive(monkeypatch, latencies_ms, **kwargs):
+    clock = FakeClock()
+    monkeypatch.setattr(adaptive, 'time', types.SimpleNamespace(perf_counter=clock.perf_counter))
+    return AdaptiveScaleObstacleDetector(lambda scale: FakeDetector(scale, clock, latencies_ms), **kwargs)
+
+
+def test_drops_to_a_coarser_scale_over_budget(monkeypatch):
+    latencies_ms = {1.0: 40., 0.5: 10., 0.25: 3.}
+    detector = _adaptive(monkeypatch, latencies_ms, budget_ms=20., smoothing=1.)
+    scales = [detector.forward(None, [])[0] for _ in range(5)]
+    # The full scale is tried first, half of it is estimated to fit and measured to fit
+    assert scales == [1.0, 0.5, 0.5, 0.5, 0.5]
+
+
+def test_falls_back_to_the_coarsest_scale(monkeypatch):
+    latencies_ms = {1.0: 400., 0.5: 100., 0.25: 30.}
+    detector = _adaptive(monkeypatch, latencies_ms, budget_ms=20., smoothing=1.)
+    assert [detector.forward(None, [])[0] for _ in range(4)] == [1.0, 0.25, 0.25, 0.25]
+
+
+def test_probes_finer_scales_again_after_probe_interval(monkeypatch):
+    latencies_ms = {1.0: 40., 0.5: 10., 0.25: 3.}
+    detector = _adaptive(monkeypatch, latencies_ms, budget_ms=20., smoothing=1., probe_interval=5)
+    scales = [detector.forward(None, [])[0] for _ in range(4)]
+    # The machine gets faster, the stale full scale measurement keeps it away until the next probe
+    latencies_ms.update({1.0: 16., 0.5: 4.})
+    scales += [detector.forward(None, [])[0] for _ in range(4)]
+    assert scales == [1.0, 0.5, 0.5, 0.5, 0.5, 1.0, 1.0, 1.0]
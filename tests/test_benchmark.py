@@ -0,0 +1,41 @@
+import itertools
+
+import numpy
+import pytest
+
+from obstacle_detection.benchmark import default_scale, hits, l2_obstacles, match_obstacles
+from obstacle_detection.obstacle_utils import DETECTION_SCALE
+
+
+def _brute_force_cost(distances):
+    n, m = distances.shape
+    if n > m:
+        distances, n, m = distances.T, m, n
+    return min(distances[numpy.arange(n), list(columns)].sum() for columns in itertools.permutations(range(m), n))
+
+
+@pytest.mark.parametrize('n_true, n_predicted', [(4, 4), (3, 5), (5, 3), (1, 6)])
+def test_match_obstacles_is_optimal(n_true, n_predicted):
+    rng = numpy.random.default_rng(n_true * 10 + n_predicted)
+    true_obstacles = rng.uniform(-4, 4, (n_true, 2))
+    predicted_obstacles = rng.uniform(-4, 4, (n_predicted, 2))
+
+    matched = match_obstacles(true_obstacles, predicted_obstacles)
+    distances = numpy.linalg.norm(predicted_obstacles[:, None] - true_obstacles[None], axis=-1)
+    assert len(matched) == min(n_true, n_predicted)
+    assert matched.sum() == pytest.approx(_brute_force_cost(distances))
+    assert l2_obstacles(true_obstacles, predicted_obstacles) == pytest.approx(matched.sum())
+
+
+def test_match_obstacles_without_predictions():
+    assert len(match_obstacles([(0., 0.)], numpy.empty((0, 2)))) == 0
+
+
+def test_hits_counts_pairs_under_every_threshold():
+    assert list(hits(numpy.array([0.01, 0.07, 0.3]), (0.05, 0.1, 0.2))) == [1, 2, 2]
+
+
+def test_default_scales_of_registered_detectors():
+    assert default_scale('MSER') == DETECTION_SCALE
+    assert default_scale('MSER+Pyramid') == 0.25
+    assert default_scale('MSER+Adaptive') == 1.0
@@ -0,0 +1,47 @@
+import random
+
+import cv2
+import numpy
+import pytest
+
+import constants
+from obstacle_detection.benchmark import generate_sample
+from obstacle_detection.color_blob import ColorBlobObstacleDetector
+
+REFERENCE_COLOR = [(constants.Color.RED, 1), (constants.Color.LIGHTBLUE, 10)]
+
+
+RADIUS = int(constants.UNITS_RADIUS * constants.k)
+# Disks this close share one core after the distance transform, so their blob is clustered
+OVERLAPPING_CENTERS = [(200, 200), (200 + int(1.2 * RADIUS), 200)]
+
+
+def _overlapping_disks():
+    frame = numpy.zeros((constants.WINDOW_HEIGHT, constants.WINDOW_WIDTH, 3), dtype=numpy.uint8)
+    for center in OVERLAPPING_CENTERS:
+        cv2.circle(frame, center, RADIUS, constants.Color.LIGHTBLUE, thickness=-1)
+    return frame
+
+
+def _frames():
+    random.seed(11)
+    return [_overlapping_disks()] + [
+        generate_sample(constants.WINDOW_HEIGHT, constants.WINDOW_WIDTH, 10)[0] for _ in range(20)
+    ]
+
+
+def test_clustered_blobs_are_split():
+    disks = ColorBlobObstacleDetector().forward(_overlapping_disks(), REFERENCE_COLOR)[1]
+    numpy.testing.assert_allclose(sorted(disks.tolist()), OVERLAPPING_CENTERS, atol=3)
+
+
+@pytest.mark.parametrize('frame_index', range(21))
+def test_same_frame_gives_the_same_detections(frame_index):
+    frame = _frames()[frame_index]
+    results = []
+    for rng_seed in (1, 2):
+        # Whatever state OpenCV's global RNG is in
+        cv2.setRNGSeed(rng_seed)
+        results.append(ColorBlobObstacleDetector().forward(frame, REFERENCE_COLOR))
+    for first, second in zip(*results):
+        numpy.testing.assert_array_equal(first, second)
@@ -0,0 +1,77 @@
+import random
+
+import numpy
+import pytest
+
+import constants
+from detection_service import DetectionService, _detect
+from obstacle_detection.benchmark import generate_sample
+from obstacle_detection.registry import DETECTORS
+
+REFERENCE_COLOR = [(constants.Color.RED, 1), (constants.Color.LIGHTBLUE, 5)]
+
+
+@pytest.fixture
+def service():
+    service = DetectionService('MSER', workers=1, clients=1, slots=2)
+    yield service
+    service.close()
+
+
+def _frames(n):
+    random.seed(3)
+    return [generate_sample(constants.WINDOW_HEIGHT, constants.WINDOW_WIDTH, 5)[0] for _ in range(n)]
+
+
+def test_next_frame_waits_for_the_slot_to_be_read(service):
+    client = service.client(0)
+    frames = _frames(3)
+    tickets = [client.submit(frame, REFERENCE_COLOR) for frame in frames[:2]]
+
+    # Slot 0 is handed out again only once its first request is done
+    slot = client.next_frame()
+    assert tickets[0] not in client._pending
+    slot[...] = frames[2]
+    tickets.append(client.submit(slot, REFERENCE_COLOR))
+
+    detector = DETECTORS['MSER']()
+    for ticket, frame in zip(tickets, frames):
+        for expected, result in zip(detector.forward(frame, REFERENCE_COLOR), client.result(ticket)):
+            numpy.testing.assert_array_equal(numpy.asarray(expected).reshape(-1, 2), result)
+
+
+def test_worker_errors_are_raised_by_the_client(service):
+    client = service.client(0)
+    with pytest.raises(Exception):
+        client.forward(_frames(1)[0], None)
+    # The worker survives and keeps serving
+    assert len(client.forward(_frames(1)[0], REFERENCE_COLOR)) == 2
+
+
+def test_batched_requests_match_single_frames():
+    detector = DETECTORS['MSER']()
+    frames = _frames(3)
+    for frame, results in zip(frames, _detect([detector] * len(frames), frames, REFERENCE_COLOR)):
+        for expected, result in zip(detector.forward(frame, REFERENCE_COLOR), results):
+            numpy.testing.assert_array_equal(numpy.asarray(expected).reshape(-1, 2), result)
+
+
+def test_stateful_detectors_see_only_their_clients_frames():
+    service = DetectionService('Blob+Kalman', workers=2, clients=3, slots=2)
+    try:
+        clients = service.clients()
+        detectors = [DETECTORS['Blob+Kalman']() for _ in clients]
+        frames = _frames(12)
+        for step in range(len(frames)):
+            if step == 6:
+                for client, detector in zip(clients, detectors):
+                    client.reset()
+                    detector.reset()
+            # Clients take turns, so both workers interleave frames of different clients
+            for i, (client, detector) in enumerate(zip(clients, detectors)):
+                image = frames[(step + 4 * i) % len(frames)]
+                for expected, result in zip(detector.forward(image, REFERENCE_COLOR),
+                                            client.forward(image, REFERENCE_COLOR)):
+                    numpy.testing.assert_array_equal(numpy.asarray(expected).reshape(-1, 2), result)
+    finally:
+        service.close()
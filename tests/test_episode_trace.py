@@ -0,0 +1,47 @@
+import numpy
+import pytest
+
+from episode_trace import Trace, TraceRecorder, replay_detection, replay_planning
+from obstacle_avoidance import RolloutObstacleAvoidance
+from obstacle_detection.mser import MSERObstacleDetector
+from obstacle_detection.tracking import TrackingObstacleDetector
+from simulation import Simulation
+
+
+def _planner():
+    # Without a time budget every candidate is evaluated, so plans do not depend on the machine
+    return RolloutObstacleAvoidance(time_budget=numpy.inf)
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+@pytest.mark.parametrize('use_recorded_frames', [False, True])
+def test_replays_match_the_trace(tmp_path, pipelined, use_recorded_frames):
+    recorder = TraceRecorder(str(tmp_path), chunk_steps=8, frames=True)
+    # The tracker estimates velocities, which the planner moves by the detection latency
+    simulation = Simulation(
+        TrackingObstacleDetector(MSERObstacleDetector()), _planner(), recorders=[recorder], pipelined=pipelined,
+        detection_rate=5
+    )
+    simulation.run(0.05, max_steps=30)
+    simulation.close()
+
+    with Trace(str(tmp_path)) as trace:
+        detected = numpy.flatnonzero(trace['detected'])
+        frame_steps = numpy.searchsorted(trace['time'], trace['detection_time'][detected])
+        # Pipelined detections are applied one step after their frame was drawn, but for the first one
+        assert detected[0] == frame_steps[0] == 0
+        numpy.testing.assert_array_equal(detected[1:] - frame_steps[1:], int(pipelined))
+        _, max_error = replay_detection(trace, TrackingObstacleDetector(MSERObstacleDetector()), use_recorded_frames)
+        assert max_error == 0
+        assert (trace['detection_latency'] > 0).any() == pipelined
+        _, _, distances = replay_planning(trace, _planner())
+        assert len(distances) and (distances == 0).all()
+
+
+def test_controller_state_is_recorded(tmp_path):
+    recorder = TraceRecorder(str(tmp_path))
+    simulation = Simulation(MSERObstacleDetector(), recorders=[recorder])
+    simulation.run(0.1, max_steps=3)
+    simulation.close()
+    with Trace(str(tmp_path)) as trace:
+        numpy.testing.assert_array_equal(trace['controller'][-1], simulation.controller_state)
@@ -0,0 +1,57 @@
+import numpy
+import pytest
+
+from models import ObstacleField
+
+R = ObstacleField.RADIUS
+
+
+def test_head_on_pair_swaps_normal_velocities():
+    field = ObstacleField([0., 2 * R - 0.01], [0., 0.], [1., -0.5], [0.3, -0.2])
+    assert field.collide() == 1
+    numpy.testing.assert_allclose(field.vx, [-0.5, 1.])
+    # Tangential components are left alone
+    numpy.testing.assert_allclose(field.vy, [0.3, -0.2])
+    # The overlap is pushed apart symmetrically
+    numpy.testing.assert_allclose(field.x, [-0.005, 2 * R - 0.005])
+
+
+def test_oblique_pair_swaps_normal_components_and_keeps_energy():
+    normal = numpy.array([0.6, 0.8])
+    second = normal * (2 * R - 0.001)
+    field = ObstacleField([0., second[0]], [0., second[1]], [0.7, -0.1], [0.4, -0.6])
+    velocities = numpy.stack((field.vx, field.vy), axis=-1)
+    field.collide()
+    after = numpy.stack((field.vx, field.vy), axis=-1)
+
+    numpy.testing.assert_allclose(after @ normal, (velocities @ normal)[::-1])
+    tangent = numpy.array([-0.8, 0.6])
+    numpy.testing.assert_allclose(after @ tangent, velocities @ tangent)
+    numpy.testing.assert_allclose((after ** 2).sum(), (velocities ** 2).sum())
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_momentum_is_conserved(seed):
+    rng = numpy.random.default_rng(seed)
+    # A crowded field, so many bodies are in several contacts at once
+    field = ObstacleField(*rng.uniform(0, 1.5, (2, 60)), *rng.uniform(-1, 1, (2, 60)))
+    momentum = field.vx.sum(), field.vy.sum()
+    center = field.x.mean(), field.y.mean()
+    assert field.collide() > 0
+    numpy.testing.assert_allclose((field.vx.sum(), field.vy.sum()), momentum, atol=1e-9)
+    numpy.testing.assert_allclose((field.x.mean(), field.y.mean()), center, atol=1e-9)
+
+
+def test_separating_pair_keeps_its_velocities():
+    field = ObstacleField([0., 2 * R - 0.01], [0., 0.], [-1., 0.5], [0., 0.])
+    field.collide()
+    numpy.testing.assert_array_equal(field.vx, [-1., 0.5])
+
+
+def test_separated_bodies_are_untouched():
+    x, y = [0., 2 * R + 0.01, 0.], [0., 0., 2 * R + 0.01]
+    vx, vy = [1., -1., 0.], [0., 0., -1.]
+    field = ObstacleField(x, y, vx, vy)
+    assert field.collide() == 0
+    for actual, expected in ((field.x, x), (field.y, y), (field.vx, vx), (field.vy, vy)):
+        numpy.testing.assert_array_equal(actual, expected)
@@ -0,0 +1,23 @@
+from monte_carlo import episode_seed, run_episode
+from obstacle_detection.color_blob import ColorBlobObstacleDetector
+
+
+def test_episode_seeds_are_reproducible():
+    assert [episode_seed(7, i) for i in range(5)] == [episode_seed(7, i) for i in range(5)]
+    assert episode_seed(7, 0) != episode_seed(8, 0)
+
+
+def test_obstacle_seeds_do_not_collide_across_episodes():
+    n_episodes, n_obstacles = 2000, 10
+    # Simulation seeds the ball with `seed` and obstacle `k` with `seed * (k + 1)`
+    seeds = [episode_seed(42, i) for i in range(n_episodes)]
+    streams = {seed * (k + 1) for seed in seeds for k in range(n_obstacles)}
+    assert len(streams) == n_episodes * n_obstacles
+
+
+def test_episode_reruns_from_its_seed():
+    seed = episode_seed(42, 3)
+    first = run_episode(seed, ColorBlobObstacleDetector(), max_steps=20)
+    second = run_episode(seed, ColorBlobObstacleDetector(), max_steps=20)
+    assert first == second
+    assert first['seed'] == seed
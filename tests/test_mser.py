@@ -0,0 +1,78 @@
+import random
+
+import cv2
+import numpy
+import pytest
+
+import constants
+from obstacle_detection.benchmark import generate_sample
+from obstacle_detection.mser import MSERObstacleDetector
+from obstacle_detection.obstacle_utils import pad_detections, select_points
+
+REFERENCE_COLOR = [(constants.Color.RED, 1), (constants.Color.LIGHTBLUE, 10)]
+
+
+def _frames(seed, n):
+    random.seed(seed)
+    return [generate_sample(constants.WINDOW_HEIGHT, constants.WINDOW_WIDTH, 10)[0] for _ in range(n)]
+
+
+def _hulls(detector, image):
+    image_scaled, image_grayscale = detector._preprocess(image)
+    regions = detector.mser.detectRegions(image_grayscale)
+    return image_scaled, image_grayscale, [cv2.convexHull(p.reshape(-1, 1, 2)) for p in regions[0]]
+
+
+def _full_frame_detect(detector, image):
+    # Hull scoring as it was done with a full-frame mask per hull and a color norm per reference color
+    image_scaled, image_grayscale, hulls = _hulls(detector, image)
+    positions, differences = [], []
+    last_hull_coords = numpy.array([-1000, -1000])
+    for hull in hulls:
+        mask = cv2.fillConvexPoly(numpy.zeros_like(image_grayscale), hull, (255, 255, 255))
+        relevant_pixels = numpy.where(mask)
+        hull_coords = numpy.mean(relevant_pixels, axis=-1)
+        if numpy.linalg.norm(hull_coords - last_hull_coords) <= detector.hull_distance_threshold:
+            continue
+        last_hull_coords = hull_coords
+        positions.append(hull_coords)
+        differences.append([
+            numpy.linalg.norm(image_scaled[relevant_pixels] - color, axis=1).mean() for color, _ in REFERENCE_COLOR
+        ])
+    positions, differences = numpy.array(positions), numpy.array(differences)
+    return [
+        select_points(differences[:, i], positions, cnt, 1 / detector.scale)
+        for i, (_, cnt) in enumerate(REFERENCE_COLOR)
+    ]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_hull_pixels_match_full_frame_masks(seed):
+    detector = MSERObstacleDetector()
+    for frame in _frames(seed, 2):
+        _, image_grayscale, hulls = _hulls(detector, frame)
+        for hull in hulls:
+            expected = numpy.where(cv2.fillConvexPoly(numpy.zeros_like(image_grayscale), hull, 255))
+            for axis, expected_axis in zip(MSERObstacleDetector._hull_pixels(hull), expected):
+                numpy.testing.assert_array_equal(axis, expected_axis)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_forward_matches_full_frame_scoring(seed):
+    detector = MSERObstacleDetector()
+    for frame in _frames(seed, 3):
+        for result, expected in zip(detector.forward(frame, REFERENCE_COLOR), _full_frame_detect(detector, frame)):
+            numpy.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('scale', [1.0, 0.5, 0.25])
+def test_forward_batch_matches_forward(scale):
+    detector = MSERObstacleDetector(scale=scale, threads=2)
+    frames = _frames(7, 4)
+    positions, valid = detector.forward_batch(numpy.stack(frames), REFERENCE_COLOR)
+    expected_positions, expected_valid = pad_detections(
+        [detector.forward(frame, REFERENCE_COLOR) for frame in frames], REFERENCE_COLOR
+    )
+    for result, expected in zip((*positions, *valid), (*expected_positions, *expected_valid)):
+        numpy.testing.assert_array_equal(result, expected)
+    detector.close()
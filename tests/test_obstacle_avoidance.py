@@ -0,0 +1,24 @@
+import numpy
+import pytest
+
+from obstacle_avoidance import RolloutObstacleAvoidance
+
+
+def _plan(time_budget):
+    planner = RolloutObstacleAvoidance(time_budget=time_budget)
+    # An obstacle right between the robot and the ball, so heading for the ball collides
+    planner((-2., 0.), [(2., 0.)], [(-1.5, 0.)], [(0., 0.)], robot_angle=0.)
+    return planner
+
+
+@pytest.mark.parametrize('time_budget', [0., 1e-9])
+def test_coarse_batch_runs_to_the_end_on_any_budget(time_budget):
+    planner = _plan(time_budget)
+    # The ball and every coarse heading, the fine headings are skipped
+    assert planner.last_evaluated == 1 + planner.n_headings // 2 * len(planner.distances)
+    assert planner.last_plan_time > time_budget
+
+
+def test_fine_batch_runs_within_the_budget():
+    planner = _plan(numpy.inf)
+    assert planner.last_evaluated == 1 + planner.n_headings * len(planner.distances)
@@ -0,0 +1,93 @@
+import cv2
+import numpy
+import pytest
+
+from obstacle_detection.color_blob import ColorBlobObstacleDetector
+from obstacle_detection.obstacle_utils import (
+    DETECTION_SCALE, SUPPRESSION_DISTANCE, extract_closest_points, grayscale_batch, remove_too_close_points,
+    remove_too_close_scored_points, scale_batch, scale_image, select_points
+)
+
+
+def _greedy_suppression(points, limit=None):
+    kept = []
+    for i, point in enumerate(points):
+        if all(numpy.linalg.norm(point - points[j]) > SUPPRESSION_DISTANCE for j in kept):
+            kept.append(i)
+            if limit is not None and len(kept) == limit:
+                break
+    return kept
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('limit', [None, 3])
+def test_remove_too_close_points_matches_greedy_scan(seed, limit):
+    rng = numpy.random.default_rng(seed)
+    points = numpy.round(rng.uniform(0, 30, (int(rng.integers(1, 60)), 2)))
+    assert remove_too_close_points(points, limit).tolist() == _greedy_suppression(points, limit)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_scored_points_keep_the_list_api(seed):
+    rng = numpy.random.default_rng(seed)
+    points = [(float(score), point) for score, point in
+              zip(rng.random(40), numpy.round(rng.uniform(0, 30, (40, 2))))]
+    # The list implementation remove_too_close_points had before it worked on arrays
+    expected = []
+    for score, point in points:
+        if all(numpy.linalg.norm(kept - point) > 3 for _, kept in expected):
+            expected.append((score, point))
+    assert remove_too_close_scored_points(points) == expected
+    assert remove_too_close_scored_points([]) == []
+
+
+def test_select_points_keeps_best_separated_points_scaled():
+    scores = numpy.array([5., 1., 2., 300., 3.])
+    points = numpy.array([[10., 10.], [20., 20.], [21., 20.], [40., 40.], [30., 5.]])
+    # (row, col) points come back as scaled (x, y), the duplicate of the best one is dropped
+    assert select_points(scores, points, 3, 2).tolist() == [[40, 40], [10, 60], [20, 20]]
+
+
+def test_select_points_drops_followers_with_large_color_distance():
+    scores = numpy.array([1., 250.])
+    points = numpy.array([[0., 0.], [50., 50.]])
+    assert select_points(scores, points, 2, 1).tolist() == [[0, 0]]
+
+
+def test_extract_closest_points_without_candidates():
+    result = extract_closest_points({(0, 0, 255): []}, [((0, 0, 255), 1)], 2)
+    assert result[0].shape == (0, 2)
+
+
+@pytest.mark.parametrize('scale, kept', [(1, 1), (2, 2), (4, 2)])
+def test_suppression_distance_follows_the_detection_scale(scale, kept):
+    # Two candidates 4 detector pixels apart are duplicates only at full resolution
+    scores = numpy.array([1., 2.])
+    points = numpy.array([[10., 10.], [10., 14.]])
+    assert len(select_points(scores, points, 2, scale)) == kept
+
+
+def test_close_shuts_down_the_batch_threads():
+    detector = ColorBlobObstacleDetector()
+    frames = numpy.zeros((2, 40, 40, 3), dtype=numpy.uint8)
+    detector.forward_batch(frames, [((0, 0, 255), 1)])
+    executor = detector._batch_executor
+    detector.close()
+    assert detector._batch_executor is None and executor._shutdown
+    # A later batch starts a new pool
+    detector.forward_batch(frames, [((0, 0, 255), 1)])
+    detector.close()
+
+
+@pytest.mark.parametrize('scale', [1.0, DETECTION_SCALE, 0.25, 0.3])
+@pytest.mark.parametrize('height', [60, 62])
+def test_scale_batch_matches_single_frames(scale, height):
+    frames = numpy.random.default_rng(0).integers(0, 256, (3, height, 80, 3), dtype=numpy.uint8)
+    expected = numpy.stack([scale_image(frame, scale) for frame in frames])
+    numpy.testing.assert_array_equal(scale_batch(frames, scale), expected)
+
+
+def test_grayscale_batch_matches_single_frames():
+    frames = numpy.random.default_rng(1).integers(0, 256, (3, 30, 40, 3), dtype=numpy.uint8)
+    expected = numpy.stack([cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames])
+    numpy.testing.assert_array_equal(grayscale_batch(frames), expected)
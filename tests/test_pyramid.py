@@ -0,0 +1,44 @@
+import cv2
+import numpy
+import pytest
+
+from obstacle_detection.pyramid import PyramidObstacleDetector
+
+COLOR = (255, 200, 0)
+RADIUS = 10
+
+
+class ShiftedDetector:
+    """Coarse detector stand-in, reports every true center off by `offset` pixels."""
+
+    name = 'Shifted'
+
+    def __init__(self, centers, offset):
+        self.centers = numpy.asarray(centers, dtype=numpy.float64)
+        self.offset = numpy.asarray(offset, dtype=numpy.float64)
+
+    def forward(self, image, reference_color):
+        return [self.centers + self.offset]
+
+
+def _draw_discs(centers, shape=(120, 160, 3)):
+    image = numpy.zeros(shape, dtype=numpy.uint8)
+    for x, y in centers:
+        # Sub-pixel centers with 4 fractional bits
+        cv2.circle(image, (round(x * 16), round(y * 16)), RADIUS * 16, COLOR, thickness=-1, shift=4)
+    return image
+
+
+@pytest.mark.parametrize('offset', [(0., 0.), (3., -2.), (-4.5, 1.5)])
+def test_refinement_finds_disc_centers_at_sub_pixel_accuracy(offset):
+    centers = [(40.25, 30.5), (101.75, 77.125)]
+    detector = PyramidObstacleDetector(ShiftedDetector(centers, offset), disk_radius=RADIUS)
+    refined = detector.forward(_draw_discs(centers), [(COLOR, 2)])[0]
+    numpy.testing.assert_allclose(refined, centers, atol=0.2)
+
+
+def test_candidates_without_enough_color_stay_put():
+    centers = [(40., 30.)]
+    detector = PyramidObstacleDetector(ShiftedDetector([(120., 90.)], (0., 0.)), disk_radius=RADIUS)
+    refined = detector.forward(_draw_discs(centers), [(COLOR, 1)])[0]
+    numpy.testing.assert_array_equal(refined, [(120., 90.)])
@@ -0,0 +1,62 @@
+import time
+
+import numpy
+import pytest
+
+from recording import AsyncRecorder, DropPolicy
+
+
+class FailingWriter:
+    def __init__(self, fail_after):
+        self.fail_after = fail_after
+        self.frames = 0
+        self.released = False
+
+    def write(self, frame):
+        if self.frames == self.fail_after:
+            raise IOError('disk full')
+        self.frames += 1
+
+    def release(self):
+        self.released = True
+
+
+@pytest.mark.parametrize('drop_policy', [DropPolicy.BLOCK, DropPolicy.DROP_NEWEST, DropPolicy.DROP_OLDEST])
+def test_encoder_errors_reach_render_and_close(drop_policy):
+    writer = FailingWriter(fail_after=2)
+    recorder = AsyncRecorder(writer, pool_size=2, drop_policy=drop_policy, shape=(4, 4, 3))
+    frame = numpy.zeros((4, 4, 3), dtype=numpy.uint8)
+    with pytest.raises(IOError):
+        for _ in range(100):
+            recorder.render(frame)
+            recorder._thread.join(timeout=0.01)
+    with pytest.raises(IOError):
+        recorder.close()
+    assert writer.released
+
+
+def test_close_releases_the_writer_once():
+    writer = FailingWriter(fail_after=None)
+    recorder = AsyncRecorder(writer, shape=(4, 4, 3))
+    for _ in range(5):
+        recorder.render(numpy.zeros((4, 4, 3), dtype=numpy.uint8))
+    recorder.close()
+    recorder.close()
+    assert writer.released and writer.frames == recorder.frames_written == 5
+
+
+def test_blocked_render_wakes_up_when_the_encoder_fails():
+    class SlowFailingWriter(FailingWriter):
+        def write(self, frame):
+            time.sleep(0.05)
+            super().write(frame)
+
+    recorder = AsyncRecorder(SlowFailingWriter(fail_after=0), pool_size=1, drop_policy=DropPolicy.BLOCK,
+                             shape=(4, 4, 3))
+    frame = numpy.zeros((4, 4, 3), dtype=numpy.uint8)
+    recorder.render(frame)
+    # The only buffer is still being written, this render waits for it until the writer fails
+    with pytest.raises(IOError):
+        recorder.render(frame)
+    with pytest.raises(IOError):
+        recorder.close()
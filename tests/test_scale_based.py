@@ -0,0 +1,55 @@
+import random
+
+import cv2
+import numpy
+import pytest
+
+import constants
+from obstacle_detection.benchmark import generate_sample
+from obstacle_detection.obstacle_utils import pad_detections
+from obstacle_detection.scale_based import ScaleBasedObstacleDetector
+
+REFERENCE_COLOR = [(constants.Color.RED, 1), (constants.Color.LIGHTBLUE, 10)]
+
+
+def _frames(seed, n):
+    random.seed(seed)
+    return [generate_sample(constants.WINDOW_HEIGHT, constants.WINDOW_WIDTH, 10)[0] for _ in range(n)]
+
+
+def _masked_colors(image, keypoints):
+    # Mean color under a cv2.circle mask per keypoint, drawn with the rounded quarter size as its value
+    colors = []
+    for keypoint in keypoints:
+        x, y = keypoint.pt
+        mask = numpy.zeros(image.shape[:2], numpy.uint8)
+        cv2.circle(mask, (round(x), round(y)), 3, round(keypoint.size / 4), thickness=-1)
+        colors.append(image[numpy.where(mask)].mean(0))
+    return numpy.array(colors)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_sampled_colors_match_circle_masks(seed):
+    rng = numpy.random.default_rng(seed)
+    image = rng.integers(0, 256, (60, 80, 3), dtype=numpy.uint8)
+    # Keypoints anywhere in the image, at its borders and too small to be drawn
+    points = numpy.concatenate([rng.uniform(0, (79, 59), (50, 2)), [[0, 0], [79, 59], [1.5, 58.5], [78.4, 0.6]]])
+    sizes = rng.choice([1., 1.9, 2., 5., 12.], len(points))
+    keypoints = [cv2.KeyPoint(float(x), float(y), float(size)) for (x, y), size in zip(points, sizes)]
+
+    detector = ScaleBasedObstacleDetector('SIFT')
+    with pytest.warns(RuntimeWarning):
+        expected = _masked_colors(image, keypoints)
+    numpy.testing.assert_array_equal(detector._sample_colors(image, keypoints), expected)
+
+
+def test_forward_batch_matches_forward():
+    detector = ScaleBasedObstacleDetector('SIFT', threads=2)
+    frames = _frames(5, 3)
+    positions, valid = detector.forward_batch(numpy.stack(frames), REFERENCE_COLOR)
+    expected_positions, expected_valid = pad_detections(
+        [detector.forward(frame, REFERENCE_COLOR) for frame in frames], REFERENCE_COLOR
+    )
+    for result, expected in zip((*positions, *valid), (*expected_positions, *expected_valid)):
+        numpy.testing.assert_array_equal(result, expected)
+    detector.close()
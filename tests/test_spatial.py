@@ -0,0 +1,32 @@
+import numpy
+import pytest
+
+from spatial import UniformGrid
+
+
+def _brute_force_pairs(points, radius):
+    distances = numpy.linalg.norm(points[:, None] - points[None], axis=-1)
+    first, second = numpy.nonzero(numpy.triu(distances <= radius, k=1))
+    return set(zip(first.tolist(), second.tolist()))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_pairs_match_brute_force(seed):
+    rng = numpy.random.default_rng(seed)
+    points = rng.uniform((-4, -2.5), (4, 2.5), (200, 2))
+    first, second = UniformGrid(points, 0.3).pairs(0.3)
+    assert (first < second).all()
+    assert set(zip(first.tolist(), second.tolist())) == _brute_force_pairs(points, 0.3)
+
+
+def test_pairs_of_no_points():
+    first, second = UniformGrid(numpy.empty((0, 2)), 0.3).pairs(0.3)
+    assert len(first) == len(second) == 0
+
+
+def test_query_radius_matches_brute_force():
+    rng = numpy.random.default_rng(7)
+    points = rng.uniform((-4, -2.5), (4, 2.5), (300, 2))
+    found = UniformGrid(points, 0.5).query_radius((0.3, -0.2), 1.2)
+    expected = numpy.flatnonzero(numpy.linalg.norm(points - (0.3, -0.2), axis=-1) <= 1.2)
+    assert sorted(found.tolist()) == expected.tolist()
@@ -0,0 +1,37 @@
+import numpy
+
+from team import TeamSimulation, closest_chases
+
+
+def test_closest_chases_skips_inactive_robots():
+    simulation = TeamSimulation(team_sizes=(3, 3), seed=7)
+    ball = numpy.array(simulation.ball.get_pos())
+    distances = numpy.hypot(*(simulation.robots.get_positions()[:3] - ball).T)
+    closest, runner_up = numpy.argsort(distances)[:2]
+    simulation.active[closest] = False
+
+    targets = closest_chases(simulation, 0)
+    numpy.testing.assert_array_equal(targets[runner_up], ball)
+    assert not numpy.array_equal(targets[closest], ball)
+
+
+def test_team_without_active_robots_keeps_formation():
+    simulation = TeamSimulation(team_sizes=(2, 2), seed=7)
+    simulation.active[:2] = False
+    ball = numpy.array(simulation.ball.get_pos())
+    assert not (closest_chases(simulation, 0) == ball).all(axis=1).any()
+
+
+def test_match_without_active_robots_stalls():
+    simulation = TeamSimulation(team_sizes=(2, 2), seed=7)
+    simulation.active[:] = False
+    assert simulation.run(0.1) == TeamSimulation.Status.STALLED
+    assert simulation.steps == 1
+
+
+def test_robots_touching_obstacles_drop_out():
+    simulation = TeamSimulation(team_sizes=(2, 2), obstacles_count=3, seed=7)
+    simulation.obstacles.x[0], simulation.obstacles.y[0] = simulation.robots.x[1], simulation.robots.y[1]
+    simulation.check()
+    assert not simulation.active[1]
+    assert simulation.active.sum() == 3
@@ -0,0 +1,24 @@
+import numpy
+import pytest
+
+from obstacle_detection.color_blob import ColorBlobObstacleDetector
+from obstacle_detection.tracking import KalmanTracks, TrackingObstacleDetector
+from simulation import Simulation
+
+
+@pytest.mark.parametrize('dt', [0.05, 0.1, 0.4])
+def test_velocities_follow_the_frame_interval(dt):
+    tracks = KalmanTracks(0.1, measurement_std=0.1, acceleration_std=1., initial_velocity_std=100.)
+    tracks.add(numpy.zeros((1, 2)))
+    for i in range(1, 30):
+        tracks.predict(dt)
+        tracks.update(numpy.array([0]), numpy.array([[2. * i, 0.]]))
+    # 2 pixels per frame
+    numpy.testing.assert_allclose(tracks.velocities[0], (2. / dt, 0.), rtol=1e-2, atol=1e-2)
+
+
+def test_simulation_sets_the_tracker_interval():
+    detector = TrackingObstacleDetector(ColorBlobObstacleDetector())
+    simulation = Simulation(detector, detection_rate=4.)
+    simulation.run(0.05, max_steps=20)
+    assert detector.dt == pytest.approx(0.25)
@@ -0,0 +1,95 @@
+import math
+
+import numpy
+import pytest
+
+import constants
+from models import Robot
+from utils import (
+    calculate_phi_vector, calculate_wheel_velocities, calculate_xi_vector, move_to_dot, move_to_dot_again,
+    move_to_dot_batch
+)
+
+
+def _matrix_wheel_velocities(v, omega, theta):
+    return calculate_phi_vector(calculate_xi_vector(v, omega, theta), theta)
+
+
+def _matrix_move_to_dot(target_x, target_y, robot_x, robot_y, ball_x, ball_y, theta):
+    # move_to_dot as it was written before the closed form, through the rotation matrices
+    dx = target_x - robot_x
+    dy = target_y - robot_y
+    ro_new = math.sqrt(dx ** 2 + dy ** 2)
+    alpha_new = -theta + math.atan2(dy, dx)
+    beta_new = -theta - alpha_new
+    vl, vr = _matrix_wheel_velocities(
+        constants.k_ro * ro_new, constants.k_alpha * alpha_new + constants.k_beta * beta_new, theta
+    )
+    if target_x == ball_x and target_y == ball_y and ro_new < Robot.RADIUS + 1.5:
+        vl, vr = vl + constants.ROBOT_MAX_VELOCITY, vr + constants.ROBOT_MAX_VELOCITY
+    if vl > constants.ROBOT_MAX_VELOCITY or vr > constants.ROBOT_MAX_VELOCITY:
+        if vl > vr:
+            vl, vr = constants.ROBOT_MAX_VELOCITY, constants.ROBOT_MAX_VELOCITY * vr / vl
+        elif vr > vl:
+            vl, vr = constants.ROBOT_MAX_VELOCITY * vl / vr, constants.ROBOT_MAX_VELOCITY
+        else:
+            vl, vr = constants.ROBOT_MAX_VELOCITY, constants.ROBOT_MAX_VELOCITY
+    return vl, vr, ro_new, alpha_new, beta_new
+
+
+def _random_poses(seed, n=200):
+    rng = numpy.random.default_rng(seed)
+    robots = rng.uniform((-4, -2.5), (4, 2.5), (n, 2))
+    targets = rng.uniform((-4, -2.5), (4, 2.5), (n, 2))
+    # Half of the targets are the ball, some of them close enough for the boost
+    balls = numpy.where(rng.random((n, 1)) < 0.5, targets, rng.uniform((-4, -2.5), (4, 2.5), (n, 2)))
+    near = rng.random(n) < 0.25
+    targets[near] = balls[near] = robots[near] + rng.uniform(-0.5, 0.5, (near.sum(), 2))
+    thetas = rng.uniform(-2 * math.pi, 2 * math.pi, n)
+    return targets, robots, balls, thetas
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_wheel_velocities_match_the_matrix_path(seed):
+    rng = numpy.random.default_rng(seed)
+    for v, omega, theta in rng.uniform((-3, -10, -2 * math.pi), (3, 10, 2 * math.pi), (200, 3)):
+        numpy.testing.assert_allclose(
+            calculate_wheel_velocities(v, omega), _matrix_wheel_velocities(v, omega, theta), rtol=1e-12, atol=1e-12
+        )
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_move_to_dot_matches_the_matrix_path(seed):
+    for target, robot, ball, theta in zip(*_random_poses(seed)):
+        numpy.testing.assert_allclose(
+            move_to_dot(*target, *robot, *ball, theta), _matrix_move_to_dot(*target, *robot, *ball, theta),
+            rtol=1e-12, atol=1e-12
+        )
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_move_to_dot_again_matches_the_matrix_path(seed):
+    rng = numpy.random.default_rng(seed)
+    for ro, alpha, beta, theta in rng.uniform((0, -math.pi, -math.pi, -math.pi), (5, math.pi, math.pi, math.pi),
+                                              (200, 4)):
+        dt = 0.1
+        ro_new = ro - constants.k_ro * ro * math.cos(alpha) * dt
+        change_rate = constants.k_ro * math.sin(alpha) - constants.k_alpha * alpha - constants.k_beta * beta
+        alpha_new = alpha + change_rate * dt
+        beta_new = beta - constants.k_ro * math.sin(alpha) * dt
+        vl, vr = _matrix_wheel_velocities(
+            constants.k_ro * ro_new, constants.k_alpha * alpha_new + constants.k_beta * beta_new, theta
+        )
+        numpy.testing.assert_allclose(
+            move_to_dot_again(ro, alpha, beta, theta, dt), (vl, vr, ro_new, alpha_new, beta_new),
+            rtol=1e-12, atol=1e-12
+        )
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_move_to_dot_batch_matches_scalar(seed):
+    targets, robots, balls, thetas = _random_poses(seed)
+    batch = move_to_dot_batch(*targets.T, *robots.T, *balls.T, thetas)
+    scalar = [move_to_dot(*target, *robot, *ball, theta) for target, robot, ball, theta in
+              zip(targets, robots, balls, thetas)]
+    numpy.testing.assert_allclose(numpy.stack(batch, axis=-1), scalar, rtol=1e-12, atol=1e-12)
@@ -0,0 +1,111 @@
+import numpy
+import pytest
+
+import constants
+from simulation import TIMEOUT, Simulation
+from vector_env import ShardedVectorEnv, VectorEnv
+
+
+def _actions(rng, n_worlds):
+    return rng.uniform(-constants.ROBOT_MAX_VELOCITY, constants.ROBOT_MAX_VELOCITY, (n_worlds, 2))
+
+
+def test_state_observation_shape():
+    env = VectorEnv(3, obstacles_count=4)
+    assert env.reset().shape == (3, 8 + 4 * 4)
+    observation, rewards, dones, info = env.step(numpy.zeros((3, 2)))
+    assert observation.shape == (3, 8 + 4 * 4)
+    assert rewards.shape == dones.shape == info['status'].shape == (3,)
+
+
+def test_finished_worlds_report_their_status_and_restart():
+    env = VectorEnv(4, obstacles_count=2, max_steps=50, seed=1)
+    env.reset()
+    obstacles_x, obstacles_y = env._world_obstacles(env.obstacles.x), env._world_obstacles(env.obstacles.y)
+    # Everything far from the robots, which start in the same corner
+    obstacles_x[:], obstacles_y[:] = 0., 0.
+    env.balls.vx[:], env.balls.vy[:] = 0., 0.
+    # World 0 touches the ball, world 1 sits on an obstacle, world 2 runs out of steps, world 3 keeps going
+    env.balls.x[0], env.balls.y[0] = env.robots.x[0] + 0.2, env.robots.y[0]
+    obstacles_x[1, 0], obstacles_y[1, 0] = env.robots.x[1], env.robots.y[1]
+    env.steps[2] = env.max_steps - 1
+
+    _, rewards, dones, info = env.step(numpy.zeros((4, 2)))
+    assert list(info['status']) == [
+        Simulation.Status.REACHED, Simulation.Status.CRASHED, TIMEOUT, Simulation.Status.RUNNING
+    ]
+    assert list(dones) == [True, True, True, False]
+    assert list(info['steps']) == [1, 1, env.max_steps, 1]
+    assert rewards[0] > VectorEnv.REACH_REWARD / 2 and rewards[1] < VectorEnv.CRASH_REWARD / 2
+
+    # Finished worlds already started over, the running one did not
+    assert list(env.steps) == [0, 0, 0, 1]
+    numpy.testing.assert_array_equal(env.robots.x[:3], constants.x_start)
+    assert (env.balls.x[:3] == constants.WINDOW_CORNERS[2] - 1).all()
+
+
+def test_shards_match_unsharded_worlds():
+    steps, seed = 30, 5
+    sharded = ShardedVectorEnv(5, shards=2, seed=seed, obstacles_count=3, max_steps=10)
+    try:
+        # Shard k holds its share of the worlds and is seeded seed + k
+        shards = [VectorEnv(3, obstacles_count=3, max_steps=10, seed=seed),
+                  VectorEnv(2, obstacles_count=3, max_steps=10, seed=seed + 1)]
+        numpy.testing.assert_array_equal(sharded.reset(), numpy.concatenate([env.reset() for env in shards]))
+        rng = numpy.random.default_rng(0)
+        for _ in range(steps):
+            actions = _actions(rng, 5)
+            expected = [env.step(part) for env, part in zip(shards, (actions[:3], actions[3:]))]
+            observation, rewards, dones, info = sharded.step(actions)
+            numpy.testing.assert_array_equal(observation, numpy.concatenate([part[0] for part in expected]))
+            numpy.testing.assert_array_equal(rewards, numpy.concatenate([part[1] for part in expected]))
+            numpy.testing.assert_array_equal(dones, numpy.concatenate([part[2] for part in expected]))
+            for key in info:
+                numpy.testing.assert_array_equal(info[key], numpy.concatenate([part[3][key] for part in expected]))
+    finally:
+        sharded.close()
+
+
+@pytest.mark.parametrize('detector_name', ['MSER', 'Blob'])
+def test_frame_observation_masks(detector_name):
+    env = VectorEnv(2, obstacles_count=3, observation=VectorEnv.Observation.FRAME, detector_name=detector_name,
+                    seed=2)
+    observation = env.reset()
+    for _ in range(3):
+        observation, _, _, _ = env.step(numpy.full((2, 2), 1.))
+
+    assert observation['ball'].shape == (2, 2) and observation['obstacles'].shape == (2, 3, 2)
+    numpy.testing.assert_array_equal(observation['ball_valid'], ~numpy.isnan(observation['ball']).any(axis=-1))
+    numpy.testing.assert_array_equal(
+        observation['obstacles_valid'], ~numpy.isnan(observation['obstacles']).any(axis=-1)
+    )
+    # Detections are packed to the front and lie on the true bodies
+    for world in range(2):
+        valid = observation['obstacles_valid'][world]
+        assert valid.any() and not (~valid[:-1] & valid[1:]).any()
+        truth = numpy.stack((env._world_obstacles(env.obstacles.x)[world],
+                             env._world_obstacles(env.obstacles.y)[world]), axis=-1)
+        offsets = observation['obstacles'][world, valid][:, None, :] - truth[None, :, :]
+        assert (numpy.linalg.norm(offsets, axis=-1).min(axis=1) < 0.1).all()
+        assert observation['ball_valid'][world]
+        assert numpy.hypot(*(observation['ball'][world] - (env.balls.x[world], env.balls.y[world]))) < 0.1
+    env.close()
+
+
+def test_detectors_restart_with_their_worlds():
+    env = VectorEnv(2, obstacles_count=3, observation=VectorEnv.Observation.FRAME, detector_name='Blob+Kalman',
+                    max_steps=2)
+    env.reset()
+    resets = [0, 0]
+    for world, detector in enumerate(env.detectors):
+        reset = detector.reset
+
+        def counted(world=world, reset=reset):
+            resets[world] += 1
+            reset()
+        detector.reset = counted
+
+    for _ in range(2):
+        _, _, dones, _ = env.step(numpy.zeros((2, 2)))
+    assert dones.all() and resets == [1, 1]
+    env.close()
@@ -0,0 +1,51 @@
+import numpy
+import pytest
+
+import constants
+from world_model import DistanceField
+
+
+def _random_positions(rng, n):
+    left, bottom, right, top = constants.WINDOW_CORNERS
+    return numpy.stack((rng.uniform(left, right, n), rng.uniform(bottom, top, n)), axis=-1)
+
+
+def _rebuilt(field):
+    reference = DistanceField(resolution=field.resolution, max_distance=field.max_distance)
+    reference.rebuild(field.positions)
+    return reference.distance
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_shuffled_small_moves_repaint_only_around_them(seed):
+    rng = numpy.random.default_rng(seed)
+    field = DistanceField(max_distance=0.3)
+    positions = _random_positions(rng, 10)
+    field.rebuild(positions)
+
+    for _ in range(5):
+        moved = rng.random(len(positions)) < 0.3
+        positions = positions + moved[:, None] * rng.normal(0., 0.03, positions.shape)
+        # Detectors list obstacles by score, not in the order they were painted in
+        field.update(positions[rng.permutation(len(positions))])
+        assert field.repainted_cells < field.distance.size / 4
+        numpy.testing.assert_array_equal(field.distance, _rebuilt(field))
+
+
+def test_unmoved_obstacles_in_any_order_repaint_nothing():
+    rng = numpy.random.default_rng(0)
+    field = DistanceField()
+    positions = _random_positions(rng, 10)
+    field.rebuild(positions)
+    field.update(positions[::-1])
+    assert field.repainted_cells == 0
+
+
+@pytest.mark.parametrize('count', [0, 7, 10, 12])
+def test_appearing_and_disappearing_obstacles(count):
+    rng = numpy.random.default_rng(count)
+    field = DistanceField(max_distance=0.3)
+    field.rebuild(_random_positions(rng, 10))
+    field.update(_random_positions(rng, count))
+    assert len(field.positions) == count
+    numpy.testing.assert_array_equal(field.distance, _rebuilt(field))
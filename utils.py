@@ -26,6 +26,28 @@ def calculate_phi_vector(ksi, theta):
     return phi[1][0], phi[0][0]
 
 
+def calculate_wheel_velocities(v, omega):
+    # Closed form of calculate_phi_vector(calculate_xi_vector(v, omega, theta), theta):
+    # rotating the world frame velocity back into the robot frame cancels theta out
+    return (v - constants.l * omega) / constants.r, (v + constants.l * omega) / constants.r
+
+
+def _limit_velocities(vl_chosen, vr_chosen):
+    if vl_chosen > constants.ROBOT_MAX_VELOCITY or vr_chosen > constants.ROBOT_MAX_VELOCITY:
+        if vl_chosen > vr_chosen:
+            diff = vr_chosen / vl_chosen
+            vl_chosen = constants.ROBOT_MAX_VELOCITY
+            vr_chosen = vl_chosen * diff
+        elif vr_chosen > vl_chosen:
+            diff = vl_chosen / vr_chosen
+            vr_chosen = constants.ROBOT_MAX_VELOCITY
+            vl_chosen = vr_chosen * diff
+        else:
+            vl_chosen = constants.ROBOT_MAX_VELOCITY
+            vr_chosen = constants.ROBOT_MAX_VELOCITY
+    return vl_chosen, vr_chosen
+
+
 def move_to_dot(target_x, target_y, robot_x, robot_y, ball_x, ball_y, theta):
     # x and y here are robot coordinates
     dx = target_x - robot_x
@@ -38,8 +60,7 @@ def move_to_dot(target_x, target_y, robot_x, robot_y, ball_x, ball_y, theta):
     v = constants.k_ro * ro_new
     omega = constants.k_alpha * alpha_new + constants.k_beta * beta_new
 
-    ksi = calculate_xi_vector(v, omega, theta)
-    vl_chosen, vr_chosen = calculate_phi_vector(ksi, theta)
+    vl_chosen, vr_chosen = calculate_wheel_velocities(v, omega)
 
     # We should move faster if target is ball and it is close to our robot
     if target_x == ball_x and target_y == ball_y:
@@ -48,49 +69,71 @@ def move_to_dot(target_x, target_y, robot_x, robot_y, ball_x, ball_y, theta):
             vl_chosen = vl_chosen + constants.ROBOT_MAX_VELOCITY
             vr_chosen = vr_chosen + constants.ROBOT_MAX_VELOCITY
 
-    if vl_chosen > constants.ROBOT_MAX_VELOCITY or vr_chosen > constants.ROBOT_MAX_VELOCITY:
-        if vl_chosen > vr_chosen:
-            diff = vr_chosen / vl_chosen
-            vl_chosen = constants.ROBOT_MAX_VELOCITY
-            vr_chosen = vl_chosen * diff
-        elif vr_chosen > vl_chosen:
-            diff = vl_chosen / vr_chosen
-            vr_chosen = constants.ROBOT_MAX_VELOCITY
-            vl_chosen = vr_chosen * diff
-        else:
-            vl_chosen = constants.ROBOT_MAX_VELOCITY
-            vr_chosen = constants.ROBOT_MAX_VELOCITY
+    vl_chosen, vr_chosen = _limit_velocities(vl_chosen, vr_chosen)
+
+    return vl_chosen, vr_chosen, ro_new, alpha_new, beta_new
+
+
+def move_to_dot_batch(target_x, target_y, robot_x, robot_y, ball_x, ball_y, theta):
+    """move_to_dot for arrays of robots and/or targets, all arguments broadcast against each other."""
+    dx = numpy.subtract(target_x, robot_x)
+    dy = numpy.subtract(target_y, robot_y)
+
+    ro_new = numpy.sqrt(dx ** 2 + dy ** 2)
+    alpha_new = -theta + numpy.arctan2(dy, dx)
+    beta_new = -theta - alpha_new
+
+    v = constants.k_ro * ro_new
+    omega = constants.k_alpha * alpha_new + constants.k_beta * beta_new
+
+    vl_chosen, vr_chosen = calculate_wheel_velocities(v, omega)
+
+    boost = (numpy.equal(target_x, ball_x) & numpy.equal(target_y, ball_y)) & (ro_new < Robot.RADIUS + 1.5)
+    vl_chosen = vl_chosen + boost * constants.ROBOT_MAX_VELOCITY
+    vr_chosen = vr_chosen + boost * constants.ROBOT_MAX_VELOCITY
+
+    max_velocity = constants.ROBOT_MAX_VELOCITY
+    limited = (vl_chosen > max_velocity) | (vr_chosen > max_velocity)
+    left = limited & (vl_chosen > vr_chosen)
+    right = limited & (vr_chosen > vl_chosen)
+    equal = limited & (vl_chosen == vr_chosen)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        vl_limited = numpy.where(left | equal, max_velocity, max_velocity * (vl_chosen / vr_chosen))
+        vr_limited = numpy.where(right | equal, max_velocity, max_velocity * (vr_chosen / vl_chosen))
+    vl_chosen = numpy.where(limited, vl_limited, vl_chosen)
+    vr_chosen = numpy.where(limited, vr_limited, vr_chosen)
 
     return vl_chosen, vr_chosen, ro_new, alpha_new, beta_new
 
 
 def move_to_dot_again(ro, alpha, beta, theta, dt):
-    change_rate = numpy.array(
-        [
-            [-constants.k_ro * ro * math.cos(alpha)],
-            [constants.k_ro * math.sin(alpha) - constants.k_alpha * alpha - constants.k_beta * beta],
-            [-constants.k_ro * math.sin(alpha)],
-        ]
-    )
-
-    ro_new = ro + change_rate[0][0] * dt
-    alpha_new = alpha + change_rate[1][0] * dt
-    beta_new = beta + change_rate[2][0] * dt
+    ro_new = ro - constants.k_ro * ro * math.cos(alpha) * dt
+    alpha_new = alpha + (constants.k_ro * math.sin(alpha) - constants.k_alpha * alpha - constants.k_beta * beta) * dt
+    beta_new = beta - constants.k_ro * math.sin(alpha) * dt
 
     v = constants.k_ro * ro_new
     omega = constants.k_alpha * alpha_new + constants.k_beta * beta_new
 
-    ksi = calculate_xi_vector(v, omega, theta)
-    vl_chosen, vr_chosen = calculate_phi_vector(ksi, theta)
+    vl_chosen, vr_chosen = calculate_wheel_velocities(v, omega)
 
     return vl_chosen, vr_chosen, ro_new, alpha_new, beta_new
 
 
 def cast_detector_coordinates(coords):
+    # Any (..., 2) array of pixel coordinates, e.g. padded batches of detections
     local_coords = coords.copy()
     # shift
-    local_coords[:, 0] = local_coords[:, 0] - constants.WINDOW_WIDTH / 2
-    local_coords[:, 1] = constants.WINDOW_HEIGHT / 2 - local_coords[:, 1]
+    local_coords[..., 0] = local_coords[..., 0] - constants.WINDOW_WIDTH / 2
+    local_coords[..., 1] = constants.WINDOW_HEIGHT / 2 - local_coords[..., 1]
     # scale
     local_coords = local_coords / constants.k
     return local_coords
+
+
+def cast_detector_velocities(velocities):
+    local_velocities = velocities.copy()
+    # screen y axis points down
+    local_velocities[..., 1] = -local_velocities[..., 1]
+    # scale
+    local_velocities = local_velocities / constants.k
+    return local_velocities
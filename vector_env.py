@@ -0,0 +1,258 @@
+import multiprocessing
+
+import numpy
+
+import constants
+from constants import Color
+from models import Robot, Ball, MovingObstacle, ObstacleField, RobotTeam
+from obstacle_detection.registry import DETECTORS
+from rendering import SceneRenderer
+from simulation import TIMEOUT, Simulation
+from utils import cast_detector_coordinates, move_to_dot_batch
+
+
+class VectorEnv:
+    """`n_worlds` independent episodes of the robot chasing the ball, stepped together.
+
+    Robots, balls and obstacles of all worlds live in one `RobotTeam` and two
+    `ObstacleField`s, so a step of every world is a handful of batched NumPy
+    calls. Worlds that finish are reset on the spot and report their final
+    status in the step info.
+
+    Actions are wheel velocities (`Action.WHEELS`, shape (B, 2)) or dots for
+    move_to_dot (`Action.DOT`, shape (B, 2)). Observations are the true state
+    (`Observation.STATE`, shape (B, 8 + 4 * obstacles)) or what a detector sees
+    on the drawn frames (`Observation.FRAME`, a dict of detected ball and
+    obstacle positions padded to the obstacle count, with validity masks).
+    """
+
+    class Action:
+        WHEELS = 'wheels'
+        DOT = 'dot'
+
+    class Observation:
+        STATE = 'state'
+        FRAME = 'frame'
+
+    REACH_REWARD = 10.
+    CRASH_REWARD = -10.
+
+    def __init__(self, n_worlds: int, obstacles_count: int = constants.OBSTACLES_COUNT,
+                 observation: str = Observation.STATE, action: str = Action.WHEELS, detector_name: str = 'MSER',
+                 dt: float = 0.1, max_steps: int = 3000, seed=constants.RANDOM_SEED):
+        assert observation in (VectorEnv.Observation.STATE, VectorEnv.Observation.FRAME), \
+            f"Unknown observation mode {observation}"
+        assert action in (VectorEnv.Action.WHEELS, VectorEnv.Action.DOT), f"Unknown action mode {action}"
+        self.n_worlds = n_worlds
+        self.obstacles_count = obstacles_count
+        self.observation = observation
+        self.action = action
+        self.dt = dt
+        self.max_steps = max_steps
+        self.rng = numpy.random.default_rng(seed)
+
+        self.robots = RobotTeam(numpy.zeros(n_worlds), numpy.zeros(n_worlds), numpy.zeros(n_worlds))
+        self.balls = ObstacleField(*numpy.zeros((4, n_worlds)))
+        self.obstacles = ObstacleField(*numpy.zeros((4, n_worlds * obstacles_count)))
+        self.steps = numpy.zeros(n_worlds, dtype=numpy.int64)
+        self._distances = numpy.zeros(n_worlds)
+
+        if observation == VectorEnv.Observation.FRAME:
+            # Drawing and detection work on one world at a time, through views into the batched state
+            self.scenes = [SceneRenderer(buffers=1) for _ in range(n_worlds)]
+            self.detectors = [DETECTORS[detector_name]() for _ in range(n_worlds)]
+            self.ball_views = [self.balls.rows(i, i + 1, Ball)[0] for i in range(n_worlds)]
+            self.obstacle_views = [
+                self.obstacles.rows(i * obstacles_count, (i + 1) * obstacles_count) for i in range(n_worlds)
+            ]
+            self.robot_views = [None] * n_worlds
+
+    def _world_obstacles(self, values: numpy.ndarray) -> numpy.ndarray:
+        return values.reshape(self.n_worlds, self.obstacles_count)
+
+    def _reset_worlds(self, worlds: numpy.ndarray):
+        n = len(worlds)
+        if n == 0:
+            return
+        low = numpy.array(constants.WINDOW_CORNERS[:2]) + MovingObstacle.RADIUS * 2
+        high = numpy.array(constants.WINDOW_CORNERS[2:]) - MovingObstacle.RADIUS * 2
+
+        # Same layout as Simulation.reset: the robot in a corner and the ball near the opposite one
+        self.robots.x[worlds] = constants.x_start
+        self.robots.y[worlds] = constants.y_start
+        self.robots.angle[worlds] = constants.theta_start
+        self.robots.vel_left[worlds] = 0.
+        self.robots.vel_right[worlds] = 0.
+        self.balls.x[worlds] = constants.WINDOW_CORNERS[2] - 1
+        self.balls.y[worlds] = constants.WINDOW_CORNERS[3] - 1
+        self.balls.vx[worlds], self.balls.vy[worlds] = self.rng.normal(0., Ball.VELOCITY_RANGE, (2, n))
+
+        shape = (n, self.obstacles_count)
+        self._world_obstacles(self.obstacles.x)[worlds] = self.rng.uniform(low[0], high[0], shape)
+        self._world_obstacles(self.obstacles.y)[worlds] = self.rng.uniform(low[1], high[1], shape)
+        self._world_obstacles(self.obstacles.vx)[worlds] = self.rng.normal(0., MovingObstacle.VELOCITY_RANGE, shape)
+        self._world_obstacles(self.obstacles.vy)[worlds] = self.rng.normal(0., MovingObstacle.VELOCITY_RANGE, shape)
+
+        self.steps[worlds] = 0
+        self._distances[worlds] = self._distances_to_ball()[worlds]
+        if self.observation == VectorEnv.Observation.FRAME:
+            for world in worlds:
+                self.robot_views[world] = Robot(constants.x_start, constants.y_start, constants.theta_start)
+                # Tracks of the finished episode must not carry over into the new one
+                if hasattr(self.detectors[world], 'reset'):
+                    self.detectors[world].reset()
+
+    def _distances_to_ball(self) -> numpy.ndarray:
+        return numpy.hypot(self.robots.x - self.balls.x, self.robots.y - self.balls.y)
+
+    def _clearances(self) -> numpy.ndarray:
+        if self.obstacles_count == 0:
+            return numpy.full(self.n_worlds, numpy.inf)
+        dx = self._world_obstacles(self.obstacles.x) - self.robots.x[:, None]
+        dy = self._world_obstacles(self.obstacles.y) - self.robots.y[:, None]
+        return numpy.sqrt(dx * dx + dy * dy).min(axis=1) - MovingObstacle.RADIUS - Robot.RADIUS
+
+    def _state_observation(self) -> numpy.ndarray:
+        obstacles = numpy.stack([
+            self._world_obstacles(values) for values in
+            (self.obstacles.x, self.obstacles.y, self.obstacles.vx, self.obstacles.vy)
+        ], axis=-1).reshape(self.n_worlds, -1)
+        return numpy.concatenate([
+            numpy.stack((self.robots.x, self.robots.y, numpy.cos(self.robots.angle), numpy.sin(self.robots.angle),
+                         self.balls.x, self.balls.y, self.balls.vx, self.balls.vy), axis=-1),
+            obstacles
+        ], axis=-1)
+
+    def _frame_observation(self):
+        balls = numpy.full((self.n_worlds, 2), numpy.nan)
+        obstacles = numpy.full((self.n_worlds, self.obstacles_count, 2), numpy.nan)
+        reference_color = [(Color.RED, 1), (Color.LIGHTBLUE, self.obstacles_count)]
+        for world in range(self.n_worlds):
+            screen = self.scenes[world].draw_world(
+                self.robot_views[world], self.ball_views[world], self.obstacle_views[world]
+            )
+            ball_positions, obstacle_positions = self.detectors[world].forward(screen, reference_color)
+            if len(ball_positions):
+                balls[world] = cast_detector_coordinates(ball_positions.reshape(-1, 2))[0]
+            if len(obstacle_positions):
+                detected = cast_detector_coordinates(obstacle_positions.reshape(-1, 2))[:self.obstacles_count]
+                obstacles[world, :len(detected)] = detected
+        return {
+            'ball': balls, 'ball_valid': ~numpy.isnan(balls[:, 0]),
+            'obstacles': obstacles, 'obstacles_valid': ~numpy.isnan(obstacles[..., 0]),
+        }
+
+    def observe(self):
+        if self.observation == VectorEnv.Observation.FRAME:
+            return self._frame_observation()
+        return self._state_observation()
+
+    def reset(self):
+        self._reset_worlds(numpy.arange(self.n_worlds))
+        return self.observe()
+
+    def step(self, actions: numpy.ndarray):
+        """Advances every world by `dt`, returns observations, rewards, dones and an info dict of arrays."""
+        actions = numpy.asarray(actions, dtype=numpy.float64).reshape(self.n_worlds, 2)
+        if self.action == VectorEnv.Action.DOT:
+            vel_left, vel_right, _, _, _ = move_to_dot_batch(
+                actions[:, 0], actions[:, 1], self.robots.x, self.robots.y, self.balls.x, self.balls.y,
+                self.robots.angle
+            )
+        else:
+            vel_left, vel_right = numpy.clip(actions, -constants.ROBOT_MAX_VELOCITY, constants.ROBOT_MAX_VELOCITY).T
+        self.robots.set_velocities(vel_left, vel_right)
+
+        self.balls.advance(self.dt)
+        self.robots.move(self.dt)
+        self.obstacles.advance(self.dt)
+        self.steps += 1
+
+        distances = self._distances_to_ball()
+        crashed = self._clearances() < Simulation.CRASH_DISTANCE
+        reached = ~crashed & (distances < MovingObstacle.RADIUS + Robot.RADIUS)
+        timeout = ~crashed & ~reached & (self.steps >= self.max_steps)
+        rewards = self._distances - distances + \
+            numpy.where(reached, VectorEnv.REACH_REWARD, 0.) + numpy.where(crashed, VectorEnv.CRASH_REWARD, 0.)
+        self._distances = distances
+
+        dones = crashed | reached | timeout
+        status = numpy.full(self.n_worlds, Simulation.Status.RUNNING, dtype=object)
+        status[crashed] = Simulation.Status.CRASHED
+        status[reached] = Simulation.Status.REACHED
+        status[timeout] = TIMEOUT
+        info = {'status': status, 'steps': self.steps.copy()}
+
+        if self.observation == VectorEnv.Observation.FRAME:
+            for world in numpy.flatnonzero(~dones):
+                self.robot_views[world].set_angle(self.robots.angle[world])
+                self.robot_views[world].set_pos(self.robots.x[world], self.robots.y[world])
+        self._reset_worlds(numpy.flatnonzero(dones))
+        return self.observe(), rewards, dones, info
+
+    def close(self):
+        if self.observation != VectorEnv.Observation.FRAME:
+            return
+        for detector in self.detectors:
+            if hasattr(detector, 'close'):
+                detector.close()
+
+
+def _shard_worker(connection, kwargs):
+    env = VectorEnv(**kwargs)
+    while True:
+        command, data = connection.recv()
+        if command == 'reset':
+            connection.send(env.reset())
+        elif command == 'step':
+            connection.send(env.step(data))
+        else:
+            break
+    env.close()
+    connection.close()
+
+
+def _concatenate(parts):
+    if isinstance(parts[0], dict):
+        return {key: numpy.concatenate([part[key] for part in parts]) for key in parts[0]}
+    return numpy.concatenate(parts)
+
+
+class ShardedVectorEnv:
+    """`VectorEnv` split into `shards` sub-processes, each stepping its share of the worlds.
+
+    Shards are seeded `seed + shard`, results come back concatenated in world order.
+    """
+
+    def __init__(self, n_worlds: int, shards: int, seed=constants.RANDOM_SEED, **kwargs):
+        assert seed is not None, 'Shards need a seed to be reproducible'
+        sizes = [len(part) for part in numpy.array_split(numpy.arange(n_worlds), shards)]
+        self.bounds = numpy.cumsum([0] + sizes)
+        self.connections = []
+        self.processes = []
+        for shard, size in enumerate(sizes):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_shard_worker, args=(child, dict(kwargs, n_worlds=size, seed=seed + shard)), daemon=True
+            )
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def reset(self):
+        for connection in self.connections:
+            connection.send(('reset', None))
+        return _concatenate([connection.recv() for connection in self.connections])
+
+    def step(self, actions: numpy.ndarray):
+        actions = numpy.asarray(actions, dtype=numpy.float64).reshape(-1, 2)
+        for shard, connection in enumerate(self.connections):
+            connection.send(('step', actions[self.bounds[shard]:self.bounds[shard + 1]]))
+        observations, rewards, dones, infos = zip(*[connection.recv() for connection in self.connections])
+        return _concatenate(observations), numpy.concatenate(rewards), numpy.concatenate(dones), _concatenate(infos)
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(('close', None))
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,153 @@
+import numpy
+from scipy.optimize import linear_sum_assignment
+
+import constants
+
+
+class DistanceField:
+    """Occupancy grid and distance field of the field, kept up to date from obstacle detections.
+
+    The field within `corners` is split into square cells of `resolution`
+    metres. Every cell holds the distance from its center to the closest
+    obstacle surface, negative inside obstacles, capped at `max_distance`.
+    With `walls` the field borders count as obstacles as well.
+
+    `update` takes the detected obstacle positions in any order, detectors sort
+    them by score. They are matched to the painted obstacles with the least
+    total displacement. Only obstacles that moved more than `move_tolerance`
+    since they were last painted, appeared or disappeared are repainted, and
+    only the cells their old and new discs cover are recomputed.
+
+    `clearance` and `gradient` interpolate between the four cells around a
+    point, so each query costs the same whatever the obstacle count.
+    """
+
+    def __init__(self, resolution: float = 0.02, max_distance: float = 1.,
+                 obstacle_radius: float = constants.UNITS_RADIUS, corners=constants.WINDOW_CORNERS, walls: bool = False,
+                 move_tolerance: float = None):
+        self.resolution = resolution
+        self.max_distance = max_distance
+        self.obstacle_radius = obstacle_radius
+        self.origin = numpy.array(corners[:2], dtype=numpy.float64)
+        self.shape = (
+            int(numpy.ceil((corners[3] - corners[1]) / resolution)),
+            int(numpy.ceil((corners[2] - corners[0]) / resolution))
+        )
+        self.move_tolerance = move_tolerance if move_tolerance is not None else resolution / 4
+        # Cells of a painted disc reach this many cells away from the obstacle's cell
+        self.reach = int(numpy.ceil((max_distance + obstacle_radius) / resolution)) + 1
+
+        # Cell centers along both axes
+        self.xs = self.origin[0] + (numpy.arange(self.shape[1]) + 0.5) * resolution
+        self.ys = self.origin[1] + (numpy.arange(self.shape[0]) + 0.5) * resolution
+        self.static_layer = numpy.full(self.shape, max_distance)
+        if walls:
+            to_walls = numpy.minimum.outer(
+                numpy.minimum(self.ys - corners[1], corners[3] - self.ys),
+                numpy.minimum(self.xs - corners[0], corners[2] - self.xs)
+            )
+            numpy.minimum(self.static_layer, to_walls, out=self.static_layer)
+
+        self.distance = self.static_layer.copy()
+        self.positions = numpy.empty((0, 2))
+        self.repainted_cells = 0
+
+    @property
+    def occupancy(self) -> numpy.ndarray:
+        """Cells whose center lies inside an obstacle (or beyond a wall)."""
+        return self.distance <= 0
+
+    def _window(self, position: numpy.ndarray):
+        col, row = numpy.floor((position - self.origin) / self.resolution).astype(numpy.int64)
+        return (
+            max(0, row - self.reach), min(self.shape[0], row + self.reach + 1),
+            max(0, col - self.reach), min(self.shape[1], col + self.reach + 1)
+        )
+
+    def _paint(self, position: numpy.ndarray, box=None):
+        row0, row1, col0, col1 = self._window(position)
+        if box is not None:
+            row0, row1, col0, col1 = max(row0, box[0]), min(row1, box[1]), max(col0, box[2]), min(col1, box[3])
+        if row0 >= row1 or col0 >= col1:
+            return
+        distances = numpy.hypot(
+            self.xs[col0:col1][None, :] - position[0], self.ys[row0:row1][:, None] - position[1]
+        ) - self.obstacle_radius
+        window = self.distance[row0:row1, col0:col1]
+        numpy.minimum(window, distances, out=window)
+
+    def rebuild(self, positions):
+        """Repaints the whole field for obstacles at `positions`."""
+        self.positions = numpy.array(positions, dtype=numpy.float64).reshape(-1, 2)
+        self.distance[...] = self.static_layer
+        for position in self.positions:
+            self._paint(position)
+        self.repainted_cells = self.distance.size
+
+    def update(self, positions):
+        """Moves the obstacles to `positions`, matched to the painted ones whatever their order."""
+        positions = numpy.array(positions, dtype=numpy.float64).reshape(-1, 2)
+        offsets = positions[:, None, :] - self.positions[None, :, :]
+        distances = numpy.sqrt(numpy.einsum('nok,nok->no', offsets, offsets))
+        new_rows, old_rows = linear_sum_assignment(distances)
+        still = distances[new_rows, old_rows] <= self.move_tolerance
+        # Obstacles that stayed within the tolerance keep the position they were painted at
+        positions[new_rows[still]] = self.positions[old_rows[still]]
+
+        boxes = []
+        for old, new in zip(self.positions[old_rows[~still]], positions[new_rows[~still]]):
+            old_box, new_box = self._window(old), self._window(new)
+            boxes.append((min(old_box[0], new_box[0]), max(old_box[1], new_box[1]),
+                          min(old_box[2], new_box[2]), max(old_box[3], new_box[3])))
+        appeared = numpy.ones(len(positions), dtype=bool)
+        appeared[new_rows] = False
+        disappeared = numpy.ones(len(self.positions), dtype=bool)
+        disappeared[old_rows] = False
+        boxes.extend(self._window(position) for position in positions[appeared])
+        boxes.extend(self._window(position) for position in self.positions[disappeared])
+
+        self.positions = positions
+        self.repainted_cells = 0
+        if len(boxes) == 0:
+            return
+        if sum((row1 - row0) * (col1 - col0) for row0, row1, col0, col1 in boxes) >= self.distance.size:
+            # Boxes would cover the field more than once, painting it once is cheaper
+            self.rebuild(self.positions)
+            return
+
+        # Every box around an old and a new disc is recomputed from the static layer and the discs reaching into it
+        rows, cols = numpy.floor((self.positions - self.origin) / self.resolution).astype(numpy.int64).T[::-1]
+        for box in boxes:
+            row0, row1, col0, col1 = box
+            self.distance[row0:row1, col0:col1] = self.static_layer[row0:row1, col0:col1]
+            self.repainted_cells += (row1 - row0) * (col1 - col0)
+            touching = (rows + self.reach >= row0) & (rows - self.reach < row1) & \
+                (cols + self.reach >= col0) & (cols - self.reach < col1)
+            for position in self.positions[touching]:
+                self._paint(position, box)
+
+    def _cell_coordinates(self, x, y):
+        # Continuous cell coordinates of the points, clamped to the centers of the outer cells
+        u = numpy.clip((numpy.asarray(x, dtype=numpy.float64) - self.origin[0]) / self.resolution - 0.5,
+                       0, self.shape[1] - 1)
+        v = numpy.clip((numpy.asarray(y, dtype=numpy.float64) - self.origin[1]) / self.resolution - 0.5,
+                       0, self.shape[0] - 1)
+        col = numpy.minimum(u.astype(numpy.int64), self.shape[1] - 2)
+        row = numpy.minimum(v.astype(numpy.int64), self.shape[0] - 2)
+        return row, col, v - row, u - col
+
+    def clearance(self, x, y, radius: float = 0.):
+        """Distance from a body of `radius` at (x, y) to the closest obstacle, for scalars or arrays of points."""
+        row, col, ty, tx = self._cell_coordinates(x, y)
+        d = self.distance
+        value = (d[row, col] * (1 - tx) + d[row, col + 1] * tx) * (1 - ty) + \
+            (d[row + 1, col] * (1 - tx) + d[row + 1, col + 1] * tx) * ty
+        return value - radius
+
+    def gradient(self, x, y) -> numpy.ndarray:
+        """Gradient of the distance at (x, y), pointing away from the closest obstacle, shaped (..., 2)."""
+        row, col, ty, tx = self._cell_coordinates(x, y)
+        d = self.distance
+        gx = (d[row, col + 1] - d[row, col]) * (1 - ty) + (d[row + 1, col + 1] - d[row + 1, col]) * ty
+        gy = (d[row + 1, col] - d[row, col]) * (1 - tx) + (d[row + 1, col + 1] - d[row, col + 1]) * tx
+        return numpy.stack((gx, gy), axis=-1) / self.resolution